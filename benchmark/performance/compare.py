@@ -0,0 +1,104 @@
+
+"""
+Compare a benchmark results file of suite.py with a baseline, flagging
+the cases that are slower, or use more memory, than the baseline by
+more than the given relative thresholds. Exits with status 1 if any
+case regressed, e.g.
+
+    python compare.py baseline.json results.json --threshold 0.2
+
+suite.py --save-baseline and the default comparison of suite.py with
+baseline.json use the same comparison.
+"""
+
+# ----------------------------------------------------------------------
+
+import sys
+import json
+import argparse
+
+from collections import OrderedDict
+
+# ----------------------------------------------------------------------
+def compare(baseline, results, threshold=0.2, memory_threshold=0.2,
+            min_time=1e-2, min_memory=2**20):
+
+    """ Returns a list of (key, status, time ratio, memory ratio) for the
+    cases in both reports. Cases faster than min_time seconds in both
+    are compared by memory only, as their timing is dominated by noise.
+    The memory is compared by the increase of the peak memory during
+    the case, if it is at least min_memory bytes in the baseline. """
+
+    base, new = baseline['results'], results['results']
+
+    rows = []
+    for key in new:
+        if key not in base or 'time' not in base[key] or 'time' not in new[key]:
+            continue
+
+        b, n = base[key], new[key]
+
+        time_ratio = None
+        if max(b['time'], n['time']) >= min_time:
+            time_ratio = n['time'] / max(b['time'], 1e-12)
+
+        memory_ratio = None
+        if b.get('memory_increase') >= min_memory and \
+           n.get('memory_increase') is not None:
+            memory_ratio = float(n['memory_increase']) / b['memory_increase']
+
+        status = 'ok'
+        if time_ratio is not None and time_ratio < 1. / (1. + threshold):
+            status = 'faster'
+        if (time_ratio is not None and time_ratio > 1. + threshold) or \
+           (memory_ratio is not None and memory_ratio > 1. + memory_threshold):
+            status = 'REGRESSION'
+
+        rows.append((key, status, time_ratio, memory_ratio))
+
+    return rows
+
+# ----------------------------------------------------------------------
+def print_comparison(rows):
+
+    """ Prints the rows of compare, returns the number of regressions. """
+
+    def fmt(ratio):
+        return '%8s' % '-' if ratio is None else '%8.2f' % ratio
+
+    print '%-60s %8s %8s  %s' % ('case', 'time', 'memory', 'status')
+    for key, status, time_ratio, memory_ratio in rows:
+        print '%-60s %s %s  %s' % (key, fmt(time_ratio), fmt(memory_ratio), status)
+
+    regressions = [ row for row in rows if row[1] == 'REGRESSION' ]
+    print '--> %i cases compared, %i regressions' % (len(rows), len(regressions))
+
+    return len(regressions)
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare pyed benchmark results')
+    parser.add_argument('baseline')
+    parser.add_argument('results')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown flagged as a regression')
+    parser.add_argument('--memory-threshold', type=float, default=0.2,
+                        help='Relative memory increase flagged as a regression')
+    parser.add_argument('--min-time', type=float, default=1e-2,
+                        help='Cases faster than this (in s) are not timed')
+    args = parser.parse_args()
+
+    def load(filename):
+        with open(filename) as fd:
+            return json.load(fd, object_pairs_hook=OrderedDict)
+
+    baseline, results = load(args.baseline), load(args.results)
+
+    if baseline['metadata'].get('platform') != results['metadata'].get('platform'):
+        print 'WARNING: Baseline from a different platform!'
+
+    rows = compare(baseline, results, threshold=args.threshold,
+                   memory_threshold=args.memory_threshold, min_time=args.min_time)
+
+    sys.exit(1 if print_comparison(rows) else 0)
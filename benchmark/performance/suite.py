@@ -0,0 +1,449 @@
+
+r"""
+Performance benchmarks of pyed on synthetic Anderson impurity and
+Hubbard ring models, timing and memory profiling the compilation of
+Triqs operator expressions (requires pytriqs, skipped otherwise), the
+construction of the sparse models, the full and sparse diagonalization, G(\tau), G(i\omega_n),
+the high frequency tails and the three- and four-point Green's functions
+G3(\tau_1, \tau_2) and G4(\tau_1, \tau_2, \tau_3).
+
+Every case is swept over the number of fermions and the number of
+imaginary times or frequencies, and is run in a separate process so
+that the peak memory of each case is measured on its own. The best of
+--repeat runs is reported, together with the per stage profile of the
+last run (see pyed.Instrumentation).
+
+Usage:
+
+    python suite.py --output results.json
+    python suite.py --quick --cases g_tau g4_tau --output results.json
+    python compare.py baseline.json results.json --threshold 0.2
+
+A baseline is a results file of a previous run on the same machine,
+the timings are machine specific and baselines are not committed.
+To check a change for regressions, save a baseline of the unchanged
+tree, then run the same cases with the change:
+
+    git stash
+    python suite.py --quick --save-baseline
+    git stash pop
+    python suite.py --quick
+
+--save-baseline writes the results to the --baseline file (by default
+baseline.json). Without it, the results are compared with the
+--baseline file if it exists, see compare.py, and the exit status is 1
+if any case regressed.
+"""
+
+# ----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import multiprocessing
+
+from Queue import Empty
+
+import numpy as np
+import scipy
+
+from collections import OrderedDict
+
+# ----------------------------------------------------------------------
+
+from pyed.SparseMatrixFockStates import SparseMatrixCreationOperators
+from pyed.SparseMatrixFockStates import SparseMatrixRepresentation
+from pyed.SparseExactDiagonalization import SparseExactDiagonalization
+from pyed.Instrumentation import Profiler, peak_memory
+
+from compare import compare, print_comparison
+
+# ----------------------------------------------------------------------
+
+beta = 10.0
+
+# ----------------------------------------------------------------------
+def anderson_model(nfermions, U=2.0, mu=1.0, V=1.0):
+
+    """ Anderson impurity with (nfermions - 2)/2 spinful bath sites,
+    with the bath levels evenly spaced in [-2, 2]. Returns the sparse
+    Hamiltonian and the annihilation and creation operators, the
+    impurity orbitals are 0 (up) and 1 (down). """
+
+    ops = SparseMatrixCreationOperators(nfermions)
+    cd = ops.c_dag
+    c = [ op.getH().tocsr() for op in cd ]
+    n = [ cd[i] * c[i] for i in xrange(nfermions) ]
+
+    H = -mu * (n[0] + n[1]) + U * n[0] * n[1]
+
+    nbath = (nfermions - 2) // 2
+    for b, eps in enumerate(np.linspace(-2., 2., nbath)):
+        for s in [0, 1]:
+            i = 2 + 2 * b + s
+            H = H + eps * n[i] + V * (cd[s] * c[i] + cd[i] * c[s])
+
+    return H.tocsr(), c, cd
+
+# ----------------------------------------------------------------------
+def hubbard_model(nfermions, U=2.0, mu=1.0, t=1.0):
+
+    """ Hubbard ring of nfermions/2 sites with periodic boundary
+    conditions, orbital 2 i + s for site i and spin s. """
+
+    ops = SparseMatrixCreationOperators(nfermions)
+    cd = ops.c_dag
+    c = [ op.getH().tocsr() for op in cd ]
+    n = [ cd[i] * c[i] for i in xrange(nfermions) ]
+
+    L = nfermions // 2
+    H = 0. * ops.I
+    for i in xrange(L):
+        H = H - mu * (n[2 * i] + n[2 * i + 1]) + U * n[2 * i] * n[2 * i + 1]
+    for i, j in _ring_bonds(L):
+        for s in [0, 1]:
+            a, b = 2 * i + s, 2 * j + s
+            H = H - t * (cd[a] * c[b] + cd[b] * c[a])
+
+    return H.tocsr(), c, cd
+
+# ----------------------------------------------------------------------
+def _ring_bonds(L):
+    return [ (i, (i + 1) % L) for i in xrange(L) ] if L > 2 else [ (0, 1) ][:L - 1]
+
+# ----------------------------------------------------------------------
+def triqs_model(model, nfermions, U=2.0, mu=1.0, V=1.0, t=1.0):
+
+    """ The model as a Triqs operator expression, with orbital i as
+    c(0,i), and the fundamental operators. Requires pytriqs. """
+
+    from pytriqs.operators import c, c_dag
+
+    n = [ c_dag(0,i) * c(0,i) for i in xrange(nfermions) ]
+
+    def hop(a, b):
+        return c_dag(0,a) * c(0,b) + c_dag(0,b) * c(0,a)
+
+    if model == 'anderson':
+        H = -mu * (n[0] + n[1]) + U * n[0] * n[1]
+        nbath = (nfermions - 2) // 2
+        for b, eps in enumerate(np.linspace(-2., 2., nbath)):
+            for s in [0, 1]:
+                i = 2 + 2 * b + s
+                H += float(eps) * n[i] + V * hop(s, i)
+    else:
+        L = nfermions // 2
+        H = 0. * n[0]
+        for i in xrange(L):
+            H += -mu * (n[2 * i] + n[2 * i + 1]) + U * n[2 * i] * n[2 * i + 1]
+        for i, j in _ring_bonds(L):
+            for s in [0, 1]:
+                H += -t * hop(2 * i + s, 2 * j + s)
+
+    return H, [ c(0,i) for i in xrange(nfermions) ]
+
+# ----------------------------------------------------------------------
+
+models = dict(anderson=anderson_model, hubbard=hubbard_model)
+
+# ----------------------------------------------------------------------
+# -- Cases, setup(profiler, model, **params) returns the timed callable
+
+def setup_operators(profiler, model, nfermions):
+
+    """ Compilation of the Triqs operator expression of the model by
+    SparseMatrixRepresentation, the expression is built in the setup. """
+
+    H, fundamental_operators = triqs_model(model, nfermions)
+
+    def run():
+        rep = SparseMatrixRepresentation(
+            fundamental_operators, profiler=profiler)
+        rep.sparse_matrix(H)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_model_construction(profiler, model, nfermions):
+
+    """ Construction of the sparse model from products of the sparse
+    creation and annihilation operators. """
+
+    def run():
+        with profiler.stage('model_construction'):
+            models[model](nfermions)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_full_diagonalization(profiler, model, nfermions):
+
+    H, c, cd = models[model](nfermions)
+
+    def run():
+        SparseExactDiagonalization(H, beta, profiler=profiler)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_sparse_diagonalization(profiler, model, nfermions, nstates=16):
+
+    H, c, cd = models[model](nfermions)
+    v0 = np.ones(H.shape[0]) / np.sqrt(H.shape[0])
+
+    def run():
+        SparseExactDiagonalization(
+            H, beta, nstates=nstates, v0=v0, profiler=profiler)
+
+    return run
+
+# ----------------------------------------------------------------------
+def _setup_ed(profiler, model, nfermions):
+
+    H, c, cd = models[model](nfermions)
+    ed = SparseExactDiagonalization(H, beta, profiler=profiler)
+    profiler.reset()
+
+    return ed, c, cd
+
+# ----------------------------------------------------------------------
+def setup_g_tau(profiler, model, nfermions, ntau):
+
+    ed, c, cd = _setup_ed(profiler, model, nfermions)
+    tau = np.linspace(0, beta, ntau)
+
+    def run():
+        ed.get_tau_greens_function_component(tau, c[0], cd[0])
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_g_iw(profiler, model, nfermions, niw):
+
+    ed, c, cd = _setup_ed(profiler, model, nfermions)
+    iwn = 1.j * np.pi * (2 * np.arange(niw) + 1) / beta
+
+    def run():
+        ed.get_frequency_greens_function_component(iwn, c[0], cd[0], -1.0)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_tail(profiler, model, nfermions):
+
+    ed, c, cd = _setup_ed(profiler, model, nfermions)
+
+    def run():
+        ed.get_high_frequency_tail_coeff_component(c[0], cd[0], -1.0, Norder=3)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_g3_tau(profiler, model, nfermions, ntau):
+
+    ed, c, cd = _setup_ed(profiler, model, nfermions)
+
+    tau = np.linspace(0, beta, ntau)
+    t1, t2 = np.meshgrid(tau, tau, indexing='ij')
+    ordered = t1 >= t2
+    taus = np.array([ t1[ordered], t2[ordered] ])
+
+    n = [ cd[i] * c[i] for i in [0, 1] ]
+    ops = [ c[0], cd[0], n[0] + n[1] ]
+
+    def run():
+        ed.get_timeordered_two_tau_greens_function(taus, ops)
+
+    return run
+
+# ----------------------------------------------------------------------
+def setup_g4_tau(profiler, model, nfermions, ntau):
+
+    ed, c, cd = _setup_ed(profiler, model, nfermions)
+    tau = np.linspace(0, beta, ntau)
+
+    def run():
+        ed.get_g2_tau(tau, [ c[0], cd[0], c[1], cd[1] ])
+
+    return run
+
+# ----------------------------------------------------------------------
+# -- Parameter grids, full and --quick
+
+cases = OrderedDict([
+    ('operators', (setup_operators,
+                   dict(nfermions=[4, 6, 8, 10, 12, 14]),
+                   dict(nfermions=[4, 8]))),
+    ('model_construction', (setup_model_construction,
+                            dict(nfermions=[4, 6, 8, 10, 12, 14]),
+                            dict(nfermions=[4, 8]))),
+    ('full_diagonalization', (setup_full_diagonalization,
+                              dict(nfermions=[4, 6, 8, 10, 12]),
+                              dict(nfermions=[4, 8]))),
+    ('sparse_diagonalization', (setup_sparse_diagonalization,
+                                dict(nfermions=[8, 10, 12, 14]),
+                                dict(nfermions=[8]))),
+    ('g_tau', (setup_g_tau,
+               dict(nfermions=[4, 6, 8, 10], ntau=[100, 1000]),
+               dict(nfermions=[4, 8], ntau=[100]))),
+    ('g_iw', (setup_g_iw,
+              dict(nfermions=[4, 6, 8, 10], niw=[100, 1000]),
+              dict(nfermions=[4, 8], niw=[100]))),
+    ('tail', (setup_tail,
+              dict(nfermions=[4, 6, 8, 10]),
+              dict(nfermions=[4, 8]))),
+    ('g3_tau', (setup_g3_tau,
+                dict(nfermions=[4, 6, 8], ntau=[20, 40, 80]),
+                dict(nfermions=[4, 6], ntau=[20]))),
+    ('g4_tau', (setup_g4_tau,
+                dict(nfermions=[4, 6, 8], ntau=[10, 20, 40]),
+                dict(nfermions=[4, 6], ntau=[10]))),
+    ])
+
+# ----------------------------------------------------------------------
+def case_key(name, model, params):
+    return '%s[%s]' % (name, ','.join(
+        ['model=%s' % model] + [ '%s=%s' % kv for kv in sorted(params.items()) ]))
+
+# ----------------------------------------------------------------------
+def _run_case(name, model, params, repeat, queue):
+
+    """ Runs one case in a child process, the result or the error
+    message is put on the queue. """
+
+    try:
+        profiler = Profiler()
+        memory_start = peak_memory()
+
+        t = time.time()
+        run = cases[name][0](profiler, model, **params)
+        setup_time = time.time() - t
+
+        times = []
+        for r in xrange(repeat):
+            profiler.reset()
+            t = time.time()
+            run()
+            times.append(time.time() - t)
+
+        memory = peak_memory()
+        result = OrderedDict([
+            ('time', min(times)),
+            ('times', times),
+            ('setup_time', setup_time),
+            ('peak_memory', memory),
+            ('memory_increase', None if memory is None else memory - memory_start),
+            ('stages', profiler.report()['stages']),
+            ])
+
+    except ImportError as e:
+        result = dict(skipped=str(e))
+    except Exception as e:
+        result = dict(error='%s: %s' % (type(e).__name__, e))
+
+    queue.put(result)
+
+# ----------------------------------------------------------------------
+def run_suite(names, model='anderson', quick=False, repeat=3,
+              nfermions=None, timeout=None):
+
+    """ Runs the cases names on their parameter grids, restricted to
+    the fermion numbers nfermions if given. Returns the report dict. """
+
+    results = OrderedDict()
+
+    for name in names:
+        setup, grid, quick_grid = cases[name]
+        grid = quick_grid if quick else grid
+
+        keys = sorted(grid.keys())
+        for values in itertools.product(*[ grid[key] for key in keys ]):
+            params = dict(zip(keys, values))
+            if nfermions is not None and params['nfermions'] not in nfermions:
+                continue
+
+            key = case_key(name, model, params)
+
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run_case, args=(name, model, params, repeat, queue))
+            process.start()
+
+            # -- Poll, the child can be killed, e.g. when out of memory
+            start, result = time.time(), None
+            while result is None:
+                try:
+                    result = queue.get(timeout=1.)
+                except Empty:
+                    if not process.is_alive():
+                        result = dict(error='Exit code %s' % process.exitcode)
+                    elif timeout is not None and time.time() - start > timeout:
+                        process.terminate()
+                        result = dict(error='Timeout after %s s' % timeout)
+            process.join()
+
+            results[key] = result
+
+            if 'time' in result:
+                print '%-60s %10.4f s %10.1f MB' % (
+                    key, result['time'], (result['peak_memory'] or 0) / 2.**20)
+            else:
+                print '%-60s %s' % (key, result.values()[0])
+            sys.stdout.flush()
+
+    metadata = OrderedDict([
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('platform', platform.platform()),
+        ('processor', platform.processor()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('scipy', scipy.__version__),
+        ('model', model),
+        ('repeat', repeat),
+        ('quick', quick),
+        ])
+
+    return OrderedDict([('metadata', metadata), ('results', results)])
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='pyed performance benchmarks')
+    parser.add_argument('--cases', nargs='+', default=list(cases.keys()),
+                        choices=list(cases.keys()))
+    parser.add_argument('--model', default='anderson', choices=sorted(models.keys()))
+    parser.add_argument('--nfermions', nargs='+', type=int, default=None)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Timeout per case in seconds')
+    parser.add_argument('--output', default='results.json')
+    parser.add_argument('--baseline', default='baseline.json',
+                        help='Baseline results file to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write the results to the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    report = run_suite(args.cases, model=args.model, quick=args.quick,
+                       repeat=args.repeat, nfermions=args.nfermions,
+                       timeout=args.timeout)
+
+    output = args.baseline if args.save_baseline else args.output
+    with open(output, 'w') as fd:
+        json.dump(report, fd, indent=2)
+
+    print '--> Results written to', output
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fd:
+            baseline = json.load(fd, object_pairs_hook=OrderedDict)
+
+        rows = compare(baseline, report, threshold=args.threshold,
+                       memory_threshold=args.threshold)
+        sys.exit(1 if print_comparison(rows) else 0)
@@ -0,0 +1,216 @@
+
+r"""
+Exact diagonalization of a batch of small Hamiltonians on the same
+Hilbert space, e.g. Hubbard atoms or few orbital clusters for many
+parameters, k-points or disorder samples, with stacked dense arrays.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+from scipy import sparse
+
+# ----------------------------------------------------------------------
+
+from Instrumentation import null_profiler
+from SparseExactDiagonalization import SparseExactDiagonalization
+
+# ----------------------------------------------------------------------
+class BatchExactDiagonalization(object):
+
+    """ Exact diagonalization of B Hamiltonians of dimension N, stored
+    as a (B, N, N) array and diagonalized by one batched eigh.
+
+    All results carry the instance as their first axis, so that the
+    result of instance b is the view result[b]. The dense stack takes
+    B N^2 floats, the batch mode is intended for small N. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, H, beta):
+
+        """ H is a list of sparse or dense matrices, or a (B, N, N) array. """
+
+        if not isinstance(H, np.ndarray):
+            H = np.array([ h.toarray() if sparse.issparse(h) else np.asarray(h)
+                           for h in H ])
+
+        assert( H.ndim == 3 and H.shape[1] == H.shape[2] )
+
+        self.H = H
+        self.beta = beta
+
+        self.E, self.U = np.linalg.eigh(H)
+        self.E0 = np.min(self.E, axis=1)
+        self.E = self.E - self.E0[:, None]
+
+        self.exp_bE = np.exp(-self.beta * self.E)
+        self.Z = np.sum(self.exp_bE, axis=1)
+
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return self.H.shape[0]
+
+    # ------------------------------------------------------------------
+    def get_instance(self, b):
+
+        """ SparseExactDiagonalization of instance b, sharing the
+        eigenvalues and eigenvectors of the batch, for the single
+        instance API, e.g. the two-particle Green's functions. """
+
+        ed = SparseExactDiagonalization.__new__(SparseExactDiagonalization)
+
+        ed.v0, ed.tol, ed.nstates, ed.hermitian = None, 0, None, True
+        ed.blocks, ed.precision = None, 'double'
+        ed.profiler, ed.plan = null_profiler, None
+
+        ed.H = sparse.csr_matrix(self.H[b])
+        ed.beta = self.beta
+
+        ed.E, ed.U = self.E[b], np.asmatrix(self.U[b])
+        ed.E0, ed.Z = self.E0[b], self.Z[b]
+        ed._calculate_density_matrix()
+
+        return ed
+
+    # ------------------------------------------------------------------
+    def get_free_energy(self):
+        return -1./self.beta * (np.log(self.Z) - self.beta * self.E0)
+    def get_partition_function(self):
+        return self.Z
+    def get_ground_state_energy(self):
+        return self.E0
+    def get_eigen_values(self):
+        return self.E
+    def get_eigen_vectors(self):
+        return self.U
+
+    # ------------------------------------------------------------------
+    def get_density_matrix(self):
+
+        w = self.exp_bE / self.Z[:, None]
+        return np.matmul(self.U * w[:, None, :], self._adjoint(self.U))
+
+    # ------------------------------------------------------------------
+    def _adjoint(self, A):
+        return np.conj(np.swapaxes(A, 1, 2))
+
+    # ------------------------------------------------------------------
+    def _apply_operator(self, op):
+
+        """ O U for all instances, with one product for the shared O. """
+
+        B, N, _ = self.U.shape
+
+        U_flat = self.U.transpose(1, 0, 2).reshape(N, B * N)
+        OU = op.dot(U_flat) if sparse.issparse(op) else np.dot(op, U_flat)
+
+        return np.asarray(OU).reshape(N, B, N).transpose(1, 0, 2)
+
+    # ------------------------------------------------------------------
+    def _operators_to_eigenbasis(self, op_vec):
+
+        UH = self._adjoint(self.U)
+        return [ np.matmul(UH, self._apply_operator(op)) for op in op_vec ]
+
+    # ------------------------------------------------------------------
+    def get_expectation_value(self, operator):
+
+        diag = np.einsum('bin,bin->bn', np.conj(self.U),
+                         self._apply_operator(operator))
+
+        return np.sum(diag * self.exp_bE, axis=1) / self.Z
+
+    # ------------------------------------------------------------------
+    def _get_lehmann_terms(self, op1, op2):
+
+        """ O_1[n, m] O_2[m, n] for all instances, (B, N, N). """
+
+        op1_eig, op2_eig = self._operators_to_eigenbasis([op1, op2])
+        return op1_eig * np.swapaxes(op2_eig, 1, 2)
+
+    # ------------------------------------------------------------------
+    def get_tau_greens_function_component(self, tau, op1, op2):
+
+        r"""
+        Returns:
+        G^{(2)}(\tau) = -1/Z < O_1(\tau) O_2(0) >, (B, len(tau))
+        """
+
+        M = self._get_lehmann_terms(op1, op2)
+
+        tau = np.asarray(tau).real
+        et_p = np.exp((-self.beta + tau[None, :, None]) * self.E[:, None, :])
+        et_m = np.exp(-tau[None, :, None] * self.E[:, None, :])
+
+        G = -np.sum(np.matmul(et_p, M) * et_m, axis=2)
+
+        G /= self.Z[:, None]
+        return G
+
+    # ------------------------------------------------------------------
+    def _get_frequency_poles(self, op1, op2, xi, tol=1e-12):
+
+        r""" Poles E_m - E_n and residues
+        O_1[n, m] O_2[m, n] (e^{-\beta E_n} - \xi e^{-\beta E_m}),
+        times Z, for all instances, (B, N^2). Poles within tol of zero
+        are set to zero. """
+
+        B, N = self.E.shape
+
+        residues = self._get_lehmann_terms(op1, op2) * \
+            (self.exp_bE[:, :, None] - xi * self.exp_bE[:, None, :])
+        poles = self.E[:, None, :] - self.E[:, :, None]
+        poles[np.abs(poles) < tol] = 0.
+
+        return poles.reshape(B, N * N), residues.reshape(B, N * N)
+
+    # ------------------------------------------------------------------
+    def get_frequency_greens_function_component(self, iwn, op1, op2, xi,
+                                                chunk_size=None):
+
+        r"""
+        Returns:
+        G^{(2)}(i\omega_n) = -1/Z < O_1(i\omega_n) O_2(-i\omega_n) >, (B, len(iwn))
+
+        evaluated in chunks of chunk_size frequencies. Terms with vanishing
+        denominator are skipped.
+        """
+
+        poles, residues = self._get_frequency_poles(op1, op2, xi)
+
+        iwn = np.asarray(iwn)
+        B, P = poles.shape
+        if chunk_size is None: chunk_size = max(1, 2**22 // (B * P))
+
+        G = np.zeros((B, len(iwn)), dtype=np.complex)
+        for start in xrange(0, len(iwn), chunk_size):
+            chunk = slice(start, start + chunk_size)
+
+            inv_freq = iwn[None, chunk, None] - poles[:, None, :]
+            # -- Only eval for non-zero values
+            nonzero = inv_freq != 0
+            freq = np.zeros_like(inv_freq)
+            freq[nonzero] = inv_freq[nonzero]**(-1)
+
+            G[:, chunk] = np.einsum('bwp,bp->bw', freq, residues)
+
+        G /= self.Z[:, None]
+        return G
+
+    # ------------------------------------------------------------------
+    def get_high_frequency_tail_coeff_component(self, op1, op2, xi, Norder=3):
+
+        r""" High frequency tail coefficients, the moments
+        \sum_{nm} (E_m - E_n)^k O_1[n, m] O_2[m, n] (e^{-\beta E_n} - \xi e^{-\beta E_m}) / Z
+        for k = 0, ..., Norder - 1, (B, Norder). """
+
+        poles, residues = self._get_frequency_poles(op1, op2, xi)
+
+        moments = poles[:, None, :]**np.arange(Norder)[None, :, None]
+        tail = np.einsum('bkp,bp->bk', moments, residues)
+
+        tail /= self.Z[:, None]
+        return tail
+
+# ----------------------------------------------------------------------
@@ -0,0 +1,111 @@
+
+"""
+Streaming and checkpointed two-particle Green's function calculation
+in imaginary time, written slab by slab to a chunked HDF5 dataset.
+"""
+
+# ----------------------------------------------------------------------
+
+import hashlib
+import itertools
+import numpy as np
+
+# ----------------------------------------------------------------------
+def operator_hash(ops):
+
+    """ Hash of a list of sparse matrices identifying the operators. """
+
+    sha = hashlib.sha1()
+    for op in ops:
+        op = op.tocsr()
+        for array in [op.indptr, op.indices, op.data]:
+            sha.update(np.ascontiguousarray(array).tostring())
+
+    return sha.hexdigest()
+
+# ----------------------------------------------------------------------
+def write_g4_tau_hdf5(ed, filename, tau, ops, slab=1,
+                      name='g4_tau', compression='gzip', max_slabs=None):
+
+    """ Compute G(t1, t2, t3) = < O1(t1) O2(t2) O3(t3) O4(0) > on the
+    cube tau x tau x tau and stream it to the HDF5 file filename.
+
+    The cube is computed in slabs of slab t1 indices. Each finished
+    slab is written to the chunked and compressed dataset name and
+    marked in the progress manifest name + '_done' before the next one
+    is started, so only one slab is held in memory. Calling the function
+    again with the same arguments resumes after the last finished slab.
+    With max_slabs at most max_slabs slabs are computed in this call,
+    e.g. to stay within the time limit of a batch job.
+
+    ed is a SparseExactDiagonalization and ops are sparse matrices.
+    Returns the number of slabs computed in this call. """
+
+    import h5py
+
+    tau = np.asarray(tau, dtype=np.float)
+    ntau = len(tau)
+    nslabs = (ntau + slab - 1) // slab
+
+    fingerprint = np.array([ed.beta, ed.E0, ed.Z, ntau, slab])
+    ops_hash = operator_hash(ops)
+
+    with h5py.File(filename, 'a') as f:
+
+        if name in f:
+            dset, done = f[name], f[name + '_done']
+            if not np.allclose(dset.attrs['fingerprint'], fingerprint) or \
+               dset.attrs['tau'].shape != tau.shape or \
+               not np.allclose(dset.attrs['tau'], tau) or \
+               dset.attrs['operators'] != ops_hash:
+                raise ValueError(
+                    'ERROR: %s in %s belongs to another calculation' % (name, filename))
+        else:
+            dset = f.create_dataset(
+                name, shape=(ntau, ntau, ntau), dtype=np.complex,
+                chunks=(slab, ntau, ntau), compression=compression)
+            dset.attrs['fingerprint'] = fingerprint
+            dset.attrs['tau'] = tau
+            dset.attrs['operators'] = ops_hash
+            done = f.create_dataset(
+                name + '_done', data=np.zeros((nslabs), dtype=np.bool))
+            f.flush()
+
+        # -- Eigenbasis operators, shared by all slabs
+        dops = None
+        if not np.all(done[:]): dops = ed._operators_to_eigenbasis(ops)
+
+        computed = 0
+        for sidx in xrange(nslabs):
+            if done[sidx]: continue
+            if max_slabs is not None and computed >= max_slabs: break
+
+            i1 = np.arange(sidx * slab, min((sidx + 1) * slab, ntau))
+            idx = np.array(list(itertools.product(i1, range(ntau), range(ntau))))
+
+            G = ed.get_g2_tau_points(tau[idx], ops, dops=dops)
+
+            dset[i1[0]:i1[-1]+1] = G.reshape((len(i1), ntau, ntau))
+            f.flush()
+            done[sidx] = True
+            f.flush()
+
+            computed += 1
+
+    return computed
+
+# ----------------------------------------------------------------------
+def read_g4_tau_hdf5(filename, name='g4_tau'):
+
+    """ Read a complete imaginary time cube written by write_g4_tau_hdf5,
+    returns tau and G. """
+
+    import h5py
+
+    with h5py.File(filename, 'r') as f:
+        if not np.all(f[name + '_done'][:]):
+            raise ValueError(
+                'ERROR: %s in %s is incomplete, resume the calculation' % (name, filename))
+        return f[name].attrs['tau'], f[name][:]
+
+# ----------------------------------------------------------------------
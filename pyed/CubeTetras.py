@@ -11,6 +11,8 @@ Author: Hugo U. R. Strand (2017), hugo.strand@gmail.com
 import itertools
 import numpy as np
 
+from scipy.special import roots_jacobi
+
 # ----------------------------------------------------------------------
 def zero_outer_planes_and_equal_times(g4_tau):
 
@@ -60,6 +62,73 @@ class CubeTetrasBase(object):
         
         return tetra_list
 
+    def get_tetra_classes(self, op_keys):
+
+        """ Group the tetrahedrons in classes with equal time ordered
+        operator strings.
+
+        op_keys are four operator identifiers, equal for equal operators.
+        The tetrahedrons in a class evaluate the same time ordered
+        Green's function on their sorted times and differ only by
+        the permutation sign.
+
+        Only the relations by equal operators are detected. Tetrahedrons
+        related by complex conjugation, i.e. by the Hermitian conjugate
+        operator string on the reversed times, or by symmetries of the
+        Hamiltonian such as spin flip, are in separate classes. """
+
+        classes, class_keys = [], []
+
+        for tidx, (func, perm, perm_sign) in enumerate(self.get_tetra_list()):
+            key = tuple([ op_keys[i] for i in perm + [3] ])
+            if key in class_keys:
+                classes[class_keys.index(key)].append(tidx)
+            else:
+                class_keys.append(key)
+                classes.append([tidx])
+
+        return classes
+
+# ----------------------------------------------------------------------
+def ordered_index_tau3(ntau):
+
+    """ Indices (3, n) of all time ordered points i1 >= i2 >= i3 in the
+    imaginary time cube, in increasing raveled index order. These are
+    the sorted times of the points in all tetrahedrons. """
+
+    i1, i2, i3 = np.meshgrid(*[np.arange(ntau)]*3, indexing='ij')
+    mask = np.logical_and(i1 >= i2, i2 >= i3)
+    return np.array([i1[mask], i2[mask], i3[mask]])
+
+# ----------------------------------------------------------------------
+def ordered_gauss_tau3(n, beta):
+
+    """ Gauss quadrature rule with n**3 points inside the time ordered
+    tetrahedron beta > t1 > t2 > t3 > 0, returns the times (3, n**3)
+    and the weights.
+
+    In the collapsed coordinates t1 = beta y1, t2 = t1 y2, t3 = t2 y3
+    with the Jacobian beta**3 y1**2 y2, the rule is the product of
+    Gauss-Jacobi rules in y1 and y2 and a Gauss-Legendre rule in y3,
+    exact for polynomials of degree 2 n - 1 in the times. """
+
+    # -- Nodes and weights on [0, 1] for the weights y**2, y and 1
+    rules = []
+    for k in [2, 1, 0]:
+        x, w = roots_jacobi(n, 0., k)
+        rules.append(((1. + x) / 2., w / 2.**(k + 1)))
+
+    y1, y2, y3 = [ y.flatten() for y in np.meshgrid(
+        *[ rule[0] for rule in rules ], indexing='ij') ]
+    w1, w2, w3 = [ w.flatten() for w in np.meshgrid(
+        *[ rule[1] for rule in rules ], indexing='ij') ]
+
+    t1 = beta * y1
+    t2 = t1 * y2
+    t3 = t2 * y3
+
+    return np.array([t1, t2, t3]), beta**3 * w1 * w2 * w3
+
 # ----------------------------------------------------------------------
 class CubeTetras(CubeTetrasBase):
 
@@ -0,0 +1,79 @@
+
+"""
+Divided differences of the exponential function, used for the
+analytic imaginary time integrals of the Lehmann representation.
+
+The integral of exp(\sum_k a_k x_k) over the simplex a_k >= 0,
+\sum_k a_k = \beta is the divided difference e^{\beta x}[x_0, ..., x_n]
+(Hermite-Genocchi), which also covers all confluent (degenerate) cases.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+from scipy.special import factorial
+
+# ----------------------------------------------------------------------
+def exp_divided_difference(z, radius=1.0, order=20):
+
+    r""" Divided difference e^{z}[z_0, ..., z_n] of the exponential.
+
+    z has shape (n+1, ...) and the divided differences are evaluated
+    elementwise over the trailing axes.
+
+    Nodes within radius of their mean c are evaluated with the series
+
+    e^{z}[z_0, ..., z_n] = e^c \sum_m h_m(z_0 - c, ..., z_n - c) / (n + m)!
+
+    where h_m are the complete homogeneous symmetric polynomials, which
+    is exact for confluent nodes and free of cancellation for nearly
+    degenerate ones. Other nodes are reduced by the recursion
+    (e^{z}[z_1, ..., z_n] - e^{z}[z_0, ..., z_{n-1}]) / (z_n - z_0)
+    with z_n the node furthest from z_0, so that |z_n - z_0| > radius/2.
+
+    For e^{\beta x}[x_0, ..., x_n] use \beta^n e^{z}[\beta x_0, ..., \beta x_n]. """
+
+    z = np.asarray(z, dtype=np.complex)
+    n = z.shape[0] - 1
+
+    if n == 0:
+        return np.exp(z[0])
+
+    dd = np.empty(z.shape[1:], dtype=np.complex)
+
+    # -- Series for clustered nodes
+
+    c = np.mean(z, axis=0)
+    w = z - c[None, ...]
+    series = np.max(np.abs(w), axis=0) <= radius
+
+    if np.any(series):
+        w_s = w[:, series]
+        h = np.zeros((order + 1,) + w_s.shape[1:], dtype=np.complex)
+        h[0] = 1.0
+        for w_k in w_s:
+            for m in xrange(1, order + 1):
+                h[m] += w_k * h[m - 1]
+
+        coeff = 1. / factorial(np.arange(n, n + order + 1), exact=False)
+        dd[series] = np.exp(c[series]) * np.tensordot(coeff, h, axes=(0, 0))
+
+    # -- Recursion for spread out nodes
+
+    if not np.all(series):
+        z_r = z[:, ~series]
+
+        # -- Put the node furthest from z_0 last, the result is symmetric
+        m = np.argmax(np.abs(z_r - z_r[0][None, ...]), axis=0)
+        z_m = np.choose(m, z_r)
+        z_r[m, np.arange(z_r.shape[1])] = z_r[-1]
+        z_r[-1] = z_m
+
+        dd[~series] = (exp_divided_difference(z_r[1:], radius, order) -
+                       exp_divided_difference(z_r[:-1], radius, order)) / \
+                       (z_r[-1] - z_r[0])
+
+    return dd
+
+# ----------------------------------------------------------------------
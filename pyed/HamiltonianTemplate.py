@@ -0,0 +1,129 @@
+
+r"""
+Parametrized Hamiltonians H(\lambda) = \sum_k \lambda_k h_k with the
+terms h_k compiled once to sparse matrices on a shared sparsity pattern,
+and a process pool executor for parameter grids.
+"""
+
+# ----------------------------------------------------------------------
+
+import multiprocessing
+import numpy as np
+
+from scipy import sparse
+
+# ----------------------------------------------------------------------
+
+from SparseMatrixFockStates import SparseMatrixRepresentation
+
+# ----------------------------------------------------------------------
+class HamiltonianTemplate(object):
+
+    r""" Hamiltonian template H(\lambda) = \sum_k \lambda_k h_k.
+
+    terms is a list of (name, h_k) with h_k a Triqs operator expression,
+    compiled using fundamental_operators, or a scipy sparse matrix.
+
+    All terms are stored as data arrays on the union of their sparsity
+    patterns, so that H(\lambda) is assembled by a single product of the
+    coefficients with the data arrays. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, terms, fundamental_operators=None):
+
+        self.names = [ name for name, h in terms ]
+        assert( len(set(self.names)) == len(self.names) ), \
+            "ERROR: Repeated term names in Hamiltonian template!"
+
+        rep = None
+        if fundamental_operators is not None:
+            rep = SparseMatrixRepresentation(fundamental_operators)
+
+        mats = []
+        for name, h in terms:
+            if not sparse.issparse(h):
+                assert( rep is not None ), \
+                    "ERROR: fundamental_operators needed for operator expressions!"
+                h = rep.sparse_matrix(h)
+            mats.append(sparse.coo_matrix(h))
+
+        self.shape = mats[0].shape
+        for mat in mats: assert( mat.shape == self.shape )
+
+        # -- Shared sparsity pattern in CSR order
+
+        keys = [ np.ravel_multi_index((mat.row, mat.col), self.shape) for mat in mats ]
+        pattern = np.unique(np.concatenate(keys))
+        rows, self.indices = np.unravel_index(pattern, self.shape)
+
+        self.indptr = np.zeros((self.shape[0] + 1), dtype=np.int)
+        np.cumsum(np.bincount(rows, minlength=self.shape[0]), out=self.indptr[1:])
+
+        # -- Term data arrays on the shared pattern
+
+        dtype = np.result_type(*[ mat.dtype for mat in mats ])
+        self.data = np.zeros((len(mats), len(pattern)), dtype=dtype)
+        for term_data, mat, key in zip(self.data, mats, keys):
+            np.add.at(term_data, np.searchsorted(pattern, key), mat.data)
+
+    # ------------------------------------------------------------------
+    def coefficients(self, params):
+
+        """ Coefficient vector from a dict {name : value}, or from a
+        sequence in the order of the terms. """
+
+        if isinstance(params, dict):
+            return np.array([ params[name] for name in self.names ])
+
+        params = np.asarray(params)
+        assert( params.shape == (len(self.names),) )
+        return params
+
+    # ------------------------------------------------------------------
+    def sparse_matrix(self, params):
+
+        r""" The Hamiltonian H(\lambda) as a CSR matrix, with its own
+        copy of the sparsity pattern of the template, so that in place
+        operations on the matrix do not modify the template. """
+
+        data = np.dot(self.coefficients(params), self.data)
+
+        return sparse.csr_matrix(
+            (data, self.indices, self.indptr), shape=self.shape, copy=True)
+
+# ----------------------------------------------------------------------
+
+_grid_template, _grid_func = None, None
+
+def _grid_initializer(template, func):
+    global _grid_template, _grid_func
+    _grid_template, _grid_func = template, func
+
+def _grid_point(params):
+    return _grid_func(_grid_template.sparse_matrix(params), params)
+
+# ----------------------------------------------------------------------
+def run_grid(template, grid, func, processes=None):
+
+    """ Evaluate func(H, params) for all params in grid, with
+    H = template.sparse_matrix(params), on a pool of processes.
+
+    func has to be a module level function. The template is passed
+    to every worker once. With processes=1 the grid is evaluated in
+    the calling process. Returns the results in the order of grid. """
+
+    if processes == 1:
+        return [ func(template.sparse_matrix(params), params) for params in grid ]
+
+    pool = multiprocessing.Pool(
+        processes, initializer=_grid_initializer, initargs=(template, func))
+
+    try:
+        results = pool.map(_grid_point, grid)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+# ----------------------------------------------------------------------
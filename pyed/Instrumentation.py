@@ -0,0 +1,169 @@
+
+"""
+Per stage instrumentation of the exact diagonalization solvers, with
+timers, counters (e.g. nominal FLOPs and array elements), the increase
+of the peak memory, callbacks and a JSON report.
+
+Solvers take a profiler and wrap their stages in profiler.stage(name),
+the default NullProfiler does nothing at the cost of a method call.
+"""
+
+# ----------------------------------------------------------------------
+
+import json
+import time
+
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ----------------------------------------------------------------------
+def peak_memory():
+
+    """ Peak resident memory of the process in bytes, None if unknown. """
+
+    if resource is None: return None
+    # -- ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# ----------------------------------------------------------------------
+class _Stage(object):
+
+    """ Context manager timing one stage call of a Profiler. """
+
+    def __init__(self, profiler, name, counters):
+        self.profiler, self.name, self.counters = profiler, name, counters
+
+    def __enter__(self):
+        self.memory = peak_memory()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.time() - self.start
+        memory = peak_memory()
+        memory_increase = None if memory is None else memory - self.memory
+        self.profiler.record(
+            self.name, elapsed, memory_increase=memory_increase, **self.counters)
+        return False
+
+# ----------------------------------------------------------------------
+class Profiler(object):
+
+    """ Aggregated timers and counters per stage.
+
+    with profiler.stage('diagonalization', flops=9*N**3):
+        ...
+
+    records the call count, the total and maximal wall time, the sum of
+    each counter and the largest increase of the peak memory of the
+    process during a call. The peak memory is a high-water mark, so the
+    increase is the memory of the stage beyond the earlier peak, zero
+    for stages fitting below it. Every record calls
+    callback(name, elapsed, counters) for all callbacks. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, callbacks=None):
+
+        self.enabled = True
+        self.callbacks = list(callbacks or [])
+        self.stages = OrderedDict()
+
+    # ------------------------------------------------------------------
+    def stage(self, name, **counters):
+        return _Stage(self, name, counters)
+
+    # ------------------------------------------------------------------
+    def count(self, name, **counters):
+
+        """ Add counters to a stage without timing it. """
+
+        self.record(name, 0., calls=0, **counters)
+
+    # ------------------------------------------------------------------
+    def record(self, name, elapsed, calls=1, memory_increase=None, **counters):
+
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = OrderedDict([('calls', 0), ('time', 0.), ('max_time', 0.),
+                                 ('memory_increase', None)])
+            self.stages[name] = stage
+
+        stage['calls'] += calls
+        stage['time'] += elapsed
+        stage['max_time'] = max(stage['max_time'], elapsed)
+        if memory_increase is not None:
+            stage['memory_increase'] = max(stage['memory_increase'], memory_increase)
+
+        for key, value in counters.items():
+            stage[key] = stage.get(key, 0) + value
+
+        for callback in self.callbacks:
+            callback(name, elapsed, counters)
+
+    # ------------------------------------------------------------------
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    # ------------------------------------------------------------------
+    def reset(self):
+        self.stages = OrderedDict()
+
+    # ------------------------------------------------------------------
+    def report(self):
+
+        """ Report dictionary with the stages in order of first use. """
+
+        return OrderedDict([
+            ('total_time', sum([ s['time'] for s in self.stages.values() ])),
+            ('peak_memory', peak_memory()),
+            ('stages', self.stages),
+            ])
+
+    # ------------------------------------------------------------------
+    def to_json(self, filename=None, indent=2):
+
+        """ JSON report, written to filename if given. """
+
+        text = json.dumps(self.report(), indent=indent)
+
+        if filename is not None:
+            with open(filename, 'w') as fd:
+                fd.write(text)
+
+        return text
+
+# ----------------------------------------------------------------------
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+# ----------------------------------------------------------------------
+class NullProfiler(object):
+
+    """ Disabled profiler, all stages share one no-op context manager. """
+
+    enabled = False
+    _null_stage = _NullStage()
+
+    def stage(self, name, **counters):
+        return self._null_stage
+
+    def count(self, name, **counters):
+        pass
+
+    def report(self):
+        return OrderedDict()
+
+# ----------------------------------------------------------------------
+
+null_profiler = NullProfiler()
+
+# ----------------------------------------------------------------------
@@ -0,0 +1,234 @@
+
+r"""
+Fourier transform of multi time imaginary time Green's functions on
+uniform meshes, e.g. the G3 square and the G4 cube, to Matsubara
+frequencies
+
+G(i\omega_1, ..., i\omega_d) = \int_0^\beta d\tau_1 ... d\tau_d
+    e^{i(\omega_1 \tau_1 + ... + \omega_d \tau_d)} G(\tau_1, ..., \tau_d)
+
+The transform is taken axis by axis, integrating the piecewise linear
+interpolation of G exactly. The sums over the mesh are FFTs, or GEMMs
+for the slabs of the first axis, weighted by the attenuation factors of
+the linear interpolation, with endpoint corrections at \tau = 0, \beta. G jumps at the equal time planes
+\tau_i = \tau_j, where the mesh values are one sided. On every line the
+jumps are corrected by the one sided limits, extrapolated from the
+neighbouring points within the same time ordering (tetrahedron).
+
+The error is O(h^2) in the mesh spacing h for |\omega| h << 1, i.e. the
+number of frequencies should be well below the number of times.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+def _attenuation_factors(theta):
+
+    r""" Attenuation factors of the piecewise linear interpolation,
+    W(\theta) = 2 (1 - \cos \theta) / \theta^2 for the full hat function
+    and \alpha(\theta) = \int_0^1 du e^{i \theta u} (1 - u) for its right
+    half, returns W, \alpha(\theta), \alpha(-\theta). """
+
+    theta = np.asarray(theta, dtype=np.float)
+    small = np.abs(theta) < 1e-3
+    t = np.where(small, 1., theta)
+
+    W = np.where(small, 1. - theta**2 / 12., 2. * (1. - np.cos(t)) / t**2)
+
+    def alpha(t, theta):
+        series = 0.5 + 1.j * theta / 6. - theta**2 / 24.
+        return np.where(small, series, (1. + 1.j * t - np.exp(1.j * t)) / t**2)
+
+    return W, alpha(t, theta), alpha(-t, -theta)
+
+# ----------------------------------------------------------------------
+def _one_sided_limits(g, J, splits):
+
+    """ Left and right limits of the lines g (n, L) at the jump indices
+    J (L,), linearly extrapolated from the segment between the
+    neighbouring split points. Segments with one interior point give the
+    constant extrapolation, segments without interior points the mesh
+    value itself. """
+
+    N = g.shape[0] - 1
+    cols = np.arange(g.shape[1])
+
+    a = np.zeros_like(J)
+    b = N * np.ones_like(J)
+    for s in splits:
+        a = np.where((s < J) & (s > a), s, a)
+        b = np.where((s > J) & (s < b), s, b)
+
+    def value(idx):
+        return g[np.clip(idx, 0, N), cols]
+
+    g_J = value(J)
+
+    dl, dr = J - a, b - J
+
+    g_minus = np.where(dl >= 3, 2 * value(J - 1) - value(J - 2),
+                       np.where(dl == 2, value(J - 1), g_J))
+    g_plus = np.where(dr >= 3, 2 * value(J + 1) - value(J + 2),
+                      np.where(dr == 2, value(J + 1), g_J))
+
+    return g_minus, g_plus
+
+# ----------------------------------------------------------------------
+def _transform_axis(g, beta, w, axis, ntimes, direct=False):
+
+    r""" Transform the time axis of g to the real frequencies w, the
+    axes before axis are frequencies and the time axes after axis give
+    the jumps at \tau_{axis} = \tau_b. The mesh sums are FFTs, or with
+    direct a GEMM with the phases of the frequencies w only, e.g. for a
+    slab of frequencies, without an intermediate of the size of g. """
+
+    g = np.moveaxis(g, axis, 0)
+    shape = g.shape[1:]
+
+    n = g.shape[0]
+    N, h = n - 1, beta / (n - 1.)
+    lines = g.reshape(n, -1)
+
+    # -- Mesh sums, by FFT with \omega = \pi (2 k + \zeta) / \beta
+
+    m = np.rint(w * beta / np.pi).astype(np.int)
+    assert( np.allclose(m * np.pi / beta, w) ), \
+        "ERROR: Frequencies are not Matsubara frequencies!"
+
+    zeta = m % 2
+    k = (m - zeta) // 2
+    sign = 1 - 2 * zeta
+
+    if direct:
+        S = np.dot(np.exp(1.j * h * w[:, None] * np.arange(N)[None, :]), lines[:N])
+    else:
+        S = np.zeros((len(w), lines.shape[1]), dtype=np.complex)
+        for z in np.unique(zeta):
+            twiddle = np.exp(1.j * np.pi * z * np.arange(N) / N)
+            spectrum = N * np.fft.ifft(lines[:N] * twiddle[:, None], axis=0)
+            rows = (zeta == z)
+            S[rows] = spectrum[k[rows] % N]
+    S += sign[:, None] * lines[N][None, :]
+
+    # -- Attenuation and endpoint corrections
+
+    W, alpha_p, alpha_m = _attenuation_factors(w * h)
+
+    G = W[:, None] * S - alpha_m[:, None] * lines[0][None, :] \
+        - (sign * alpha_p)[:, None] * lines[N][None, :]
+
+    # -- Jumps at the equal time planes with the later time axes
+
+    grids = np.indices(shape)[axis:ntimes - 1]
+    jumps = [ grid.ravel() for grid in grids ]
+
+    for jidx, J in enumerate(jumps):
+
+        g_minus, g_plus = _one_sided_limits(
+            lines, J, jumps[:jidx] + jumps[jidx + 1:])
+
+        g_J = lines[J, np.arange(lines.shape[1])]
+        d_plus, d_minus = g_plus - g_J, g_minus - g_J
+
+        # -- Coinciding jumps are corrected once
+        for J_prev in jumps[:jidx]:
+            d_plus = np.where(J_prev == J, 0., d_plus)
+            d_minus = np.where(J_prev == J, 0., d_minus)
+
+        phase = np.exp(1.j * h * w[:, None] * J[None, :])
+        G += phase * (alpha_p[:, None] * d_plus[None, :] +
+                      alpha_m[:, None] * d_minus[None, :])
+
+    G *= h
+
+    return np.moveaxis(G.reshape((len(w),) + shape), 0, axis)
+
+# ----------------------------------------------------------------------
+def tau_to_iw(g, beta, iws, out=None, slab_size=None):
+
+    r""" Transform g(\tau_1, ..., \tau_d, ...) on the uniform mesh
+    \tau = linspace(0, \beta, n) in the first d = len(iws) axes to
+
+    G(i\omega_1, ..., i\omega_d, ...) = \int_0^\beta d\tau_1 ... d\tau_d
+        e^{i(\omega_1 \tau_1 + ... + \omega_d \tau_d)} g(\tau_1, ..., \tau_d, ...)
+
+    iws is a list of arrays of Matsubara frequencies i\omega, with signs,
+    trailing axes of g are target indices. The first frequency axis is
+    processed in slabs of slab_size frequencies, written to out. The
+    first axis is summed directly for the frequencies of the slab, so
+    apart from g and out only one slab is held in memory, the other
+    axes are transformed by FFTs. """
+
+    g = np.asarray(g)
+    ntimes = len(iws)
+    ws = [ np.imag(iw) for iw in iws ]
+
+    n = g.shape[0]
+    for axis in xrange(ntimes): assert( g.shape[axis] == n )
+
+    shape = tuple([ len(w) for w in ws ]) + g.shape[ntimes:]
+    if out is None: out = np.zeros(shape, dtype=np.complex)
+    assert( out.shape == shape )
+
+    if slab_size is None:
+        size = max([n] + [ len(w) for w in ws ])**(ntimes - 1) * \
+               int(np.prod(g.shape[ntimes:]))
+        slab_size = max(1, 2**22 // size)
+
+    for start in xrange(0, len(ws[0]), slab_size):
+        slab = slice(start, start + slab_size)
+        G = _transform_axis(g, beta, ws[0][slab], 0, ntimes, direct=True)
+        for axis in xrange(1, ntimes):
+            G = _transform_axis(G, beta, ws[axis], axis, ntimes)
+        out[slab] = G
+
+    return out
+
+# ----------------------------------------------------------------------
+def _mesh_frequencies(g_iw, g_tau):
+
+    from pytriqs.gf import MeshImTime, MeshImFreq
+
+    for mesh in g_tau.mesh.components:
+        assert( type(mesh) == MeshImTime )
+        tau = np.array([ t.real for t in mesh ])
+        assert( np.allclose(tau, np.linspace(0, mesh.beta, len(tau))) )
+
+    for mesh in g_iw.mesh.components:
+        assert( type(mesh) == MeshImFreq )
+        assert( mesh.beta == g_tau.mesh.components[0].beta )
+
+    return [ np.array([ w for w in mesh ]) for mesh in g_iw.mesh.components ]
+
+# ----------------------------------------------------------------------
+def set_g3_iw_from_tau(g3_iw, g3_tau, slab_size=None):
+
+    r""" G^{(3)}(i\nu_1, i\nu_2) = \int_0^\beta d\tau_1 d\tau_2
+        e^{i\nu_1 \tau_1 - i\nu_2 \tau_2} G^{(3)}(\tau_1, \tau_2)
+
+    from g3_tau on a uniform imaginary time product mesh. """
+
+    iw1, iw2 = _mesh_frequencies(g3_iw, g3_tau)
+    beta = g3_tau.mesh.components[0].beta
+
+    tau_to_iw(g3_tau.data, beta, [iw1, -iw2],
+              out=g3_iw.data, slab_size=slab_size)
+
+# ----------------------------------------------------------------------
+def set_g4_iw_from_tau(g4_iw, g4_tau, slab_size=None):
+
+    r""" G^{(4)}(i\nu_1, i\nu_2, i\nu_3) = \int_0^\beta d\tau_1 d\tau_2 d\tau_3
+        e^{i\nu_1 \tau_1 - i\nu_2 \tau_2 + i\nu_3 \tau_3} G^{(4)}(\tau_1, \tau_2, \tau_3)
+
+    from g4_tau on a uniform imaginary time product mesh, with the
+    convention of TriqsExactDiagonalization.set_g4_iw. """
+
+    iw1, iw2, iw3 = _mesh_frequencies(g4_iw, g4_tau)
+    beta = g4_tau.mesh.components[0].beta
+
+    tau_to_iw(g4_tau.data, beta, [iw1, -iw2, iw3],
+              out=g4_iw.data, slab_size=slab_size)
+
+# ----------------------------------------------------------------------
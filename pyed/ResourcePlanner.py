@@ -0,0 +1,353 @@
+
+r"""
+Resource planning for the exact diagonalization solvers, estimating the
+memory and the floating point operations of the diagonalization, the
+eigenbasis operators and the Green's function kernels before a
+calculation is started, and choosing an execution strategy (symmetry
+sectors, truncated spectrum, chunk sizes and worker processes) that
+fits a memory and time budget.
+
+The estimates are upper bounds of the dominant arrays and nominal FLOP
+counts, the time estimate assumes a sustained flop_rate. The resulting
+ExecutionPlan is passed to the solvers, e.g.
+
+    plan = plan_execution(fundamental_operators, H.nnz, beta, ntau_g4=40,
+                          memory_budget=16 * 2**30)
+    print plan.summary()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta, plan=plan)
+"""
+
+# ----------------------------------------------------------------------
+
+import os
+import multiprocessing
+import numpy as np
+
+from collections import OrderedDict
+from scipy.special import comb
+
+# ----------------------------------------------------------------------
+
+from SparseExactDiagonalization import SparseExactDiagonalization
+
+# ----------------------------------------------------------------------
+def physical_memory():
+
+    """ Physical memory of the machine in bytes, None if unknown. """
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+# ----------------------------------------------------------------------
+class ExecutionPlan(object):
+
+    """ Execution strategy and cost estimates from plan_execution.
+
+    The strategy is given by nstates (None for the full spectrum),
+    use_sectors with the sector charges, precision, the chunk sizes of
+    the kernels 'g2_iw', 'g3_tau', 'g4_tau' and 'krylov' (and, if set by
+    hand, 'chi_tau' and 'chi_iw' of the susceptibilities and 'g4_legendre'
+    of the Legendre two-particle Green's function) and the number
+    of worker processes for parameter grids, see
+    HamiltonianTemplate.run_grid. estimates holds the memory (bytes),
+    flops and time (s) of every stage. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, nfermions, beta):
+
+        self.nfermions = nfermions
+        self.dimension = 2**nfermions
+        self.beta = beta
+
+        self.nstates = None
+        self.use_sectors = False
+        self.charges = None
+        self.precision = 'double'
+        self.chunk_sizes = {}
+        self.processes = 1
+
+        self.memory_budget = None
+        self.time_budget = None
+        self.estimates = OrderedDict()
+        self.notes = []
+
+    # ------------------------------------------------------------------
+    def add_estimate(self, stage, memory=0, flops=0, flop_rate=1e10):
+        self.estimates[stage] = OrderedDict([
+            ('memory', int(memory)), ('flops', float(flops)),
+            ('time', flops / flop_rate)])
+
+    # ------------------------------------------------------------------
+    def peak_memory(self):
+
+        """ Peak memory, the diagonalization or the Green's function
+        stages on top of the eigenbasis. """
+
+        memory = dict([ (stage, e['memory']) for stage, e in self.estimates.items() ])
+        base = memory.pop('eigenbasis', 0)
+        diagonalization = memory.pop('diagonalization', 0)
+        return max([diagonalization, base + max(memory.values() + [0])])
+
+    # ------------------------------------------------------------------
+    def total_time(self):
+        return sum([ s['time'] for s in self.estimates.values() ])
+
+    # ------------------------------------------------------------------
+    def fits(self):
+
+        """ True if the estimates are within the memory and time budgets. """
+
+        fits = True
+        if self.memory_budget is not None:
+            fits &= self.peak_memory() <= self.memory_budget
+        if self.time_budget is not None:
+            fits &= self.total_time() <= self.time_budget
+        return fits
+
+    # ------------------------------------------------------------------
+    def summary(self):
+
+        lines = [ 'ExecutionPlan: %i fermions, dimension %i, nstates %s, '
+                  'sectors %s, %s precision, %i processes' % (
+                      self.nfermions, self.dimension, self.nstates,
+                      self.use_sectors, self.precision, self.processes) ]
+
+        for stage, e in self.estimates.items():
+            lines.append('  %-24s %10.1f MB %12.3e flops %10.2f s' % (
+                stage, e['memory'] / 2.**20, e['flops'], e['time']))
+
+        lines.append('  %-24s %10.1f MB %23s %10.2f s' % (
+            'peak / total', self.peak_memory() / 2.**20, '', self.total_time()))
+        lines.append('  chunk sizes: %s' % (
+            ', '.join([ '%s=%s' % kv for kv in sorted(self.chunk_sizes.items()) ])))
+        lines += [ '  note: ' + note for note in self.notes ]
+
+        return '\n'.join(lines)
+
+    # ------------------------------------------------------------------
+    def __str__(self):
+        return self.summary()
+
+# ----------------------------------------------------------------------
+def _diagonalization_estimate(D, nnz, nstates, sector_dims):
+
+    """ (memory, flops) of the diagonalization, dense eigh for the full
+    spectrum, in sectors, or Lanczos with ncv = 8 nstates + 1. """
+
+    hamiltonian = 12 * nnz + 4 * (D + 1)
+
+    if nstates is not None:
+        ncv = 8 * nstates + 1
+        memory = hamiltonian + 8 * D * (ncv + nstates)
+        flops = 10 * ncv * (2 * nnz + 4 * D * ncv)
+    elif sector_dims is not None:
+        Dk = max(sector_dims)
+        memory = hamiltonian + 8 * (2 * D * D + 2 * D * Dk + 3 * Dk * Dk)
+        flops = sum([ 9. * d**3 + 2. * nnz * d for d in sector_dims ])
+    else:
+        memory = hamiltonian + 8 * 4 * D * D
+        flops = 9. * D**3
+
+    return memory, flops
+
+# ----------------------------------------------------------------------
+def _largest_chunk(budget, per_item, fixed=0, maximum=None):
+
+    """ Largest chunk of items fitting the budget, at least one. """
+
+    chunk = max(1, int((budget - fixed) // max(1, per_item)))
+    if maximum is not None: chunk = min(chunk, max(1, maximum))
+    return chunk
+
+# ----------------------------------------------------------------------
+def _add_estimates(plan, H_nnz, sector_dims, ntau, niw, ntau_g3, ntau_g4,
+                   ncomponents, budget, flop_rate):
+
+    """ Estimates and chunk sizes of all stages for the strategy of plan. """
+
+    D, nfermions = plan.dimension, plan.nfermions
+    item = 8 if plan.precision == 'double' else 4
+
+    plan.estimates, plan.chunk_sizes = OrderedDict(), {}
+
+    memory, flops = _diagonalization_estimate(
+        D, H_nnz, plan.nstates, sector_dims if plan.use_sectors else None)
+    plan.add_estimate('diagonalization', memory, flops, flop_rate)
+
+    # -- Eigenbasis operators, dense for the full spectrum only
+
+    N = D if plan.nstates is None else plan.nstates
+    nops = min(4 * ncomponents, 2 * nfermions)
+
+    if plan.nstates is None:
+        plan.add_estimate(
+            'eigenbasis', memory=8 * D * N + 8 * D * D + nops * N * N * item,
+            flops=nops * 2. * (D * D * N + N * D * N), flop_rate=flop_rate)
+    else:
+        plan.add_estimate('eigenbasis', memory=8 * D * N + nops * 12 * D,
+                          flop_rate=flop_rate)
+
+    left = max(0, budget - plan.estimates['eigenbasis']['memory'])
+
+    # -- Single particle functions
+
+    if ntau is not None:
+        plan.add_estimate('g2_tau', memory=2 * ntau * N * 8 + 16 * ntau,
+                          flops=2. * ntau * N * N, flop_rate=flop_rate)
+
+    if niw is not None:
+        per_iw = 3 * 16 * N * N
+        plan.chunk_sizes['g2_iw'] = _largest_chunk(left / 2, per_iw, maximum=niw)
+        plan.add_estimate(
+            'g2_iw', memory=plan.chunk_sizes['g2_iw'] * per_iw + 16 * niw,
+            flops=8. * niw * N * N, flop_rate=flop_rate)
+
+    # -- Three point functions, grouped by t2
+
+    if ntau_g3 is not None:
+        npts = ntau_g3 * (ntau_g3 + 1) // 2
+        fixed = 16 * ncomponents * ntau_g3**2 + 2 * N * N * item + ntau_g3 * N * item
+        per_point = 2 * N * item + 16
+        plan.chunk_sizes['g3_tau'] = _largest_chunk(
+            left / 2, per_point, fixed=fixed, maximum=npts)
+        plan.add_estimate(
+            'g3_tau', memory=fixed + plan.chunk_sizes['g3_tau'] * per_point,
+            flops=ncomponents * (2. * N**3 * ntau_g3 + 2. * N * N * npts),
+            flop_rate=flop_rate)
+
+    # -- Four point functions, distinct operator strings on the ordered points
+
+    if ntau_g4 is not None:
+        npts = ntau_g4 * (ntau_g4 + 1) * (ntau_g4 + 2) // 6
+        nstrings = 6 * ncomponents
+        output = 16 * (ncomponents * ntau_g4**3 + nstrings * npts)
+
+        if plan.nstates is None:
+            # -- Exponential table and the block of cached products of the
+            # -- uniform mesh kernel, with P(k) recomputed once per block
+            chunk_name, maximum = 'g4_tau', npts
+            nblock = min(ntau_g4, SparseExactDiagonalization.product_cache_size(N, item))
+            nP = ntau_g4 * -(-ntau_g4 // nblock)
+            fixed = output + ntau_g4 * N * item + (nblock + 1) * N * N * item
+            per_point = 2 * N * N * item + 4 * N * item
+            flops = nstrings * (2. * N**3 * (nP + ntau_g4) + 2. * N * N * npts)
+        else:
+            # -- Krylov vectors of all times per outer state
+            chunk_name, maximum = 'krylov', N
+            fixed = output + 12 * H_nnz
+            per_point = 3 * 16 * ntau_g4 * D
+            flops = nstrings * N * ntau_g4**2 * 40. * H_nnz
+
+        plan.chunk_sizes[chunk_name] = _largest_chunk(
+            left / 2, per_point, fixed=fixed, maximum=maximum)
+        plan.add_estimate(
+            'g4_tau', memory=fixed + plan.chunk_sizes[chunk_name] * per_point,
+            flops=flops, flop_rate=flop_rate)
+
+        if output > left:
+            plan.notes.append('The G4 output exceeds the memory budget, '
+                              'see CheckpointHDF5.write_g4_tau_hdf5.')
+
+# ----------------------------------------------------------------------
+def plan_execution(fundamental_operators, H_nnz, beta,
+                   ntau=None, niw=None, ntau_g3=None, ntau_g4=None,
+                   ncomponents=1, memory_budget=None, time_budget=None,
+                   nstates=None, sector_dims=None, precision='double',
+                   flop_rate=1e10, max_processes=None):
+
+    r""" Plan the exact diagonalization of a Hamiltonian with H_nnz
+    non-zero elements in the Fock space of the fundamental operators
+    (or their number), at inverse temperature beta.
+
+    The optional mesh sizes are the number of imaginary times ntau and
+    frequencies niw of the single particle functions, and the number of
+    times ntau_g3 and ntau_g4 per axis of the three- and four-point
+    functions, for ncomponents operator combinations each.
+
+    memory_budget (bytes, by default the physical memory) and
+    time_budget (seconds, by default unlimited) select the strategy:
+
+    1. The full spectrum by dense diagonalization.
+    2. Symmetry sectors of the particle number, which reduce the time
+       and the peak memory of the diagonalization, if the dense
+       diagonalization exceeds the time or the memory budget.
+       sector_dims are the sector dimensions if known, e.g. from
+       SparseMatrixRepresentation.get_symmetry_sectors.
+    3. A truncated spectrum with Krylov propagation, if the full
+       spectrum does not fit in memory. nstates is the number of states,
+       by default the largest that fits the budgets, halving from the
+       Lanczos limit (D - 1) // 8 (ncv = 8 nstates + 1 <= D).
+
+    The chunk sizes are the largest that fit the remaining memory, and
+    the number of processes for parameter grids is limited by the peak
+    memory of one instance. Returns an ExecutionPlan. """
+
+    if isinstance(fundamental_operators, int):
+        nfermions = fundamental_operators
+    else:
+        nfermions = len(fundamental_operators)
+
+    assert( precision in ['double', 'single'] )
+
+    if memory_budget is None: memory_budget = physical_memory()
+    budget = np.inf if memory_budget is None else memory_budget
+
+    plan = ExecutionPlan(nfermions, beta)
+    plan.precision = precision
+    plan.memory_budget, plan.time_budget = memory_budget, time_budget
+
+    D = plan.dimension
+    if sector_dims is None:
+        sector_dims = [ int(comb(nfermions, n, exact=True))
+                        for n in xrange(nfermions + 1) ]
+
+    args = (H_nnz, sector_dims, ntau, niw, ntau_g3, ntau_g4,
+            ncomponents, budget, flop_rate)
+
+    # -- Full spectrum, in sectors if the dense diagonalization does not fit
+
+    _add_estimates(plan, *args)
+
+    diagonalization = plan.estimates['diagonalization']
+    if diagonalization['memory'] > budget or (
+            time_budget is not None and diagonalization['time'] > time_budget):
+        plan.use_sectors = True
+        plan.charges = [ np.ones((nfermions), dtype=np.int) ]
+        plan.notes.append('Dense diagonalization exceeds the budget, '
+                          'using particle number sectors.')
+        _add_estimates(plan, *args)
+
+    # -- Truncated spectrum
+
+    if plan.peak_memory() > budget:
+        plan.use_sectors, plan.charges = False, None
+
+        if nstates is not None:
+            candidates = [ nstates ]
+        else:
+            candidates = [ max(1, (D - 1) // 8) ]
+            while candidates[-1] > 1: candidates.append(candidates[-1] // 2)
+
+        for plan.nstates in candidates:
+            _add_estimates(plan, *args)
+            if plan.fits(): break
+
+        plan.notes = [ 'The full spectrum exceeds the memory budget, '
+                       'truncating to %i states.' % plan.nstates ]
+
+    # -- Worker processes for parameter grids
+
+    plan.processes = multiprocessing.cpu_count()
+    if max_processes is not None: plan.processes = min(plan.processes, max_processes)
+    if memory_budget is not None:
+        plan.processes = int(max(1, min(
+            plan.processes, memory_budget // max(1, plan.peak_memory()))))
+
+    if not plan.fits():
+        plan.notes.append('The estimates exceed the budget.')
+
+    return plan
+
+# ----------------------------------------------------------------------
@@ -7,19 +7,24 @@ Author: Hugo U. R. Strand (2017), hugo.strand@gmail.com
 
 # ----------------------------------------------------------------------
 
-import time
 import itertools
 import numpy as np
+from scipy import sparse
 from scipy.linalg import expm
+from scipy.special import ive, eval_legendre
 
 # ----------------------------------------------------------------------
 
 from scipy.sparse.linalg import eigs as eigs_sparse
 from scipy.sparse.linalg import eigsh as eigsh_sparse
+from scipy.sparse.linalg import expm_multiply
 
 # ----------------------------------------------------------------------
 
-from CubeTetras import CubeTetras
+from CubeTetras import CubeTetras, CubeTetrasBase
+from CubeTetras import ordered_index_tau3, ordered_gauss_tau3
+from DividedDifferences import exp_divided_difference
+from Instrumentation import null_profiler
 
 # ----------------------------------------------------------------------
 class SparseExactDiagonalization(object):
@@ -30,13 +35,51 @@ class SparseExactDiagonalization(object):
     # ------------------------------------------------------------------
     def __init__(self, H, beta,
                  nstates=None, hermitian=True,
-                 v0=None, tol=0):
+                 v0=None, tol=0, blocks=None, precision='double',
+                 profiler=None, plan=None):
+
+        r""" blocks is an optional list of sparse matrices with orthonormal
+        columns spanning the Hilbert space, e.g. the symmetry sectors of
+        SparseMatrixRepresentation.get_symmetry_sectors, in which H is
+        diagonalized block by block.
+
+        precision='single' evaluates the two- and three-time kernels with
+        float32/complex64 eigenbasis operators, exponential tables and
+        intermediates, accumulating the final sums over the eigenstates
+        in float64. Operator matrix elements below \epsilon times the
+        largest one are dropped. With \epsilon = 2^{-24} \approx 6 \cdot 10^{-8} each
+        Lehmann term of n factors has a relative rounding error of at most
+        about (n + \log_2 N) \epsilon for N eigenstates, so that
+
+        |G_{single} - G_{double}| \lesssim (n + \log_2 N) \epsilon \frac{1}{Z} \sum |terms|
+
+        i.e. 1e-6 relative to the absolute Lehmann sum for N ~ 1000.
+
+        profiler is an optional pyed.Instrumentation.Profiler recording
+        the diagonalization, eigenbasis transforms, exponential tables,
+        contractions and output scatter.
+
+        plan is an optional pyed.ResourcePlanner.ExecutionPlan, which sets
+        nstates, precision and the default chunk sizes of the kernels.
+        Symmetry sectors of the plan are applied by the caller through
+        blocks, see TriqsExactDiagonalization. """
+
+        if plan is not None:
+            assert( plan.dimension == H.shape[0] ), \
+                "ERROR: The plan does not match the Hilbert space dimension!"
+            nstates, precision = plan.nstates, plan.precision
+        self.plan = plan
+
+        assert( precision in ['double', 'single'] )
+        self.precision = precision
+        self.profiler = profiler if profiler is not None else null_profiler
 
         self.v0 = v0
         self.tol = tol
         
         self.nstates = nstates
         self.hermitian = hermitian
+        self.blocks = blocks
         
         self.H = H
         self.beta = beta
@@ -47,27 +90,65 @@ class SparseExactDiagonalization(object):
         
     # ------------------------------------------------------------------
     def _diagonalize_hamiltonian(self):
-       
-        if self.nstates is None:
+
+        with self.profiler.stage('diagonalization', elements=self.H.shape[0]**2):
+            self._diagonalize()
+
+        self.U = np.mat(self.U)
+        self.E0 = np.min(self.E)
+        self.E = self.E - self.E0
+
+    # ------------------------------------------------------------------
+    def _diagonalize(self):
+
+        if self.blocks is not None:
+            self._diagonalize_hamiltonian_blocks()
+        elif self.nstates is None:
             if self.hermitian:
                 self.E, self.U = np.linalg.eigh(self.H.todense())
             else:
                 self.E, self.U = np.linalg.eig(self.H.todense())
         else:
             if self.hermitian:
-                t = time.time()
                 self.E, self.U = eigsh_sparse(
                     self.H, k=self.nstates, which='SA',
                     v0=self.v0, tol=self.tol, ncv=self.nstates*8+1)
-                print 'ED:', time.time() - t, ' s'
             else:
                 self.E, self.U = eigs_sparse(
                     self.H, k=self.nstates, which='SR',
                     v0=self.v0, tol=self.tol)
-            
-        self.U = np.mat(self.U)
-        self.E0 = np.min(self.E)
-        self.E = self.E - self.E0
+
+    # ------------------------------------------------------------------
+    def _diagonalize_hamiltonian_blocks(self, tol=1e-10):
+
+        """ Diagonalize H in each block B^+ H B and check that H does not
+        couple the blocks, i.e. that H commutes with the symmetry. """
+
+        assert( self.nstates is None )
+        assert( sum([ B.shape[1] for B in self.blocks ]) == self.H.shape[0] ), \
+            "ERROR: The blocks do not span the Hilbert space!"
+
+        scale = max(1., abs(self.H).max())
+
+        E, U = [], []
+        for B in self.blocks:
+            HB = np.asarray((self.H * B).todense())
+            H_block = np.asarray((B.getH() * HB))
+
+            if np.max(np.abs(HB - B * H_block)) > tol * scale:
+                raise ValueError(
+                    'ERROR: The Hamiltonian does not commute with the symmetry!')
+
+            if self.hermitian:
+                E_block, U_block = np.linalg.eigh(H_block)
+            else:
+                E_block, U_block = np.linalg.eig(H_block)
+
+            E.append(E_block)
+            U.append(B * U_block)
+
+        self.E = np.concatenate(E)
+        self.U = np.hstack(U)
 
     # ------------------------------------------------------------------
     def _calculate_partition_function(self):
@@ -78,19 +159,129 @@ class SparseExactDiagonalization(object):
     # ------------------------------------------------------------------
     def _calculate_density_matrix(self):
 
+        r""" rho = U e^{-\beta E} U^{-1} / Z. For a non-Hermitian H the
+        eigenvectors U are not orthonormal, in general not even within
+        degenerate subspaces, and U^+ is not the inverse. """
+
         exp_bE = np.exp(-self.beta * self.E) / self.Z
-        self.rho = np.einsum('ij,j,jk->ik', self.U, exp_bE, self.U.H)
+        U_inv = self.U.H if self.hermitian else np.linalg.pinv(self.U)
+        self.rho = np.asarray(np.dot(np.multiply(self.U, exp_bE[None, :]), U_inv))
+
+    # ------------------------------------------------------------------
+    product_cache_bytes = 2**26
+
+    @classmethod
+    def product_cache_size(cls, N, itemsize):
+
+        """ Number of N x N operator products of the uniform mesh
+        kernels kept in product_cache_bytes, at least one. """
+
+        return max(1, cls.product_cache_bytes // (N * N * itemsize))
+
+    # ------------------------------------------------------------------
+    def _chunk_size(self, kernel, chunk_size):
+
+        """ chunk_size, or the chunk size of the kernel in the plan. """
+
+        if chunk_size is None and self.plan is not None:
+            chunk_size = self.plan.chunk_sizes.get(kernel)
+        return chunk_size
+
+    # ------------------------------------------------------------------
+    def _kernel_cast(self, a, rtol=0.):
+
+        """ Array a in the precision of the two-particle kernels. In single
+        precision values below rtol times the largest value, or below the
+        smallest normal float32, are flushed to zero. Subnormal operands and
+        products slow down the BLAS kernels considerably. """
+
+        a = np.asarray(a)
+        if self.precision == 'double': return a
+
+        a = a.astype(np.complex64 if np.iscomplexobj(a) else np.float32)
+        abs_a = np.abs(a)
+        a[abs_a < max(np.finfo(np.float32).tiny, rtol * np.max(abs_a))] = 0
+        return a
+
+    # ------------------------------------------------------------------
+    def _kernel_operators(self, dops):
+
+        """ Eigenbasis operators in the kernel precision, matrix elements
+        below the single precision resolution of the operator are dropped. """
+
+        return [ self._kernel_cast(op, rtol=np.finfo(np.float32).eps)
+                 for op in dops ]
 
     # ------------------------------------------------------------------
     def _operators_to_eigenbasis(self, op_vec):
 
-        dop_vec = []
-        for op in op_vec:
-            dop = np.mat(self.U).H * op.todense() * np.mat(self.U)
-            dop_vec.append(dop)
+        D, N = self.U.shape
+        with self.profiler.stage('eigenbasis_transform',
+                                 flops=len(op_vec) * 2 * (D * D * N + N * D * N)):
+            dop_vec = []
+            for op in op_vec:
+                dop = np.mat(self.U).H * op.todense() * np.mat(self.U)
+                dop_vec.append(dop)
 
         return dop_vec
-        
+
+    # ------------------------------------------------------------------
+    def _prune_operators(self, dops, tol):
+
+        r""" Prune the eigenbasis operators of the imaginary time trace
+
+        Tr[ e^{-(\beta - t_1) H} O_1 e^{-(t_1 - t_2) H} O_2 ... O_n e^{-t_n H} ] / Z
+
+        A term O_1[i_1, i_2] ... O_n[i_n, i_1] of the trace is bounded for
+        all ordered times by |O_1[i_1, i_2] ... O_n[i_n, i_1]| \max_k w_{i_k}
+        with the Boltzmann weights w_i = e^{-\beta E_i} / Z. Summing the
+        bound \sum_k w_{i_k} over all terms through a matrix element bounds
+        its total contribution. Matrix elements are dropped in increasing
+        order of their bound while the sum of the dropped bounds is below
+        tol, and the eigenstates without remaining matrix elements are
+        removed.
+
+        Returns the remaining eigenstates, the operators restricted to
+        them and the bound on the absolute error of the trace. """
+
+        n = len(dops)
+        N = self.E.size
+
+        A = [ np.abs(np.asarray(dop)) for dop in dops ]
+        w = np.exp(-self.beta * self.E) / self.Z
+
+        # -- Bound on the contribution of every matrix element
+
+        bounds = []
+        for j in xrange(n):
+            # -- Paths t -> O_{j+1} ... O_{j-1} -> s closing the trace over O_j[s, t],
+            # -- P without and Pw with the sum of the Boltzmann weights at the vertices
+            P, Pw = np.eye(N), np.diag(w)
+            for k in xrange(1, n):
+                P, Pw = P.dot(A[(j + k) % n]), Pw.dot(A[(j + k) % n])
+                Pw += P * w[None, :]
+            bounds.append(A[j] * Pw.T)
+
+        bounds = np.array(bounds).flatten()
+        order = np.argsort(bounds)
+        drop = order[np.cumsum(bounds[order]) <= tol]
+        error_bound = np.sum(bounds[drop])
+
+        # -- Remove the matrix elements and the disconnected eigenstates
+
+        mask = np.ones((n * N * N), dtype=np.bool)
+        mask[drop] = False
+        mask = mask.reshape((n, N, N))
+
+        pruned = [ np.where(m, np.asarray(dop), 0.) for m, dop in zip(mask, dops) ]
+
+        nonzero = np.array([ p != 0. for p in pruned ])
+        states = np.nonzero(np.any(nonzero, axis=(0, 1)) | np.any(nonzero, axis=(0, 2)))[0]
+
+        pruned = [ p[np.ix_(states, states)] for p in pruned ]
+
+        return states, pruned, error_bound
+
     # ------------------------------------------------------------------
     def get_expectation_value_sparse(self, operator):
 
@@ -151,7 +342,43 @@ class SparseExactDiagonalization(object):
     # ------------------------------------------------------------------
     def get_ground_state_energy(self):
         return self.E0
-    
+
+    # ------------------------------------------------------------------
+    def get_reduced_density_matrices(self, ops, weight_tol=0.):
+
+        r""" One- and two-particle reduced density matrices
+
+        rdm1[i, j] = < c_i^\dagger c_j >
+        rdm2[i, j, k, l] = < c_i^\dagger c_j^\dagger c_k c_l >
+
+        for the annihilation operators ops = [c_1, ..., c_n].
+
+        With the thermally weighted eigenstates W = U e^{-\beta E/2} / \sqrt{Z}
+        the expectation values are overlaps of the states V_j = c_j W and
+        D_{kl} = c_k c_l W, e.g. < c_i^\dagger c_j > = Tr[V_i^\dagger V_j],
+        so the operators are applied to the block of states W once per
+        operator and pair. Eigenstates with Boltzmann weight below
+        weight_tol are left out. """
+
+        exp_bE = np.exp(-self.beta * self.E) / self.Z
+        states = np.nonzero(exp_bE > weight_tol)[0]
+        W = np.asarray(self.U)[:, states] * np.sqrt(exp_bE[states])[None, :]
+
+        n = len(ops)
+
+        V = [ op.dot(W) for op in ops ]
+        D = np.array([ ops[k].dot(V[l]).flatten()
+                       for k, l in itertools.product(range(n), repeat=2) ])
+        V = np.array([ v.flatten() for v in V ])
+
+        rdm1 = np.dot(V.conj(), V.T)
+
+        # -- < c_i^+ c_j^+ c_k c_l > = Tr[ D_{ji}^+ D_{kl} ]
+        rdm2 = np.dot(D.conj(), D.T).reshape((n, n, n, n))
+        rdm2 = rdm2.transpose((1, 0, 2, 3))
+
+        return rdm1, rdm2
+
     # ------------------------------------------------------------------
     def get_g2_dissconnected_tau_tetra(self, tau, tau_g, g):
 
@@ -198,37 +425,347 @@ class SparseExactDiagonalization(object):
             
         return G4
     
+    # ------------------------------------------------------------------
+    def get_operator_keys(self, ops):
+
+        """ Integer keys identifying equal operators in ops. """
+
+        keys = []
+        for idx, op in enumerate(ops):
+            key = idx
+            for ref_idx in xrange(idx):
+                ref = ops[ref_idx]
+                if ref.shape == op.shape and (ref != op).nnz == 0:
+                    key = keys[ref_idx]
+                    break
+            keys.append(key)
+
+        return keys
+
     # ------------------------------------------------------------------
     def get_g2_tau(self, tau, ops):
-        
+
+        """ Two-particle Green's function on the imaginary time cube. """
+
+        return self.get_g2_tau_components(tau, [ops])[0]
+
+    # ------------------------------------------------------------------
+    def get_g2_tau_components(self, tau, ops_list, tetras=None,
+                              chunk_size=None, prune_tol=None):
+
+        """ Two-particle Green's functions for a list of operator
+        quadruples on the imaginary time cube, returns (nops, N, N, N).
+
+        The operators are transformed to the eigenbasis once and every
+        distinct time ordered operator string, over all tetrahedrons
+        and components, is evaluated once on the time ordered points
+        i1 >= i2 >= i3. The tetrahedrons are filled by permutation sign.
+
+        tetras is an optional list of (index, perm, perm_sign) with
+        index of shape (3, n), by default the tetrahedrons of CubeTetras.
+        Points shared by several tetrahedrons take the value of the last.
+
+        With prune_tol every operator string is pruned, see _prune_operators,
+        and the largest error bound is stored in self.pruning_error_bound.
+
+        With a truncated spectrum (nstates) the strings are evaluated by
+        Krylov propagation, see get_timeordered_greens_function_krylov,
+        which requires the uniform mesh tau = linspace(0, beta, N). """
+
         N = len(tau)
-        G4 = np.zeros((N, N, N), dtype=np.complex)
-        ops = np.array(ops)
 
-        for tidx, tetra in enumerate(CubeTetras(tau)):
-            idx, taus, perm, perm_sign = tetra
+        if tetras is None:
+            tetras = [ (np.array(index), perm, perm_sign)
+                       for index, taus, perm, perm_sign in CubeTetras(tau) ]
+
+        # -- Unique operators over all components
+
+        ops_flat = [ op for ops in ops_list for op in ops ]
+        flat_keys = self.get_operator_keys(ops_flat)
+        unique_keys = sorted(set(flat_keys))
+        op_keys = [ [ unique_keys.index(key) for key in flat_keys[4*i:4*i+4] ]
+                    for i in xrange(len(ops_list)) ]
+
+        unique_ops = [ ops_flat[flat_keys.index(key)] for key in unique_keys ]
+
+        # -- Distinct time ordered operator strings
+
+        cube = CubeTetrasBase()
+        tetra_list = cube.get_tetra_list()
+
+        strings, tetra_strings = [], []
+        for keys in op_keys:
+            tetra_string = [ None ] * len(tetra_list)
+            for tidxs in cube.get_tetra_classes(keys):
+                perm = tetra_list[tidxs[0]][1]
+                string = tuple([ keys[i] for i in perm + [3] ])
+                if string not in strings: strings.append(string)
+                for tidx in tidxs: tetra_string[tidx] = strings.index(string)
+            tetra_strings.append(tetra_string)
+
+        # -- Evaluate all strings on the time ordered points
+
+        index = ordered_index_tau3(N)
+        ordered_keys = np.ravel_multi_index(index, (N, N, N))
+        taus = tau[index]
+
+        G_strings = np.zeros((len(strings), taus.shape[-1]), dtype=np.complex)
+
+        if self.nstates is not None:
+
+            assert( np.allclose(tau, np.linspace(0, self.beta, N)) ), \
+                "ERROR: The truncated spectrum requires a uniform imaginary time mesh!"
+
+            for sidx, string in enumerate(strings):
+                G_cube = self.get_timeordered_greens_function_krylov(
+                    N, [ unique_ops[key] for key in string ])
+                G_strings[sidx] = G_cube[tuple(index)]
+
+        else:
+
+            dops = self._operators_to_eigenbasis(unique_ops)
+            dops_list = [ [ dops[key] for key in string ] for string in strings ]
+
+            states_list = None
+            if prune_tol is not None:
+                pruned = [ self._prune_operators(d, prune_tol) for d in dops_list ]
+                states_list, dops_list, bounds = zip(*pruned)
+                self.pruning_error_bound = max(bounds)
+
+            chunk_size = self._chunk_size('g4_tau', chunk_size)
+            if chunk_size is None: chunk_size = taus.shape[-1]
+            for start in xrange(0, taus.shape[-1], chunk_size):
+                chunk = slice(start, start + chunk_size)
+                G_strings[:, chunk] = \
+                    self._timeordered_three_tau_greens_functions(
+                        taus[:, chunk], dops_list, states_list=states_list)
+
+        # -- Fill the tetrahedrons
+
+        G4 = np.zeros((len(ops_list), N, N, N), dtype=np.complex)
+        with self.profiler.stage('scatter', elements=G4.size):
+            for index, perm, perm_sign in tetras:
+                index = np.array(index).reshape(3, -1)
+                if index.size == 0: continue
+
+                tidx = [ t[1] for t in tetra_list ].index(perm)
+                ordered = np.searchsorted(
+                    ordered_keys, np.ravel_multi_index(index[perm], (N, N, N)))
+
+                for cidx, tetra_string in enumerate(tetra_strings):
+                    G4[cidx][tuple(index)] = \
+                        perm_sign * G_strings[tetra_string[tidx], ordered]
 
-            print 'Tetra:', tidx
-            
-            # do not permute the last operator
-            ops_perm = ops[perm + [3]]
-            taus_perm = taus[perm] # permute the times
-            
-            G4[idx] = self.get_timeordered_three_tau_greens_function(
-                taus_perm, ops_perm) * perm_sign
-            
         return G4
-    
+
     # ------------------------------------------------------------------
-    def get_timeordered_two_tau_greens_function(self, taus, ops):
+    def get_g2_tau_points(self, taus, ops, chunk_size=1024, dops=None):
+
+        """ Two-particle Green's function at arbitrary points.
+
+        taus has shape (M, 3) with (t1, t2, t3) in [0, beta], returns
+        the M values. The points are sorted into the tetrahedrons,
+        points on equal time planes go to the first matching one as in
+        CubeTetrasMesh, and each class of tetrahedrons with equal time
+        ordered operator string is evaluated in chunks of points.
+
+        dops are optionally the eigenbasis operators of ops, see
+        _operators_to_eigenbasis, for repeated calls with the same
+        operators. """
+
+        taus = np.asarray(taus, dtype=np.float).reshape(-1, 3)
+        assert( (taus >= 0).all() and (taus <= self.beta).all() )
+
+        ops = np.array(ops)
+        if dops is None: dops = self._operators_to_eigenbasis(ops)
+
+        cube = CubeTetrasBase()
+        tetra_list = cube.get_tetra_list()
+
+        # -- Assign the points to the tetrahedrons
+
+        tetra_idx = np.zeros((taus.shape[0]), dtype=np.int)
+        unassigned = np.ones((taus.shape[0]), dtype=np.bool)
+        for tidx, (func, perm, perm_sign) in enumerate(tetra_list):
+            t_1, t_2, t_3 = taus[:, perm].T
+            mask = unassigned & (t_1 >= t_2) & (t_2 >= t_3)
+            tetra_idx[mask] = tidx
+            unassigned[mask] = False
+
+        G = np.zeros((taus.shape[0]), dtype=np.complex)
+
+        for tidxs in cube.get_tetra_classes(self.get_operator_keys(ops)):
+
+            points = np.nonzero(np.in1d(tetra_idx, tidxs))[0]
+            if len(points) == 0: continue
+
+            # -- Sorted times and signs of the points in the class
+            perms = np.array([ tetra_list[tidx][1] for tidx in tetra_idx[points] ])
+            signs = np.array([ tetra_list[tidx][2] for tidx in tetra_idx[points] ])
+            taus_perm = taus[points[:, None], perms].T
+
+            perm = tetra_list[tidxs[0]][1]
+            dops_perm = [ dops[i] for i in perm + [3] ]
+
+            for start in xrange(0, len(points), chunk_size):
+                chunk = slice(start, start + chunk_size)
+                G[points[chunk]] = signs[chunk] * \
+                    self._timeordered_three_tau_greens_functions(
+                        taus_perm[:, chunk], [dops_perm])[0]
+
+        return G
+
+    # ------------------------------------------------------------------
+    def get_timeordered_greens_function_krylov(self, ntau, ops, chunk_size=None):
+
+        r""" Time ordered Green's function for a truncated spectrum
+
+        G(t_1, ..., t_{m-1}) = 1/Z Tr[ e^{-(\beta - t_1) H} O_1 e^{-(t_1 - t_2) H} O_2
+                                       ... O_{m-1} e^{-t_{m-1} H} O_m ]
+
+        on the uniform mesh t_i = \beta i / (ntau - 1), for the points
+        i_1 >= i_2 >= ... >= i_{m-1}. Returns an array of shape
+        (ntau,)*(m-1) which is zero at all other points.
+
+        The trace is evaluated in the computed eigenstates |a> in the
+        longest of the m time slices, using the cyclic rotation of the
+        operators that puts it outermost. The intermediate states are not
+        truncated, the vectors O|a> are propagated with the sparse
+        Hamiltonian by scipy.sparse.linalg.expm_multiply, which gives all
+        the mesh points of a time slice in one sweep. Left and right
+        propagated vectors are contracted, so m - 1 slices take
+        2 + ntau + ... + ntau^(m-3) sweeps per rotation. The outer states
+        are processed in chunks of chunk_size. """
+
+        assert( self.hermitian )
+
+        m = len(ops)
+        n, dt = ntau, self.beta / (ntau - 1.)
+
+        A = -(self.H - self.E0 * sparse.identity(self.H.shape[0], format='csr'))
+        A = A.tocsr()
+
+        # -- Time slice lengths of the ordered points, in units of dt
+
+        grids = np.meshgrid(*[ np.arange(n) ] * (m - 1), indexing='ij')
+        mask = np.ones(grids[0].shape, dtype=np.bool)
+        for k in xrange(m - 2): mask &= grids[k] >= grids[k + 1]
+        index = np.array([ grid[mask] for grid in grids ])
+
+        npts = index.shape[-1]
+        bounds = np.vstack([ (n - 1) * np.ones(npts, dtype=np.int), index,
+                             np.zeros(npts, dtype=np.int) ])
+        slices = bounds[:-1] - bounds[1:]
+
+        rotation = np.argmax(slices, axis=0)
+
+        G = np.zeros((n,) * (m - 1), dtype=np.complex)
+
+        for j in xrange(m):
+            points = np.nonzero(rotation == j)[0]
+            if len(points) == 0: continue
+
+            ops_rot = [ ops[(j + k) % m] for k in xrange(m) ]
+            inner = slices[[ (j + k) % m for k in xrange(1, m) ]][:, points]
+            outer = slices[j, points]
+
+            T = self._krylov_trace(A, ops_rot, dt, n, chunk_size)
+
+            weight = np.exp(-outer[:, None] * dt * self.E[None, :])
+            G[tuple(index[:, points])] = np.sum(weight * T[tuple(inner)], axis=-1)
+
+        G /= self.Z
+        return G
+
+    # ------------------------------------------------------------------
+    def _krylov_trace(self, A, ops, dt, n, chunk_size=None):
+
+        r""" T[p_1, ..., p_{m-1}, a] =
+        < a | O_1 e^{p_1 dt A} O_2 e^{p_2 dt A} ... O_{m-1} e^{p_{m-1} dt A} O_m | a >
+
+        for the computed eigenstates |a>, with A = -(H - E_0) hermitian. """
+
+        m = len(ops)
+        U = np.asarray(self.U)
+        D, nstates = U.shape
+
+        chunk_size = self._chunk_size('krylov', chunk_size)
+        if chunk_size is None: chunk_size = max(1, 2**24 // (n * D))
+
+        def propagate(V):
+            with self.profiler.stage('krylov_propagation', vectors=V.shape[1]):
+                return expm_multiply(A, V, start=0, stop=(n - 1) * dt,
+                                     num=n, endpoint=True)
+
+        T = np.zeros((n,) * (m - 1) + (nstates,), dtype=np.complex)
+
+        for start in xrange(0, nstates, chunk_size):
+            a = np.arange(start, min(start + chunk_size, nstates))
+            Ua = U[:, a]
+
+            # -- < a | O_1 e^{p_1 dt A} for all p_1
+            L = propagate(ops[0].getH().dot(Ua)).conj()
+
+            if m == 2:
+                T[:, a] = np.einsum('pxa,xa->pa', L, ops[1].dot(Ua))
+                continue
+
+            def right(s, V, idx):
+                # -- V are the vectors to the right of time slice s
+                W = propagate(V)
+                if s == 2:
+                    OW = np.array([ ops[1].dot(w) for w in W ])
+                    for i, aidx in enumerate(a):
+                        T[(slice(None), slice(None)) + idx + (aidx,)] = \
+                            np.dot(L[:, :, i], OW[:, :, i].T)
+                else:
+                    for p, w in enumerate(W):
+                        right(s - 1, ops[s - 1].dot(w), (p,) + idx)
+
+            right(m - 1, ops[m - 1].dot(Ua), ())
+
+        return T
+
+    # ------------------------------------------------------------------
+    def _uniform_mesh_table(self, taus, E, tol=1e-8):
+
+        r""" For times taus on a uniform mesh t = m \beta / M, returns the
+        integer mesh indices m and the table T[k] = e^{-k \beta E / M},
+        k = 0, ..., M, so that all exponentials of time differences are
+        rows of T. Returns None if the times are not on a uniform mesh,
+        or if the table would be larger than direct evaluation. """
+
+        grid = np.unique(np.concatenate([np.ravel(taus), [0., self.beta]]))
+        if len(grid) < 2: return None
+
+        M = int(np.rint(self.beta / np.min(np.diff(grid))))
+        if M + 1 > np.size(taus): return None
+
+        m = np.rint(taus * M / self.beta)
+        if np.max(np.abs(taus * M / self.beta - m)) > tol: return None
+
+        with self.profiler.stage('exponential_table', elements=(M + 1) * len(E)):
+            T = np.exp(-(self.beta / M) * np.arange(M + 1)[:, None] * E[None, :])
+
+        return m.astype(np.int), T
+
+    # ------------------------------------------------------------------
+    def get_timeordered_two_tau_greens_function(self, taus, ops, prune_tol=None,
+                                                chunk_size=None):
 
         r"""
         taus = [t1, t2] (ordered beta>t1>t2>0)
         ops = [O1, O2, O3]
 
         Returns:
-        G^{(4)}(t1, t2) = -1/Z < O1(t1) O2(t2) O3(0) > 
- 
+        G^{(4)}(t1, t2) = -1/Z < O1(t1) O2(t2) O3(0) >
+
+        With prune_tol the Lehmann terms are pruned, see _prune_operators,
+        and the bound on the error is stored in self.pruning_error_bound.
+
+        On uniform meshes the exponentials are taken from a table, see
+        _uniform_mesh_table, otherwise the points are evaluated in chunks
+        of chunk_size, see _timeordered_two_tau_kernel.
         """
 
         Nop = 3
@@ -238,7 +775,13 @@ class SparseExactDiagonalization(object):
 
         G = np.zeros((taus.shape[-1]), dtype=np.complex)
 
+        dops = self._operators_to_eigenbasis(ops)
+
         E = self.E[None, :]
+        if prune_tol is not None:
+            states, dops, self.pruning_error_bound = \
+                self._prune_operators(dops, prune_tol)
+            E = E[:, states]
 
         t1, t2 = taus
         t1, t2 = t1[:, None], t2[:, None]
@@ -247,35 +790,120 @@ class SparseExactDiagonalization(object):
         assert( (t1 >= t2).all() )
         assert( (t2 >= 0).all() )
 
-        et_a = np.exp((-self.beta + t1)*E)
-        et_b = np.exp((t2-t1)*E)
-        et_c = np.exp((-t2)*E)
-
-        dops = self._operators_to_eigenbasis(ops)
         op1, op2, op3 = dops
 
-        G = np.einsum('ta,tb,tc,ab,bc,ca->t', et_a, et_b, et_c, op1, op2, op3)
+        mesh = self._uniform_mesh_table(taus, E[0])
+        if mesh is not None:
+
+            # -- Group the points by m1 - m2 and sum over a, c by GEMMs
+            (m1, m2), T = mesh
+            M, T = len(T) - 1, self._kernel_cast(T)
+            op1, op2, op3 = self._kernel_operators(dops)
+
+            order = np.argsort(m1 - m2, kind='mergesort')
+            keys, starts = np.unique((m1 - m2)[order], return_index=True)
+
+            N = T.shape[1]
+            flops = 2 * N**3 * len(keys) + 2 * N**2 * len(m1)
+            with self.profiler.stage('contraction', flops=flops):
+                for k, pts in zip(keys, np.split(order, starts[1:])):
+                    R = np.dot(op1 * T[k][None, :], op2) * op3.T
+                    G[pts] = np.sum(np.dot(T[M - m1[pts]], R) * T[m2[pts]],
+                                    axis=1, dtype=np.complex)
+
+        else:
+            G = self._timeordered_two_tau_kernel(
+                np.asarray(taus), dops, E[0], chunk_size=chunk_size)
 
         G /= self.Z        
         return G
 
     # ------------------------------------------------------------------
-    def get_timeordered_three_tau_greens_function(self, taus, ops):
+    def _timeordered_two_tau_kernel(self, taus, dops, E, chunk_size=None):
+
+        r""" Three operator kernel
+
+        G(t_1, t_2) = \sum_{abc} e^{-(\beta - t_1) E_a} O^1_{ab}
+                       e^{-(t_1 - t_2) E_b} O^2_{bc} e^{-t_2 E_c} O^3_{ca}
+
+        with the points grouped by t_2. For every t_2 the partial product
+        Y = O^2 e^{-t_2 E} O^3 is one GEMM, and with Z = O^1 \circ Y^T
+
+        G(t_1, t_2) = \sum_{ab} e^{-(\beta - t_1) E_a} Z_{ab} e^{-(t_1 - t_2) E_b}
+
+        is a GEMM over the points of the group, in chunks of chunk_size. """
+
+        t1, t2 = taus
+        E = self._kernel_cast(E)
+        op1, op2, op3 = self._kernel_operators(dops)
+
+        chunk_size = self._chunk_size('g3_tau', chunk_size)
+        if chunk_size is None: chunk_size = max(1, 2**22 // len(E))
+
+        G = np.zeros(len(t1), dtype=np.complex)
+
+        t2_unique, inverse = np.unique(t2, return_inverse=True)
+        order = np.argsort(inverse, kind='mergesort')
+        starts = np.searchsorted(inverse[order], np.arange(len(t2_unique)))
+
+        N = len(E)
+        flops = 2 * N**3 * len(t2_unique) + 2 * N**2 * len(t1)
+        with self.profiler.stage('contraction', flops=flops):
+            for t, pts in zip(t2_unique, np.split(order, starts[1:])):
+
+                e_c = self._kernel_cast(np.exp(-t * E))
+                Z = op1 * np.dot(op2 * e_c[None, :], op3).T
+
+                for start in xrange(0, len(pts), chunk_size):
+                    p = pts[start:start + chunk_size]
+                    e_a = self._kernel_cast(
+                        np.exp(-(self.beta - t1[p])[:, None] * E[None, :]))
+                    e_b = self._kernel_cast(
+                        np.exp(-(t1[p] - t)[:, None] * E[None, :]))
+                    G[p] = np.sum(np.dot(e_a, Z) * e_b, axis=1, dtype=np.complex)
+
+        return G
+
+    # ------------------------------------------------------------------
+    def get_timeordered_three_tau_greens_function(self, taus, ops,
+                                                  prune_tol=None):
 
         r"""
         taus = [t1, t2, t3] (ordered beta>t1>t2>t3>0)
         ops = [O1, O2, O3, O4]
 
         Returns:
-        G^{(4)}(t1, t2, t3) = -1/Z < O1(t1) O2(t2) O3(t3) O4(0) > 
- 
+        G^{(4)}(t1, t2, t3) = -1/Z < O1(t1) O2(t2) O3(t3) O4(0) >
+
+        With prune_tol the Lehmann terms are pruned, see _prune_operators,
+        and the bound on the error is stored in self.pruning_error_bound.
         """
 
-        assert( taus.shape[0] == 3 )
         assert( len(ops) == 4 )
 
-        Nop = 4
-        G = np.zeros((taus.shape[-1]), dtype=np.complex)
+        dops = self._operators_to_eigenbasis(ops)
+
+        if prune_tol is None:
+            return self._timeordered_three_tau_greens_functions(taus, [dops])[0]
+
+        states, dops, self.pruning_error_bound = \
+            self._prune_operators(dops, prune_tol)
+        return self._timeordered_three_tau_greens_functions(
+            taus, [dops], states_list=[states])[0]
+
+    # ------------------------------------------------------------------
+    def _timeordered_three_tau_greens_functions(self, taus, dops_list,
+                                                states_list=None):
+
+        """ Time ordered three time Green's functions for a list of
+        eigenbasis operator quadruples, sharing the exponentials.
+
+        states_list optionally restricts each quadruple to a subset of
+        the eigenstates, with the operators given on the subset. """
+
+        assert( taus.shape[0] == 3 )
+
+        G = np.zeros((len(dops_list), taus.shape[-1]), dtype=np.complex)
 
         E = self.E[None, :]
 
@@ -287,41 +915,122 @@ class SparseExactDiagonalization(object):
         assert( (t2 >= t3).all() )
         assert( (t3 >= 0).all() )
 
-        et_a = np.exp((-self.beta + t1)*E)
-        et_b = np.exp((t2-t1)*E)
-        et_c = np.exp((t3-t2)*E)
-        et_d = np.exp((-t3)*E)
+        mesh = self._uniform_mesh_table(taus, E[0])
+        if mesh is not None:
+            G[:] = [ self._timeordered_three_tau_uniform_mesh(
+                mesh, dops, None if states_list is None else states_list[idx])
+                     for idx, dops in enumerate(dops_list) ]
+            G /= self.Z
+            return G
 
-        dops = self._operators_to_eigenbasis(ops)
-        op1, op2, op3, op4 = dops
+        E, t1, t2, t3 = [ self._kernel_cast(x) for x in [E, t1, t2, t3] ]
 
-        if True:
-            q_tac = np.einsum('tb,ab,bc->tac', et_b, op1, op2)
-            q_tca = np.einsum('td,cd,da->tca', et_d, op3, op4)
-            G = np.einsum('ta,tc,tac,tca->t', et_a, et_c, q_tac, q_tca)
-        else:
-            # Not efficient...
-            G = np.einsum(
-                'ta,tb,tc,td,ab,bc,cd,da->t',
-                et_a, et_b, et_c, et_d, op1, op2, op3, op4)
+        with self.profiler.stage('exponential_table', elements=4 * t1.size * E.size):
+            et_a = self._kernel_cast(np.exp((-self.beta + t1)*E))
+            et_b = self._kernel_cast(np.exp((t2-t1)*E))
+            et_c = self._kernel_cast(np.exp((t3-t2)*E))
+            et_d = self._kernel_cast(np.exp((-t3)*E))
+
+        for idx, dops in enumerate(dops_list):
+
+            op1, op2, op3, op4 = self._kernel_operators(dops)
+
+            if states_list is None:
+                e_a, e_b, e_c, e_d = et_a, et_b, et_c, et_d
+            else:
+                states = states_list[idx]
+                e_a, e_b, e_c, e_d = [ et[:, states] for et in [et_a, et_b, et_c, et_d] ]
+
+            N = e_a.shape[1]
+            with self.profiler.stage('contraction', flops=10 * t1.size * N**3):
+                q_tac = np.einsum('tb,ab,bc->tac', e_b, op1, op2)
+                q_tca = np.einsum('td,cd,da->tca', e_d, op3, op4)
+                G[idx] = np.einsum('ta,tc,tac,tca->t', e_a, e_c, q_tac, q_tca,
+                                   dtype=np.complex, casting='same_kind')
 
         G /= self.Z        
         return G
 
     # ------------------------------------------------------------------
-    def get_tau_greens_function_component(self, tau, op1, op2):
+    def _timeordered_three_tau_uniform_mesh(self, mesh, dops, states=None):
+
+        r""" Three time kernel on a uniform mesh, see _uniform_mesh_table.
+
+        With k = m_1 - m_2 and l = m_3 the sum factorizes as
+
+        G = \sum_{ac} T[M - m_1]_a P(k)_{ac} Q(l)_{ca} T[m_2 - m_3]_c
+
+        with P(k) = O_1 T[k] O_2 and Q(l) = O_3 T[l] O_4. The points are
+        grouped by (k, l) and the sum over a, c of each group is a GEMM
+        over the mesh index m_1. No exponentials are evaluated.
+
+        The Q(l) are kept for blocks of l of at most product_cache_bytes,
+        and the P(k) are recomputed once per block, so that the working
+        set is bounded independently of the mesh size. """
+
+        (m1, m2, m3), T = mesh
+        M, T = len(T) - 1, self._kernel_cast(T)
+        if states is not None: T = T[:, states]
+
+        op1, op2, op3, op4 = self._kernel_operators(dops)
+
+        G = np.zeros(len(m1), dtype=np.complex)
+
+        N = T.shape[1]
+        nblock = self.product_cache_size(N, T.itemsize)
+
+        # -- Groups sorted by the block of l, then k, then l
+        k, block = m1 - m2, m3 // nblock
+        key = (block * (M + 1) + k) * (M + 1) + m3
+        order = np.argsort(key, kind='mergesort')
+        keys, starts = np.unique(key[order], return_index=True)
+
+        nP = len(np.unique(block * (M + 1) + k))
+        nQ = len(np.unique(m3))
+        flops = 2 * N**3 * (nP + nQ) + 2 * N**2 * len(m1)
+
+        with self.profiler.stage('contraction', flops=flops):
+            P, k_P, Q, b_Q = None, None, {}, None
+            for bkl, pts in zip(keys, np.split(order, starts[1:])):
+                bk, l = divmod(bkl, M + 1)
+                b, k = divmod(bk, M + 1)
+                if b != b_Q: Q, b_Q, k_P = {}, b, None
+                if k != k_P: P, k_P = np.dot(op1 * T[k][None, :], op2), k
+                if l not in Q: Q[l] = np.dot(op3 * T[l][None, :], op4).T
+                G[pts] = np.sum(
+                    np.dot(T[M - m1[pts]], P * Q[l]) * T[m2[pts] - m3[pts]],
+                    axis=1, dtype=np.complex)
+
+        return G
+
+    # ------------------------------------------------------------------
+    def get_tau_greens_function_component(self, tau, op1, op2, prune_tol=None):
 
         r"""
         Returns:
         G^{(2)}(\tau) = -1/Z < O_1(\tau) O_2(0) >
+
+        With prune_tol the Lehmann terms are pruned, see _prune_operators,
+        and the bound on the error is stored in self.pruning_error_bound.
         """
 
         G = np.zeros((len(tau)), dtype=np.complex)
 
         op1_eig, op2_eig = self._operators_to_eigenbasis([op1, op2])
-        
-        et_p = np.exp((-self.beta + tau[:,None])*self.E[None,:])
-        et_m = np.exp(-tau[:,None]*self.E[None,:])
+
+        E = self.E
+        if prune_tol is not None:
+            states, (op1_eig, op2_eig), self.pruning_error_bound = \
+                self._prune_operators([op1_eig, op2_eig], prune_tol)
+            E = E[states]
+
+        mesh = self._uniform_mesh_table(tau, E)
+        if mesh is not None:
+            m, T = mesh
+            et_p, et_m = T[len(T) - 1 - m], T[m]
+        else:
+            et_p = np.exp((-self.beta + tau[:,None])*E[None,:])
+            et_m = np.exp(-tau[:,None]*E[None,:])
         
         G = -np.einsum('tn,tm,nm,mn->t', et_p, et_m, op1_eig, op2_eig)
 
@@ -329,33 +1038,475 @@ class SparseExactDiagonalization(object):
         return G
 
     # ------------------------------------------------------------------
-    def get_frequency_greens_function_component(self, iwn, op1, op2, xi):
-        
+    def get_legendre_greens_function_component(self, nl, op1, op2):
+
         r"""
         Returns:
-        G^{(2)}(i\omega_n) = -1/Z < O_1(i\omega_n) O_2(-i\omega_n) >
+        G_l = \sqrt{2l + 1} \int_0^\beta d\tau P_l(x(\tau)) G^{(2)}(\tau)
+        with x(\tau) = 2\tau/\beta - 1 and
+        G^{(2)}(\tau) = -1/Z < O_1(\tau) O_2(0) >, for l = 0, ..., nl - 1
+
+        Using \int_{-1}^1 dx P_l(x) e^{ax} = 2 i_l(a), with i_l the modified
+        spherical Bessel function, each Lehmann term gives
+
+        \beta e^{-\beta (E_n + E_m)/2} i_l(\beta (E_n - E_m)/2)
+
+        which is evaluated with exponentially scaled Bessel functions.
+
+        For the two-particle coefficients see
+        get_legendre_two_particle_greens_function.
         """
 
-        # -- Components of the Lehman expression
-        dE = - self.E[:, None] + self.E[None, :]
-        exp_bE = np.exp(-self.beta * self.E)
-        M = exp_bE[:, None] - xi * exp_bE[None, :]
+        op1_eig, op2_eig = self._operators_to_eigenbasis([op1, op2])
+
+        M = np.asarray(np.multiply(op1_eig, op2_eig.T))
+        n, m = np.nonzero(M)
+        M = M[n, m]
+
+        a = 0.5 * self.beta * (self.E[n] - self.E[m])
+        weight = self.beta * np.exp(-self.beta * np.minimum(self.E[n], self.E[m]))
+
+        l = np.arange(nl)
+        G = np.zeros((nl), dtype=np.complex)
+
+        # -- i_l(a) e^{-|a|} = sign(a)^l \sqrt{\pi/(2|a|)} ive(l + 1/2, |a|)
+        zero = (a == 0.)
+        abs_a = np.abs(a[~zero])
+        il = np.sign(a[~zero])[None, :]**l[:, None] * \
+            np.sqrt(0.5 * np.pi / abs_a)[None, :] * \
+            ive(l[:, None] + 0.5, abs_a[None, :])
 
-        inv_freq = iwn[:, None, None] - dE[None, :, :]
-        nonzero_idx = np.nonzero(inv_freq)
-        # -- Only eval for non-zero values
-        freq = np.zeros_like(inv_freq)
-        freq[nonzero_idx] = inv_freq[nonzero_idx]**(-1)
+        G += np.dot(il, M[~zero] * weight[~zero])
+        G[0] += np.sum(M[zero] * weight[zero])
+
+        G *= -np.sqrt(2 * l + 1) / self.Z
+        return G
+
+    # ------------------------------------------------------------------
+    def get_frequency_greens_function_component(self, iwn, op1, op2, xi,
+                                                chunk_size=None):
+        
+        r"""
+        Returns:
+        G^{(2)}(i\omega_n) = -1/Z < O_1(i\omega_n) O_2(-i\omega_n) >
+
+        The Lehmann sum is reduced to its poles and residues, see
+        _get_frequency_poles, and evaluated in chunks of chunk_size
+        frequencies. Terms with vanishing denominator are skipped.
+        """
 
         op1_eig, op2_eig = self._operators_to_eigenbasis([op1, op2])
+        poles, residues = self._get_frequency_poles(op1_eig, op2_eig, xi)
+
+        chunk_size = self._chunk_size('g2_iw', chunk_size)
+        if chunk_size is None: chunk_size = max(1, 2**20 // max(1, len(poles)))
 
-        # -- Compute Lehman sum for all operator combinations
         G = np.zeros((len(iwn)), dtype=np.complex)
-        G = np.einsum('nm,mn,nm,znm->z', op1_eig, op2_eig, M, freq)
+        for start in xrange(0, len(iwn), chunk_size):
+            chunk = slice(start, start + chunk_size)
+
+            inv_freq = iwn[chunk, None] - poles[None, :]
+            # -- Only eval for non-zero values
+            nonzero = inv_freq != 0
+            freq = np.zeros_like(inv_freq)
+            freq[nonzero] = inv_freq[nonzero]**(-1)
+
+            G[chunk] = np.dot(freq, residues)
+
         G /= self.Z
 
-        return G        
-    
+        return G
+
+    # ------------------------------------------------------------------
+    def _get_frequency_poles(self, op1_eig, op2_eig, xi, tol=1e-12):
+
+        r""" Poles E_m - E_n and residues
+        O_1[n, m] O_2[m, n] (e^{-\beta E_n} - \xi e^{-\beta E_m})
+        of the Lehmann sum for G(i\omega_n), times Z.
+
+        Only the pairs with non-zero residue are kept, and poles closer
+        than tol are merged by summing their residues. Returns the poles
+        in increasing order and their residues. """
+
+        exp_bE = np.exp(-self.beta * self.E)
+
+        n, m = np.nonzero(np.multiply(op1_eig, op2_eig.T))
+        residues = np.asarray(op1_eig)[n, m] * np.asarray(op2_eig)[m, n] * \
+            (exp_bE[n] - xi * exp_bE[m])
+
+        nonzero = residues != 0
+        n, m, residues = n[nonzero], m[nonzero], residues[nonzero]
+        poles = self.E[m] - self.E[n]
+
+        if len(poles) == 0:
+            return poles, residues.astype(np.complex)
+
+        # -- Merge degenerate poles
+
+        order = np.argsort(poles)
+        poles, residues = poles[order], residues[order]
+
+        group = np.concatenate(([0], np.cumsum(np.diff(poles) > tol)))
+        poles = np.bincount(group, weights=poles) / np.bincount(group)
+        residues = np.bincount(group, weights=residues.real) + \
+            1.j * np.bincount(group, weights=residues.imag)
+
+        return poles, residues
+
+    # ------------------------------------------------------------------
+    def _get_susceptibility_operators(self, ops):
+
+        """ Flattened eigenbasis operators X[i, n*N + m] = O_i[n, m] and
+        the expectation values < O_i >. """
+
+        dops = [ np.asarray(dop) for dop in self._operators_to_eigenbasis(ops) ]
+
+        exp_bE = np.exp(-self.beta * self.E) / self.Z
+        exp_val = np.array([ np.sum(exp_bE * np.diag(dop)) for dop in dops ])
+
+        X = np.array([ dop.flatten() for dop in dops ])
+
+        return X, exp_val
+
+    # ------------------------------------------------------------------
+    def get_tau_susceptibility(self, tau, ops, connected=True,
+                               chunk_size=None):
+
+        r""" Susceptibility matrix for the operators ops = [O_1, ..., O_n]
+
+        \chi_{ij}(\tau) = < O_i(\tau) O_j^\dagger(0) > - < O_i > < O_j^\dagger >
+
+        where the disconnected part is only subtracted when connected is
+        True. The operators are transformed to the eigenbasis once and
+        all components are contracted in one matrix product per chunk of
+        chunk_size times (by default the 'chi_tau' chunk size of the plan).
+        Returns (len(tau), n, n). """
+
+        X, exp_val = self._get_susceptibility_operators(ops)
+        N, nops = self.E.size, len(ops)
+
+        # -- Only eigenstate pairs with non-zero matrix elements
+        p = np.nonzero(np.any(X != 0, axis=0))[0]
+        X = X[:, p]
+        E_n, E_m = self.E[p // N], self.E[p % N]
+
+        chunk_size = self._chunk_size('chi_tau', chunk_size)
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // max(1, nops * len(p)))
+
+        chi = np.zeros((len(tau), nops, nops), dtype=np.complex)
+        for start in xrange(0, len(tau), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            t = tau[chunk, None]
+
+            K = np.exp((-self.beta + t) * E_n[None, :] - t * E_m[None, :])
+            XK = (K[:, None, :] * X[None, :, :]).reshape(-1, len(p))
+            chi[chunk] = np.dot(XK, X.conj().T).reshape(-1, nops, nops)
+
+        chi /= self.Z
+
+        if connected:
+            chi -= np.outer(exp_val, exp_val.conj())[None, :, :]
+
+        return chi
+
+    # ------------------------------------------------------------------
+    def get_frequency_susceptibility(self, iwn, ops, connected=True,
+                                     chunk_size=None, tol=1e-12):
+
+        r""" Susceptibility matrix in bosonic Matsubara frequencies
+
+        \chi_{ij}(i\Omega_n) = \int_0^\beta d\tau e^{i\Omega_n \tau} \chi_{ij}(\tau)
+            = 1/Z \sum_{nm} O_i[n, m] O_j^\dagger[m, n]
+              (e^{-\beta E_m} - e^{-\beta E_n}) / (i\Omega_n - E_m + E_n)
+
+        Eigenstates with |E_m - E_n| < tol are degenerate and contribute
+        the static term \beta e^{-\beta E_n} at \Omega_n = 0, where also
+        \beta < O_i > < O_j^\dagger > is subtracted when connected is True.
+        The frequencies are evaluated in chunks of chunk_size (by default
+        the 'chi_iw' chunk size of the plan). Returns (len(iwn), n, n). """
+
+        X, exp_val = self._get_susceptibility_operators(ops)
+        N, nops = self.E.size, len(ops)
+
+        p = np.nonzero(np.any(X != 0, axis=0))[0]
+        X = X[:, p]
+        E_n, E_m = self.E[p // N], self.E[p % N]
+
+        exp_bE_n, exp_bE_m = np.exp(-self.beta * E_n), np.exp(-self.beta * E_m)
+        dE = E_m - E_n
+        degenerate = np.abs(dE) < tol
+        nondeg = ~degenerate
+
+        chunk_size = self._chunk_size('chi_iw', chunk_size)
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // max(1, nops * len(p)))
+
+        chi = np.zeros((len(iwn), nops, nops), dtype=np.complex)
+        for start in xrange(0, len(iwn), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            w = iwn[chunk, None]
+
+            F = np.zeros((len(iwn[chunk]), len(p)), dtype=np.complex)
+            F[:, nondeg] = (exp_bE_m[nondeg] - exp_bE_n[nondeg]) / (w - dE[nondeg])
+
+            static = (iwn[chunk] == 0)
+            F[np.ix_(static, degenerate)] = self.beta * exp_bE_n[degenerate]
+
+            XF = (F[:, None, :] * X[None, :, :]).reshape(-1, len(p))
+            chi[chunk] = np.dot(XF, X.conj().T).reshape(-1, nops, nops)
+
+        chi /= self.Z
+
+        if connected:
+            chi[iwn == 0] -= self.beta * np.outer(exp_val, exp_val.conj())
+
+        return chi
+
+    # ------------------------------------------------------------------
+    def _get_operator_paths(self, dops, tol=0.):
+
+        """ Index paths (i_0, ..., i_n) and weights
+        O_0[i_0, i_1] O_1[i_1, i_2] ... O_n[i_n, i_0] of all non-zero
+        terms in the trace of the eigenbasis operators dops. """
+
+        mats = [ np.asarray(dop) for dop in dops ]
+
+        i0, i1 = np.nonzero(np.abs(mats[0]) > tol)
+        paths, weights = [i0, i1], mats[0][i0, i1]
+
+        for mat in mats[1:-1]:
+            csr = sparse.csr_matrix(np.where(np.abs(mat) > tol, mat, 0.))
+            csr.eliminate_zeros()
+
+            # -- Append all non-zero continuations of each path
+            counts = np.diff(csr.indptr)[paths[-1]]
+            rep = np.repeat(np.arange(len(weights)), counts)
+            pos = np.arange(np.sum(counts)) + np.repeat(
+                csr.indptr[paths[-1]] - np.cumsum(counts) + counts, counts)
+
+            paths = [ path[rep] for path in paths ] + [ csr.indices[pos] ]
+            weights = weights[rep] * csr.data[pos]
+
+        weights = weights * mats[-1][paths[-1], paths[0]]
+
+        nonzero = np.abs(weights) > tol
+        paths = [ path[nonzero] for path in paths ]
+        weights = weights[nonzero]
+
+        return paths, weights
+
+    # ------------------------------------------------------------------
+    def _timeordered_frequency_greens_function(
+            self, iw_cumulative, paths, weights, chunk_size=None):
+
+        r""" Fourier transform of a time ordered Green's function
+        over the ordered times beta > t_1 > ... > t_n > 0
+
+        \sum_p w_p e^{\beta x}[x_0, ..., x_n]
+
+        with x_0 = -E_{i_0} and x_k = -E_{i_k} + i\Omega_k, where
+        iw_cumulative (n, M) holds the cumulative frequencies i\Omega_k. """
+
+        n = len(paths) - 1
+        M = iw_cumulative.shape[-1]
+
+        if chunk_size is None: chunk_size = max(1, 2**20 / max(1, M))
+
+        G = np.zeros((M), dtype=np.complex)
+
+        flops = len(weights) * M * (n + 1)**2
+        with self.profiler.stage('contraction', flops=flops):
+            for start in xrange(0, len(weights), chunk_size):
+                chunk = slice(start, start + chunk_size)
+
+                z = np.empty((n + 1, len(weights[chunk]), M), dtype=np.complex)
+                z[0] = -self.E[paths[0][chunk]][:, None]
+                for k in xrange(1, n + 1):
+                    z[k] = -self.E[paths[k][chunk]][:, None] + \
+                        iw_cumulative[k - 1][None, :]
+
+                G += np.dot(weights[chunk], exp_divided_difference(self.beta * z))
+
+        G *= self.beta**n / self.Z
+        return G
+
+    # ------------------------------------------------------------------
+    def get_frequency_two_particle_greens_function(
+            self, iwn, ops, chunk_size=None):
+
+        r"""
+        iwn = [iw1, iw2, iw3] (3, M) Matsubara frequencies
+        ops = [O1, O2, O3, O4]
+
+        Returns:
+        G^{(4)}(iw1, iw2, iw3) = \int_0^\beta dt1 dt2 dt3
+            e^{iw1 t1 + iw2 t2 + iw3 t3} 1/Z < O1(t1) O2(t2) O3(t3) O4(0) >
+
+        Each of the six time orderings is integrated analytically,
+        including the equal energy and zero frequency terms, and summed
+        over the non-zero matrix element paths only.
+        """
+
+        assert( len(ops) == 4 )
+
+        iwn = np.asarray(iwn, dtype=np.complex)
+        assert( iwn.shape[0] == 3 )
+
+        dops = self._operators_to_eigenbasis(ops)
+        keys = self.get_operator_keys(ops)
+
+        G = np.zeros((iwn.shape[-1]), dtype=np.complex)
+
+        paths = {}
+        for func, perm, perm_sign in CubeTetrasBase().get_tetra_list():
+
+            string = tuple([ keys[i] for i in perm + [3] ])
+            if string not in paths:
+                paths[string] = self._get_operator_paths(
+                    [ dops[i] for i in perm + [3] ])
+
+            iw_cumulative = np.cumsum(iwn[perm], axis=0)
+
+            G += perm_sign * self._timeordered_frequency_greens_function(
+                iw_cumulative, *paths[string], chunk_size=chunk_size)
+
+        return G
+
+    # ------------------------------------------------------------------
+    def get_legendre_two_particle_greens_function(
+            self, nl, iwn, ops, nquad=None, chunk_size=None):
+
+        r"""
+        nl number of Legendre coefficients
+        iwn (M) bosonic Matsubara frequencies
+        ops = [O1, O2, O3, O4]
+
+        Returns (M, nl, nl):
+        G^{(4)}_{ll'}(i\omega) = \sqrt{2l + 1} \sqrt{2l' + 1}
+            \int_0^\beta dt1 dt2 dt3 s(t_{12}) P_l(x(t_{12} mod \beta))
+            P_{l'}(x(t3)) e^{i\omega t2} 1/Z < O1(t1) O2(t2) O3(t3) O4(0) >
+
+        with t_{12} = t1 - t2, s(t) = -1 for t < 0 and +1 otherwise,
+        and x(t) = 2t/\beta - 1. The Matsubara two-particle Green's
+        function is recovered as
+
+        G^{(4)}(i\nu, i\omega - i\nu, i\nu') =
+            \sum_{ll'} T_{\nu l} G^{(4)}_{ll'}(i\omega) T_{\nu' l'}
+
+        with T_{\nu l} = \sqrt{2l + 1} e^{i\nu\beta/2} i^l j_l(\nu\beta/2),
+        see get_frequency_two_particle_greens_function.
+
+        In each of the six time orderings the integrand is a polynomial
+        times exponentials of the times, and the integral is evaluated
+        with the Gauss rule of ordered_gauss_tau3 on nquad**3 points,
+        using the exact time ordered Green's function of
+        _timeordered_three_tau_greens_functions on every point. The error
+        decays exponentially in nquad once nquad exceeds nl and \beta
+        times the energy and frequency range, which sets the default.
+        The cost is 10 nquad**3 N**3 flops per class of time orderings,
+        see get_tetra_classes, evaluated in chunks of chunk_size points
+        (by default the 'g4_legendre' chunk size of the plan).
+        """
+
+        assert( len(ops) == 4 )
+
+        iwn = np.asarray(iwn, dtype=np.complex)
+
+        if nquad is None:
+            w_max = np.max(np.abs(iwn)) if iwn.size > 0 else 0.
+            nquad = nl + 8 + int(np.ceil(
+                0.35 * self.beta * (np.ptp(self.E) + w_max)))
+
+        dops = self._operators_to_eigenbasis(ops)
+        keys = self.get_operator_keys(ops)
+
+        nodes, quad_weights = ordered_gauss_tau3(nquad, self.beta)
+        l = np.arange(nl)
+
+        G = np.zeros((len(iwn), nl, nl), dtype=np.complex)
+
+        chunk_size = self._chunk_size('g4_legendre', chunk_size)
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // max(self.E.size**2, len(iwn) * nl))
+
+        tetra_list = CubeTetrasBase().get_tetra_list()
+        for tetra_class in CubeTetrasBase().get_tetra_classes(keys):
+
+            perm = tetra_list[tetra_class[0]][1]
+            dops_perm = [ dops[i] for i in perm + [3] ]
+
+            for start in xrange(0, nodes.shape[-1], chunk_size):
+                chunk = slice(start, start + chunk_size)
+
+                # -- Time ordered Green's function on the sorted times
+                G_sorted = self._timeordered_three_tau_greens_functions(
+                    nodes[:, chunk], [dops_perm])[0] * quad_weights[chunk]
+
+                for tidx in tetra_class:
+                    func, perm, perm_sign = tetra_list[tidx]
+
+                    tau = np.empty_like(nodes[:, chunk])
+                    tau[perm] = nodes[:, chunk]
+
+                    t12 = tau[0] - tau[1]
+                    sign = np.where(t12 < 0., -1., 1.)
+                    P12 = eval_legendre(
+                        l[:, None], 2. * np.mod(t12, self.beta)[None, :] / self.beta - 1.)
+                    P3 = eval_legendre(l[:, None], 2. * tau[2][None, :] / self.beta - 1.)
+
+                    a = perm_sign * sign * G_sorted
+                    for widx, w in enumerate(iwn):
+                        G[widx] += np.dot(P12 * (a * np.exp(w * tau[1]))[None, :], P3.T)
+
+        norm = np.sqrt(2 * l + 1)
+        G *= norm[None, :, None] * norm[None, None, :]
+
+        return G
+
+    # ------------------------------------------------------------------
+    def get_frequency_three_point_greens_function(
+            self, iwn, ops, xi, chunk_size=None):
+
+        r"""
+        iwn = [iw1, iw2] (2, M) Matsubara frequencies
+        ops = [O1, O2, O3]
+
+        Returns:
+        G^{(3)}(iw1, iw2) = \int_0^\beta dt1 dt2
+            e^{iw1 t1 + iw2 t2} 1/Z < T O1(t1) O2(t2) O3(0) >
+
+        where xi is the sign of exchanging O1 and O2 in the time ordering,
+        -1 if both are fermionic and +1 otherwise. Both time orderings are
+        integrated analytically, see _timeordered_frequency_greens_function,
+        and summed over the non-zero matrix element paths only.
+        """
+
+        assert( len(ops) == 3 )
+
+        iwn = np.asarray(iwn, dtype=np.complex)
+        assert( iwn.shape[0] == 2 )
+
+        dops = self._operators_to_eigenbasis(ops)
+        keys = self.get_operator_keys(ops)
+
+        G = np.zeros((iwn.shape[-1]), dtype=np.complex)
+
+        paths = {}
+        for perm, perm_sign in [ ([0, 1], +1), ([1, 0], xi) ]:
+
+            string = tuple([ keys[i] for i in perm + [2] ])
+            if string not in paths:
+                paths[string] = self._get_operator_paths(
+                    [ dops[i] for i in perm + [2] ])
+
+            iw_cumulative = np.cumsum(iwn[perm], axis=0)
+
+            G += perm_sign * self._timeordered_frequency_greens_function(
+                iw_cumulative, *paths[string], chunk_size=chunk_size)
+
+        return G
+
     # ------------------------------------------------------------------
     def get_high_frequency_tail_coeff_component(
             self, op1, op2, xi, Norder=3):
@@ -386,8 +1537,23 @@ class SparseExactDiagonalization(object):
         c_k = (-1)^(k-1) (\xi G^{(k-1)}(\beta^-) - G^{(k-1)}(0^+)) 
             = (-1)^k < [ [[ H , b ]]^{(k-1)} , b^+ ]_{-\xi} >
 
+        With the full spectrum the commutators are diagonal in the
+        eigenbasis and c_k are the spectral moments of the Lehmann poles
+
+        c_k = 1/Z \sum_{nm} (E_m - E_n)^{k-1} b_{nm} b^+_{mn}
+                             (e^{-\beta E_n} - \xi e^{-\beta E_m})
+
+        see _get_frequency_poles. With a truncated spectrum (nstates) the
+        commutators are formed with the sparse Hamiltonian.
         """
 
+        if self.nstates is None and self.hermitian:
+            op1_eig, op2_eig = self._operators_to_eigenbasis([op1, op2])
+            poles, residues = self._get_frequency_poles(op1_eig, op2_eig, xi)
+
+            moments = poles[None, :] ** np.arange(Norder)[:, None]
+            return np.dot(moments, residues) / self.Z
+
         def xi_commutator(A, B, xi):
             return A * B - xi * B * A
             
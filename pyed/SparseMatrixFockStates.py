@@ -8,21 +8,181 @@ Author: Hugo U. R. Strand (2017), hugo.strand@gmail.com
 
 # ----------------------------------------------------------------------
 
+import itertools
 import numpy as np
 
+from collections import OrderedDict
 from scipy import sparse
 
+from Instrumentation import null_profiler
+
+# ----------------------------------------------------------------------
+class LRUCache(object):
+
+    """ Dictionary with bounded size evicting the least recently used
+    entries, with hit and miss statistics. maxsize=None is unbounded
+    and maxsize=0 disables the cache. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, maxsize=None):
+
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    # ------------------------------------------------------------------
+    def get(self, key):
+
+        if key in self.data:
+            self.hits += 1
+            value = self.data.pop(key)
+            self.data[key] = value
+            return value
+
+        self.misses += 1
+        return None
+
+    # ------------------------------------------------------------------
+    def put(self, key, value):
+
+        if self.maxsize == 0: return
+
+        self.data.pop(key, None)
+        self.data[key] = value
+
+        if self.maxsize is not None:
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self.data), maxsize=self.maxsize)
+
+    # ------------------------------------------------------------------
+    def clear(self):
+        self.data.clear()
+        self.hits, self.misses = 0, 0
+
+# ----------------------------------------------------------------------
+def _parity_below(states, mask):
+
+    """ Parity (0 or 1) of the number of occupied orbitals in states
+    below each orbital in mask, summed over the orbitals in mask. """
+
+    parity = np.zeros_like(states)
+    orbital = 0
+    while mask >> orbital:
+        if (mask >> orbital) & 1:
+            below = states & ((1 << orbital) - 1)
+            while below.any():
+                parity ^= below & 1
+                below = below >> 1
+        orbital += 1
+
+    return parity
+
+# ----------------------------------------------------------------------
+class CompactOperator(object):
+
+    r""" Compact representation of a fermionic operator as a sum of
+    normal ordered monomials
+
+    coefficient * c^+_{a_1} c^+_{a_2} ... c_{b_1} c_{b_2} ...
+
+    with a_1 < a_2 < ... and b_1 < b_2 < ... encoded as the integer bit
+    masks A = \sum_k 2^{a_k} and B = \sum_k 2^{b_k}. The occupation
+    number states |s> are ordered as in SparseMatrixCreationOperators,
+    with orbital i occupied when bit i of s is set.
+
+    The representation only depends on numpy and can be passed to
+    processes that never import pytriqs. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, creation_masks, annihilation_masks, coefficients,
+                 nfermions):
+
+        self.creation_masks = np.array(creation_masks, dtype=np.int64)
+        self.annihilation_masks = np.array(annihilation_masks, dtype=np.int64)
+        self.coefficients = np.array(coefficients)
+        self.nfermions = nfermions
+        self.nstates = 2**nfermions
+
+    # ------------------------------------------------------------------
+    def _monomial_action(self, A, B, states):
+
+        """ Image states, signs and mask of the states with non-zero
+        image of the monomial (A, B) acting on states. """
+
+        valid = (states & B) == B
+        states_b = states ^ B
+        valid &= (states_b & A) == 0
+        image = states_b | A
+
+        parity = _parity_below(states, B) ^ _parity_below(states_b, A)
+        sign = 1 - 2 * parity
+
+        return image, sign, valid
+
+    # ------------------------------------------------------------------
+    def sparse_matrix(self):
+
+        """ Sparse CSR matrix of the operator on the Fock space. """
+
+        states = np.arange(self.nstates, dtype=np.int64)
+
+        rows, cols, data = [], [], []
+        for A, B, coef in zip(self.creation_masks, self.annihilation_masks,
+                              self.coefficients):
+            image, sign, valid = self._monomial_action(A, B, states)
+            rows.append(image[valid])
+            cols.append(states[valid])
+            data.append(coef * sign[valid])
+
+        return sparse.coo_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(self.nstates, self.nstates)).tocsr()
+
+    # ------------------------------------------------------------------
+    def dot(self, v):
+
+        """ Apply the operator to the state vectors v of shape (nstates,)
+        or (nstates, k) without building the matrix. """
+
+        v = np.asarray(v)
+        states = np.arange(self.nstates, dtype=np.int64)
+
+        dtype = np.result_type(v.dtype, self.coefficients.dtype)
+        out = np.zeros(v.shape, dtype=dtype)
+
+        for A, B, coef in zip(self.creation_masks, self.annihilation_masks,
+                              self.coefficients):
+            image, sign, valid = self._monomial_action(A, B, states)
+            # -- The map of a monomial is injective, no repeated images
+            weight = (coef * sign[valid]).reshape((-1,) + (1,) * (v.ndim - 1))
+            out[image[valid]] += weight * v[valid]
+
+        return out
+
 # ----------------------------------------------------------------------
 class SparseMatrixRepresentation(object):
 
     """ Generator for sparse matrix representations of 
     Triqs operator expressions, given a set of fundamental 
-    creation operators. """
+    creation operators.
+
+    Compiled monomials and expressions are cached in registries with
+    least recently used eviction, the returned matrices are shared and
+    should not be modified in place. Cache misses are recorded as the
+    stage 'operator_compilation' of the optional profiler. """
     
     # ------------------------------------------------------------------
-    def __init__(self, fundamental_operators):
+    def __init__(self, fundamental_operators,
+                 monomial_cache_size=4096, expression_cache_size=1024,
+                 profiler=None):
 
         self.fundamental_operators = fundamental_operators
+        self.profiler = profiler if profiler is not None else null_profiler
 
         self.operator_labels = []
         for operator_expression in fundamental_operators:
@@ -51,31 +211,266 @@ class SparseMatrixRepresentation(object):
         self.sparse_operators = \
             SparseMatrixCreationOperators(self.nfermions)
 
+        self.operator_index = dict([
+            (tuple(idx), oidx) for oidx, (dag, idx) in enumerate(self.operator_labels) ])
+
+        self.monomial_cache = LRUCache(monomial_cache_size)
+        self.expression_cache = LRUCache(expression_cache_size)
+
     # ------------------------------------------------------------------
     def sparse_matrix(self, triqs_operator_expression):
 
         """ Convert a general Triqs operator expression to a sparse
         matrix representation. """
-        
-        matrix_rep = 0.0 * self.sparse_operators.I
-    
-        for term, coef in triqs_operator_expression:
 
-            product = coef * self.sparse_operators.I
-            
-            for fact in term:
+        terms = [ (tuple([ (dagger, tuple(idx)) for dagger, idx in term ]), coef)
+                  for term, coef in triqs_operator_expression ]
+        key = tuple(terms)
 
-                dagger, idx = fact
-                oidx = self.operator_labels.index((False, idx))
+        matrix_rep = self.expression_cache.get(key)
+        if matrix_rep is not None: return matrix_rep
 
-                op = self.sparse_operators.c_dag[oidx]
-                if not dagger: op = op.getH()                
+        with self.profiler.stage('operator_compilation', monomials=len(terms)):
+            matrix_rep = 0.0 * self.sparse_operators.I
 
-                product = product * op
+            for monomial, coef in terms:
+                matrix_rep = matrix_rep + coef * self.monomial_matrix(monomial)
 
-            matrix_rep = matrix_rep + product
-            
+        self.expression_cache.put(key, matrix_rep)
         return matrix_rep
+
+    # ------------------------------------------------------------------
+    def monomial_matrix(self, monomial):
+
+        """ Sparse matrix of the product of creation and annihilation
+        operators monomial = ((dagger, idx), ...). """
+
+        product = self.monomial_cache.get(monomial)
+        if product is not None: return product
+
+        masks = self._monomial_masks(monomial)
+
+        if masks is not None:
+            A, B, sign = masks
+            product = CompactOperator(
+                [A], [B], [float(sign)], self.nfermions).sparse_matrix()
+        else:
+            product = self.sparse_operators.I
+            for dagger, idx in monomial:
+                op = self.sparse_operators.c_dag[self.operator_index[idx]]
+                if not dagger: op = op.getH()
+                product = product * op
+
+        product = product.tocsr()
+        self.monomial_cache.put(monomial, product)
+        return product
+
+    # ------------------------------------------------------------------
+    def _monomial_masks(self, monomial):
+
+        """ Creation and annihilation bit masks and the reordering sign
+        of a normal ordered monomial, or None if it is not normal
+        ordered, or zero due to a repeated operator. """
+
+        daggers = [ dagger for dagger, idx in monomial ]
+        if daggers != sorted(daggers, reverse=True): return None
+
+        oidx = [ self.operator_index[idx] for dagger, idx in monomial ]
+        a = [ o for o, dagger in zip(oidx, daggers) if dagger ]
+        b = [ o for o, dagger in zip(oidx, daggers) if not dagger ]
+
+        if len(set(a)) != len(a) or len(set(b)) != len(b): return None
+
+        # -- Parity of the permutations sorting the operators
+        inversions = sum([ x > y for x, y in itertools.combinations(a, 2) ]) + \
+                     sum([ x > y for x, y in itertools.combinations(b, 2) ])
+
+        A = sum([ 1 << o for o in a ])
+        B = sum([ 1 << o for o in b ])
+
+        return A, B, 1 - 2 * (inversions % 2)
+
+    # ------------------------------------------------------------------
+    def compact_operator(self, triqs_operator_expression):
+
+        """ Convert a Triqs operator expression to a CompactOperator,
+        e.g. for passing operators to processes without pytriqs. """
+
+        A, B, coefficients = [], [], []
+        for term, coef in triqs_operator_expression:
+            monomial = tuple([ (dagger, tuple(idx)) for dagger, idx in term ])
+            masks = self._monomial_masks(monomial)
+            assert( masks is not None ), \
+                "ERROR: Only normal ordered monomials have a compact representation!"
+            A.append(masks[0])
+            B.append(masks[1])
+            coefficients.append(coef * masks[2])
+
+        return CompactOperator(A, B, coefficients, self.nfermions)
+
+    # ------------------------------------------------------------------
+    def _orbital_permutation(self, perm):
+
+        """ Permutation of the fundamental operators, given as a list of
+        indices or as a function mapping the operator index tuples. """
+
+        if callable(perm):
+            perm = [ self.operator_index[tuple(perm(tuple(idx)))]
+                     for dag, idx in self.operator_labels ]
+
+        perm = np.array(perm, dtype=np.int)
+        assert( sorted(perm) == range(self.nfermions) ), \
+            "ERROR: Not a permutation of the fundamental operators!"
+
+        return perm
+
+    # ------------------------------------------------------------------
+    def _orbital_charges(self, charge):
+
+        if callable(charge):
+            charge = [ charge(tuple(idx)) for dag, idx in self.operator_labels ]
+
+        charge = np.array(charge, dtype=np.int)
+        assert( charge.shape == (self.nfermions,) )
+
+        return charge
+
+    # ------------------------------------------------------------------
+    def _fock_permutation_action(self, perm):
+
+        """ Fock state images and signs of the transformation
+        T c^+_i T^{-1} = c^+_{perm[i]}, acting on the occupation number
+        states |s> = c^+_{i_1} c^+_{i_2} ... |0> with i_1 < i_2 < ...
+        The sign is the parity of the inversions of the permuted
+        operator string. """
+
+        states = np.arange(self.sparse_operators.nstates)
+        occ = (states[:, None] >> np.arange(self.nfermions)[None, :]) & 1
+
+        image = np.sum(occ << perm[None, :], axis=1)
+
+        inversions = np.zeros_like(states)
+        for i, j in itertools.combinations(range(self.nfermions), 2):
+            if perm[i] > perm[j]: inversions += occ[:, i] & occ[:, j]
+
+        sign = 1 - 2 * (inversions % 2)
+
+        return image, sign
+
+    # ------------------------------------------------------------------
+    def fock_permutation(self, perm):
+
+        """ Sparse matrix of the Fock space transformation T with
+        T c^+_i T^{-1} = c^+_{perm[i]}, perm is a list of indices of the
+        fundamental operators or a function mapping their index tuples. """
+
+        image, sign = self._fock_permutation_action(self._orbital_permutation(perm))
+        nstates = self.sparse_operators.nstates
+
+        return sparse.coo_matrix(
+            (sign.astype(np.float), (image, np.arange(nstates))),
+            shape=(nstates, nstates)).tocsr()
+
+    # ------------------------------------------------------------------
+    def get_symmetry_sectors(self, translations=None, charges=None, tol=1e-10):
+
+        r""" Symmetry adapted basis of the Fock space.
+
+        translations are generators of an abelian group of permutations of
+        the fundamental operators (e.g. the lattice translations of
+        c(spin, site)), given as lists of indices or as functions mapping
+        the operator index tuples. The generators must commute and be
+        independent. charges are conserved one-body charges
+        Q = \sum_i q_i n_i, given as lists of q_i or functions of the index
+        tuples, by default the particle number.
+
+        Within every charge sector the Bloch states
+
+        |r, k> \propto \sum_a e^{-i k a} T^a |r>, k_j = 2 \pi m_j / L_j
+
+        are built from the orbit representatives r (the smallest state
+        in each orbit) and the group elements T^a = T_1^{a_1} T_2^{a_2} ...,
+        with L_j the order of T_j. Representatives whose Bloch state
+        vanishes, due to the fermionic signs, are dropped.
+
+        Returns a list of ((m, q), B) with the momentum m = (m_1, ...),
+        the charges q = (Q_1, ...) and B a sparse matrix with the
+        orthonormal basis of the sector as columns. """
+
+        if translations is None: translations = []
+        if charges is None: charges = [ np.ones((self.nfermions), dtype=np.int) ]
+
+        gens = [ self._orbital_permutation(perm) for perm in translations ]
+        charges = [ self._orbital_charges(charge) for charge in charges ]
+
+        for perm in gens:
+            for charge in charges:
+                assert( (charge[perm] == charge).all() ), \
+                    "ERROR: The translations do not conserve the charges!"
+
+        # -- Orders of the generators and all group elements
+
+        orders = []
+        for perm in gens:
+            order, p = 1, perm
+            while (p != np.arange(self.nfermions)).any():
+                p, order = perm[p], order + 1
+            orders.append(order)
+
+        group = []
+        for exps in itertools.product(*[ range(order) for order in orders ]):
+            p = np.arange(self.nfermions)
+            for perm, a in zip(gens, exps):
+                for i in xrange(a): p = perm[p]
+            image, sign = self._fock_permutation_action(p)
+            group.append((np.array(exps), image, sign))
+
+        # -- Charge sectors and orbit representatives
+
+        nstates = self.sparse_operators.nstates
+        states = np.arange(nstates)
+        occ = (states[:, None] >> np.arange(self.nfermions)[None, :]) & 1
+
+        Q = np.array([ occ.dot(charge) for charge in charges ]).T
+        rep = np.min(np.array([ image for exps, image, sign in group ]), axis=0)
+
+        sectors = []
+        for q in sorted(set(map(tuple, Q))):
+
+            in_sector = np.all(Q == np.array(q)[None, :], axis=1)
+            reps = np.nonzero(in_sector & (rep == states))[0]
+
+            for m in itertools.product(*[ range(order) for order in orders ]):
+
+                k = 2 * np.pi * np.array(m, dtype=np.float) / np.array(orders)
+
+                rows, cols, data = [], [], []
+                for exps, image, sign in group:
+                    rows.append(image[reps])
+                    cols.append(np.arange(len(reps)))
+                    data.append(np.exp(-1.j * np.dot(k, exps)) * sign[reps])
+
+                B = sparse.coo_matrix(
+                    (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                    shape=(nstates, len(reps))).tocsc()
+
+                norm = np.sqrt(np.asarray(abs(B).power(2).sum(axis=0))).flatten()
+                keep = np.nonzero(norm > tol)[0]
+                if len(keep) == 0: continue
+
+                B = B[:, keep] * sparse.diags(1. / norm[keep])
+
+                sectors.append(((tuple(m), q), B.tocsr()))
+
+        return sectors
+
+    # ------------------------------------------------------------------
+    def get_cache_info(self):
+
+        """ Hit and miss statistics of the operator registries. """
+
+        return dict(monomials=self.monomial_cache.info(),
+                    expressions=self.expression_cache.info())
     
 # ----------------------------------------------------------------------
 class SparseMatrixCreationOperators:
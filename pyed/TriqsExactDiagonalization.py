@@ -10,29 +10,25 @@ Author: Hugo U. R. Strand (2017), hugo.strand@gmail.com
 import itertools
 import numpy as np
 
-# ----------------------------------------------------------------------
-
-from pytriqs.gf import MeshImTime, MeshProduct
+from scipy import sparse
 
 # ----------------------------------------------------------------------
 
 from pyed.CubeTetras import CubeTetrasMesh, enumerate_tau3
 from pyed.SquareTriangles import SquareTrianglesMesh, enumerate_tau2
 from pyed.SparseExactDiagonalization import SparseExactDiagonalization
+from pyed.BatchExactDiagonalization import BatchExactDiagonalization
+from pyed.CheckpointHDF5 import write_g4_tau_hdf5, read_g4_tau_hdf5
 from pyed.SparseMatrixFockStates import SparseMatrixRepresentation
+from pyed.Instrumentation import null_profiler
 
 # ----------------------------------------------------------------------
-class TriqsExactDiagonalization(object):
-    
-    """ Exact diagonalization for Triqs operator expressions. """
+class _TriqsExactDiagonalizationBase(object):
 
-    # ------------------------------------------------------------------
-    def __init__(self, H, fundamental_operators, beta):
-
-        self.beta = beta
-        self.rep = SparseMatrixRepresentation(fundamental_operators)
-        self.ed = SparseExactDiagonalization(
-            self.rep.sparse_matrix(H), beta)
+    """ Operator and Green's function setters common to the single and
+    the batch exact diagonalization. The setters take one Green's
+    function per instance, mapped by _gf_list, and the solver results
+    have the instances on their first axis, mapped by _instance_data. """
 
     # ------------------------------------------------------------------
     def get_expectation_value(self, op):
@@ -47,52 +43,63 @@ class TriqsExactDiagonalization(object):
         return self.ed.get_density_matrix()
     def get_ground_state_energy(self):
         return self.ed.get_ground_state_energy()
-        
+
     # ------------------------------------------------------------------
     def set_g2_tau(self, g_tau, op1, op2):
 
-        assert( type(g_tau.mesh) == MeshImTime )
-        assert( self.beta == g_tau.mesh.beta )
-        assert( g_tau.target_shape == (1, 1) )
-    
+        from pytriqs.gf import MeshImTime
+
+        g_tau_list = self._gf_list(g_tau)
+        assert( type(g_tau_list[0].mesh) == MeshImTime )
+        assert( self.beta == g_tau_list[0].mesh.beta )
+
         op1_mat = self.rep.sparse_matrix(op1)
-        op2_mat = self.rep.sparse_matrix(op2)        
+        op2_mat = self.rep.sparse_matrix(op2)
+
+        tau = np.array([tau for tau in g_tau_list[0].mesh])
+
+        G = self._instance_data(self.ed.get_tau_greens_function_component(
+            tau, op1_mat, op2_mat))
 
-        tau = np.array([tau for tau in g_tau.mesh])
- 
-        g_tau.data[:, 0, 0] = \
-            self.ed.get_tau_greens_function_component(
-                tau, op1_mat, op2_mat)
+        for g, data in zip(g_tau_list, G):
+            assert( g.target_shape == (1, 1) )
+            g.data[:, 0, 0] = data
 
         self.set_tail(g_tau, op1_mat, op2_mat)
-        
+
     # ------------------------------------------------------------------
     def set_g2_iwn(self, g_iwn, op1, op2):
 
-        assert( self.beta == g_iwn.mesh.beta )
-        assert( g_iwn.target_shape == (1, 1) )
-    
+        g_iwn_list = self._gf_list(g_iwn)
+        assert( self.beta == g_iwn_list[0].mesh.beta )
+
         op1_mat = self.rep.sparse_matrix(op1)
-        op2_mat = self.rep.sparse_matrix(op2)        
+        op2_mat = self.rep.sparse_matrix(op2)
 
-        iwn = np.array([iwn for iwn in g_iwn.mesh])
-        
-        g_iwn.data[:, 0, 0] = \
-            self.ed.get_frequency_greens_function_component(
-                iwn, op1_mat, op2_mat, self.xi(g_iwn.mesh))
+        iwn = np.array([iwn for iwn in g_iwn_list[0].mesh])
+
+        G = self._instance_data(self.ed.get_frequency_greens_function_component(
+            iwn, op1_mat, op2_mat, self.xi(g_iwn_list[0].mesh)))
+
+        for g, data in zip(g_iwn_list, G):
+            assert( g.target_shape == (1, 1) )
+            g.data[:, 0, 0] = data
 
         self.set_tail(g_iwn, op1_mat, op2_mat)
 
     # ------------------------------------------------------------------
     def set_tail(self, g, op1_mat, op2_mat):
 
-        tail = g.tail
+        g_list = self._gf_list(g)
+        order_max = g_list[0].tail.order_max
 
-        raw_tail = self.ed.get_high_frequency_tail_coeff_component(
-            op1_mat, op2_mat, self.xi(g.mesh), Norder=tail.order_max)
+        raw_tails = self._instance_data(
+            self.ed.get_high_frequency_tail_coeff_component(
+                op1_mat, op2_mat, self.xi(g_list[0].mesh), Norder=order_max))
 
-        for idx in xrange(tail.order_max):
-            tail[idx+1][:] = raw_tail[idx]
+        for g, raw_tail in zip(g_list, raw_tails):
+            for idx in xrange(order_max):
+                g.tail[idx+1][:] = raw_tail[idx]
 
     # ------------------------------------------------------------------
     def xi(self, mesh):
@@ -100,6 +107,149 @@ class TriqsExactDiagonalization(object):
         elif mesh.statistic == 'Boson': return +1.0
         else: raise NotImplementedError
 
+# ----------------------------------------------------------------------
+class TriqsExactDiagonalization(_TriqsExactDiagonalizationBase):
+    
+    """ Exact diagonalization for Triqs operator expressions.
+
+    The pytriqs Green's function containers are only imported by
+    the Green's function setters. """
+
+    # ------------------------------------------------------------------
+    def __init__(self, H, fundamental_operators, beta,
+                 translations=None, charges=None, nstates=None,
+                 precision='double', profiler=None, plan=None):
+
+        """ H is a Triqs operator expression, or a scipy sparse matrix
+        in the Fock space of the fundamental operators, e.g. from
+        pyed.HamiltonianTemplate.
+
+        With translations and/or charges H is diagonalized in the
+        momentum and charge sectors, see
+        SparseMatrixRepresentation.get_symmetry_sectors.
+
+        With nstates only the nstates lowest eigenstates are computed,
+        and the two-particle Green's functions are evaluated by Krylov
+        propagation of the intermediate states, see
+        SparseExactDiagonalization.get_timeordered_greens_function_krylov.
+
+        precision='single' evaluates the two-particle functions in single
+        precision, see SparseExactDiagonalization.
+
+        profiler is an optional pyed.Instrumentation.Profiler shared by
+        the operator compilation and the solver stages.
+
+        plan is an optional pyed.ResourcePlanner.ExecutionPlan, which sets
+        nstates, precision and the kernel chunk sizes, and the particle
+        number sectors if plan.use_sectors and no charges are given. """
+
+        if profiler is None: profiler = null_profiler
+        rep = SparseMatrixRepresentation(
+            fundamental_operators, profiler=profiler)
+
+        if plan is not None and plan.use_sectors and charges is None:
+            charges = plan.charges
+
+        blocks = None
+        if translations is not None or charges is not None:
+            sectors = rep.get_symmetry_sectors(
+                translations=translations, charges=charges)
+            blocks = [ B for label, B in sectors ]
+
+        if not sparse.issparse(H): H = rep.sparse_matrix(H)
+        ed = SparseExactDiagonalization(
+            H, beta, nstates=nstates, blocks=blocks, precision=precision,
+            profiler=profiler, plan=plan)
+
+        self._set_solver(ed, rep, beta, profiler)
+
+    # ------------------------------------------------------------------
+    def _set_solver(self, ed, rep, beta, profiler=None):
+
+        """ Wraps the SparseExactDiagonalization ed in the Fock space of
+        the SparseMatrixRepresentation rep, for __init__ and the instances
+        of TriqsBatchExactDiagonalization. """
+
+        self.ed, self.rep, self.beta = ed, rep, beta
+        self.profiler = profiler if profiler is not None else null_profiler
+
+    # ------------------------------------------------------------------
+    def _gf_list(self, g):
+        return [ g ]
+
+    def _instance_data(self, data):
+        return [ data ]
+
+
+    # ------------------------------------------------------------------
+    def get_reduced_density_matrices(self, ops=None):
+
+        """ One- and two-particle density matrices < c_i^+ c_j > and
+        < c_i^+ c_j^+ c_k c_l > for the annihilation operators ops,
+        by default the fundamental operators. """
+
+        if ops is None: ops = self.rep.fundamental_operators
+        ops_mat = [ self.rep.sparse_matrix(op) for op in ops ]
+
+        return self.ed.get_reduced_density_matrices(ops_mat)
+
+    # ------------------------------------------------------------------
+    def set_g2_legendre(self, g_l, op1, op2):
+
+        """ Legendre coefficients of the single-particle Green's function,
+        see SparseExactDiagonalization.get_legendre_greens_function_component.
+        For the two-particle coefficients see set_g4_legendre. """
+
+        assert( self.beta == g_l.mesh.beta )
+        assert( g_l.target_shape == (1, 1) )
+
+        op1_mat = self.rep.sparse_matrix(op1)
+        op2_mat = self.rep.sparse_matrix(op2)
+
+        g_l.data[:, 0, 0] = \
+            self.ed.get_legendre_greens_function_component(
+                g_l.data.shape[0], op1_mat, op2_mat)
+
+    # ------------------------------------------------------------------
+    def set_chi_tau(self, chi_tau, ops, connected=True):
+
+        """ Susceptibility matrix for the operators ops
+        chi_ij(tau) = < O_i(tau) O_j^+(0) > - < O_i > < O_j^+ >
+        with the disconnected part subtracted when connected is True. """
+
+        from pytriqs.gf import MeshImTime
+
+        assert( type(chi_tau.mesh) == MeshImTime )
+        assert( self.beta == chi_tau.mesh.beta )
+        assert( chi_tau.target_shape == (len(ops), len(ops)) )
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in ops ]
+        tau = np.array([ t.real for t in chi_tau.mesh ])
+
+        chi_tau.data[:] = self.ed.get_tau_susceptibility(
+            tau, ops_mat, connected=connected)
+
+    # ------------------------------------------------------------------
+    def set_chi_iw(self, chi_iw, ops, connected=True):
+
+        """ Susceptibility matrix for the operators ops in bosonic
+        Matsubara frequencies, including the static contribution of
+        degenerate eigenstates at zero frequency. """
+
+        from pytriqs.gf import MeshImFreq
+
+        assert( type(chi_iw.mesh) == MeshImFreq )
+        assert( self.beta == chi_iw.mesh.beta )
+        assert( self.xi(chi_iw.mesh) == +1.0 )
+        assert( chi_iw.target_shape == (len(ops), len(ops)) )
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in ops ]
+        iwn = np.array([ iw for iw in chi_iw.mesh ])
+
+        chi_iw.data[:] = self.ed.get_frequency_susceptibility(
+            iwn, ops_mat, connected=connected)
+
+
     # ------------------------------------------------------------------
     def set_g3_tau(self, g3_tau, op1, op2, op3):
         
@@ -111,20 +261,69 @@ class TriqsExactDiagonalization(object):
 
         ops_mat = np.array([op1_mat, op2_mat, op3_mat])
 
+        # -- Krylov grids of all time ordered points, one per distinct
+        # -- time ordered operator string, shared by both triangles if O1 == O2
+        ntau = len(g3_tau.mesh.components[0])
+        keys = self.ed.get_operator_keys(ops_mat)
+        krylov_grids = {}
+
         for idxs, taus, perm, perm_sign in SquareTrianglesMesh(g3_tau):
 
             ops_perm_mat = ops_mat[perm + [2]]
             taus_perm = np.array(taus).T[perm]
 
-            data = self.ed.get_timeordered_two_tau_greens_function(
-                taus_perm, ops_perm_mat)
+            if self.ed.nstates is not None:
+                key = tuple([ keys[i] for i in perm + [2] ])
+                if key not in krylov_grids:
+                    krylov_grids[key] = \
+                        self.ed.get_timeordered_greens_function_krylov(
+                            ntau, ops_perm_mat)
+                data = krylov_grids[key][tuple(np.array(idxs).T[perm])]
+            else:
+                data = self.ed.get_timeordered_two_tau_greens_function(
+                    taus_perm, ops_perm_mat)
 
             for idx, d in zip(idxs, data):
                 g3_tau[list(idx)][:] = perm_sign * d
 
+    # ------------------------------------------------------------------
+    def set_g3_iw(self, g3_iw, op1, op2, op3):
+
+        r""" Three-point Green's function in Matsubara frequencies
+
+        G^{(3)}(i\nu_1, i\nu_2) = \int_0^\beta d\tau_1 d\tau_2
+            e^{i\nu_1 \tau_1 - i\nu_2 \tau_2} < T O_1(\tau_1) O_2(\tau_2) O_3(0) >
+
+        computed directly from the Lehmann representation. The statistic
+        of each mesh is the statistic of its operator. """
+
+        from pytriqs.gf import MeshImFreq
+
+        assert( g3_iw.target_shape == (1,1,1,1) )
+
+        meshes = g3_iw.mesh.components
+        assert( len(meshes) == 2 )
+        for mesh in meshes:
+            assert( type(mesh) == MeshImFreq )
+            assert( self.beta == mesh.beta )
+
+        xi = -1.0 if all([ self.xi(mesh) < 0 for mesh in meshes ]) else +1.0
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in [op1, op2, op3] ]
+
+        iw = [ np.array([ w for w in mesh ]) for mesh in meshes ]
+        iw1, iw2 = np.meshgrid(*iw, indexing='ij')
+        iwn = np.array([iw1.flatten(), -iw2.flatten()])
+
+        g3 = self.ed.get_frequency_three_point_greens_function(iwn, ops_mat, xi)
+
+        g3_iw.data[:, :, 0, 0, 0, 0] = g3.reshape(iw1.shape)
+
     # ------------------------------------------------------------------
     def set_g40_tau(self, g40_tau, g_tau):
 
+        from pytriqs.gf import MeshImTime
+
         assert( type(g_tau.mesh) == MeshImTime )
         #assert( g_tau.target_shape == g40_tau.target_shape )
 
@@ -137,24 +336,196 @@ class TriqsExactDiagonalization(object):
         
         assert( g4_tau.target_shape == (1,1,1,1) )
 
-        op1_mat = self.rep.sparse_matrix(op1)
-        op2_mat = self.rep.sparse_matrix(op2)        
-        op3_mat = self.rep.sparse_matrix(op3)
-        op4_mat = self.rep.sparse_matrix(op4)        
+        self.set_g4_tau_components(
+            g4_tau, [ ((0, 0, 0, 0), (op1, op2, op3, op4)) ])
 
-        ops_mat = np.array([op1_mat, op2_mat, op3_mat, op4_mat])
+    # ------------------------------------------------------------------
+    def set_g4_tau_matrix(self, g4_tau, ops):
 
-        for idxs, taus, perm, perm_sign in CubeTetrasMesh(g4_tau):
+        """ All components G_{ijkl} = < O_i(t1) O_j^+(t2) O_k(t3) O_l^+(0) >
+        of the two-particle Green's function for the operators ops. """
 
-            ops_perm_mat = ops_mat[perm + [3]]
-            taus_perm = np.array(taus).T[perm]
+        n = len(ops)
+        assert( g4_tau.target_shape == (n, n, n, n) )
 
-            data = self.ed.get_timeordered_three_tau_greens_function(
-                taus_perm, ops_perm_mat)
+        ops_mat = [ self.rep.sparse_matrix(op) for op in ops ]
+        ops_dag_mat = [ op_mat.getH() for op_mat in ops_mat ]
 
-            for idx, d in zip(idxs, data):
-                g4_tau[list(idx)][:] = perm_sign * d
+        components = [
+            ((i, j, k, l), (ops_mat[i], ops_dag_mat[j], ops_mat[k], ops_dag_mat[l]))
+            for i, j, k, l in itertools.product(range(n), repeat=4) ]
+
+        self._set_g4_tau_components_mat(g4_tau, components)
+
+    # ------------------------------------------------------------------
+    def set_g4_tau_components(self, g4_tau, components):
+
+        """ Set several components of the two-particle Green's function
+        in one pass over the imaginary time cube.
+
+        components is a list of (target_index, (op1, op2, op3, op4)). """
+
+        components_mat = [
+            (target_index, [ self.rep.sparse_matrix(op) for op in ops ])
+            for target_index, ops in components ]
+
+        self._set_g4_tau_components_mat(g4_tau, components_mat)
+
+    # ------------------------------------------------------------------
+    def _set_g4_tau_components_mat(self, g4_tau, components_mat):
+
+        meshes = g4_tau.mesh.components
+        tau = np.array([ t.real for t in meshes[0] ])
+        for mesh in meshes[1:]:
+            assert( len(mesh) == len(tau) )
+
+        tetras = [ (np.array(idxs, dtype=np.int).reshape(-1, 3).T, perm, perm_sign)
+                   for idxs, taus, perm, perm_sign in CubeTetrasMesh(g4_tau) ]
+
+        G4 = self.ed.get_g2_tau_components(
+            tau, [ ops for target_index, ops in components_mat ], tetras=tetras)
+
+        with self.profiler.stage('scatter', elements=G4.size):
+            for (target_index, ops), g4 in zip(components_mat, G4):
+                g4_tau.data[(Ellipsis,) + tuple(target_index)] = g4
+
+    # ------------------------------------------------------------------
+    def get_g4_tau_points(self, taus, op1, op2, op3, op4, **kwargs):
+
+        """ Two-particle Green's function < O1(t1) O2(t2) O3(t3) O4(0) >
+        at the M points (t1, t2, t3) given as an (M, 3) array, see
+        SparseExactDiagonalization.get_g2_tau_points. """
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in [op1, op2, op3, op4] ]
+        return self.ed.get_g2_tau_points(taus, ops_mat, **kwargs)
+
+    # ------------------------------------------------------------------
+    def write_g4_tau_hdf5(self, filename, imtime, op1, op2, op3, op4, **kwargs):
+
+        """ Stream the two-particle Green's function on the cube of the
+        MeshImTime imtime to filename, resuming a previous calculation,
+        see pyed.CheckpointHDF5.write_g4_tau_hdf5. """
+
+        tau = np.array([ t.real for t in imtime ])
+        ops_mat = [ self.rep.sparse_matrix(op) for op in [op1, op2, op3, op4] ]
+
+        return write_g4_tau_hdf5(self.ed, filename, tau, ops_mat, **kwargs)
+
+    # ------------------------------------------------------------------
+    def set_g4_tau_from_hdf5(self, g4_tau, filename, name='g4_tau'):
+
+        assert( g4_tau.target_shape == (1,1,1,1) )
+
+        tau, G4 = read_g4_tau_hdf5(filename, name=name)
+        assert( g4_tau.data.shape[:3] == G4.shape )
+
+        g4_tau.data[:, :, :, 0, 0, 0, 0] = G4
+
+    # ------------------------------------------------------------------
+    def set_g4_iw(self, g4_iw, op1, op2, op3, op4):
+
+        r""" Two-particle Green's function in Matsubara frequencies
+
+        G^{(4)}(i\nu_1, i\nu_2, i\nu_3) = \int_0^\beta d\tau_1 d\tau_2 d\tau_3
+            e^{i\nu_1 \tau_1 - i\nu_2 \tau_2 + i\nu_3 \tau_3}
+            < T O_1(\tau_1) O_2(\tau_2) O_3(\tau_3) O_4(0) >
+
+        computed directly from the Lehmann representation. """
+
+        from pytriqs.gf import MeshImFreq
+
+        assert( g4_iw.target_shape == (1,1,1,1) )
+
+        meshes = g4_iw.mesh.components
+        assert( len(meshes) == 3 )
+        for mesh in meshes:
+            assert( type(mesh) == MeshImFreq )
+            assert( self.beta == mesh.beta )
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in [op1, op2, op3, op4] ]
+
+        iw = [ np.array([ w for w in mesh ]) for mesh in meshes ]
+        iw1, iw2, iw3 = np.meshgrid(*iw, indexing='ij')
+        iwn = np.array([iw1.flatten(), -iw2.flatten(), iw3.flatten()])
+
+        g4 = self.ed.get_frequency_two_particle_greens_function(iwn, ops_mat)
+
+        g4_iw.data[:, :, :, 0, 0, 0, 0] = g4.reshape(iw1.shape)
+
+    # ------------------------------------------------------------------
+    def set_g4_legendre(self, g4_l, op1, op2, op3, op4, nquad=None):
+
+        r""" Two-particle Green's function G^{(4)}_{ll'}(i\omega) in one
+        bosonic Matsubara frequency and two Legendre coefficients, on the
+        mesh product of MeshImFreq and two MeshLegendre, see
+        SparseExactDiagonalization.get_legendre_two_particle_greens_function. """
+
+        from pytriqs.gf import MeshImFreq
+
+        assert( g4_l.target_shape == (1,1,1,1) )
+
+        meshes = g4_l.mesh.components
+        assert( len(meshes) == 3 )
+        assert( type(meshes[0]) == MeshImFreq )
+        assert( self.xi(meshes[0]) == +1.0 )
+        for mesh in meshes:
+            assert( self.beta == mesh.beta )
+
+        nw, nl1, nl2 = g4_l.data.shape[:3]
+        assert( nl1 == nl2 )
+
+        ops_mat = [ self.rep.sparse_matrix(op) for op in [op1, op2, op3, op4] ]
+        iwn = np.array([ w for w in meshes[0] ])
+
+        g4_l.data[:, :, :, 0, 0, 0, 0] = \
+            self.ed.get_legendre_two_particle_greens_function(
+                nl1, iwn, ops_mat, nquad=nquad)
+
+    # ------------------------------------------------------------------
+
+# ----------------------------------------------------------------------
+class TriqsBatchExactDiagonalization(_TriqsExactDiagonalizationBase):
+
+    """ Exact diagonalization of a list of Triqs operator expressions,
+    or scipy sparse matrices, on the same fundamental operators, see
+    BatchExactDiagonalization.
+
+    Results have the instance as their first axis and the Green's
+    function setters take a list of Green's functions, one per
+    instance. """
 
     # ------------------------------------------------------------------
-   
+    def __init__(self, H_list, fundamental_operators, beta):
+
+        self.beta = beta
+        self.rep = SparseMatrixRepresentation(fundamental_operators)
+
+        H_list = [ H if sparse.issparse(H) else self.rep.sparse_matrix(H)
+                   for H in H_list ]
+
+        self.ed = BatchExactDiagonalization(H_list, beta)
+
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return len(self.ed)
+
+    # ------------------------------------------------------------------
+    def get_instance(self, b):
+
+        """ TriqsExactDiagonalization of instance b, sharing the
+        eigenstates of the batch. """
+
+        ed = TriqsExactDiagonalization.__new__(TriqsExactDiagonalization)
+        ed._set_solver(self.ed.get_instance(b), self.rep, self.beta)
+
+        return ed
+
+    # ------------------------------------------------------------------
+    def _gf_list(self, g_list):
+        assert( len(g_list) == len(self) )
+        return g_list
+
+    def _instance_data(self, data):
+        return data
+
 # ----------------------------------------------------------------------
@@ -0,0 +1,48 @@
+
+"""
+Model Hamiltonians shared by the tests.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+from pytriqs.operators import c, c_dag
+
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def anderson_dimer(U=1.0, mu=0.5, V=1.0, eps=0.3):
+
+    """ Hubbard atom (site 0) hybridized with one bath site (site 1),
+    with spin up = 0 and down = 1 as first operator index. Returns the
+    Hamiltonian and the fundamental operators. """
+
+    up, do = 0, 1
+    H = U * c_dag(up,0) * c(up,0) * c_dag(do,0) * c(do,0) \
+        - mu * (c_dag(up,0) * c(up,0) + c_dag(do,0) * c(do,0)) \
+        + eps * (c_dag(up,1) * c(up,1) + c_dag(do,1) * c(do,1)) \
+        + V * (c_dag(up,0) * c(up,1) + c_dag(up,1) * c(up,0) + \
+               c_dag(do,0) * c(do,1) + c_dag(do,1) * c(do,0))
+
+    fundamental_operators = [c(up,0), c(do,0), c(up,1), c(do,1)]
+
+    return H, fundamental_operators
+
+# ----------------------------------------------------------------------
+def anderson_dimer_g4_tau(beta, ntau=8, **kwargs):
+
+    """ Exact diagonalization of anderson_dimer, with the keyword
+    arguments of TriqsExactDiagonalization. Returns the
+    SparseExactDiagonalization, the sparse matrices of
+    c_up c_up^+ c_do c_do^+ on site 0 and tau = linspace(0, beta, ntau). """
+
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta, **kwargs)
+
+    ops = [ ed.rep.sparse_matrix(op) for op in
+            [c(up,0), c_dag(up,0), c(do,0), c_dag(do,0)] ]
+    tau = np.linspace(0, beta, ntau)
+
+    return ed.ed, ops, tau
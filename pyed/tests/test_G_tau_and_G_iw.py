@@ -14,13 +14,15 @@ import numpy as np
 from pytriqs.gf import Gf
 from pytriqs.gf import MeshImTime, MeshImFreq
 
-from pytriqs.gf import GfImTime, GfImFreq, TailGf
+from pytriqs.gf import GfImTime, GfImFreq, GfLegendre, TailGf
 from pytriqs.operators import c, c_dag
 
-from pytriqs.gf import inverse, iOmega_n, InverseFourier
+from pytriqs.gf import inverse, iOmega_n, InverseFourier, LegendreToMatsubara
 
 # ----------------------------------------------------------------------
 
+from models import anderson_dimer
+from pyed.SparseExactDiagonalization import SparseExactDiagonalization
 from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
 
 # ----------------------------------------------------------------------
@@ -81,7 +83,92 @@ def test_cf_G_tau_and_G_iw_nonint(verbose=False):
         
         plt.show()
 
+# ----------------------------------------------------------------------
+def test_cf_G_legendre_and_G_iw_nonint():
+
+    beta = 3.22
+    eps = 1.234
+
+    niw = 64
+    nl = 40
+
+    H = eps * c_dag(0,0) * c(0,0)
+    ed = TriqsExactDiagonalization(H, [c(0,0)], beta)
+
+    G_iw = GfImFreq(beta=beta, statistic='Fermion', n_points=niw, indices=[1])
+    G_iw << inverse( iOmega_n - eps )
+
+    G_l_ed = GfLegendre(beta=beta, statistic='Fermion', n_points=nl, indices=[1])
+    ed.set_g2_legendre(G_l_ed, c(0,0), c_dag(0,0))
+
+    G_iw_l = GfImFreq(beta=beta, statistic='Fermion', n_points=niw, indices=[1])
+    G_iw_l << LegendreToMatsubara(G_l_ed)
+
+    from pytriqs.utility.comparison_tests import assert_gfs_are_close
+    assert_gfs_are_close(G_iw, G_iw_l)
+
+# ----------------------------------------------------------------------
+def test_chi_tau_and_chi_iw():
+
+    beta = 3.22
+    U, mu = 1.3, 0.4
+
+    up, do = 0, 1
+    n_up, n_do = c_dag(up,0) * c(up,0), c_dag(do,0) * c(do,0)
+    H = U * n_up * n_do - mu * (n_up + n_do)
+
+    ed = TriqsExactDiagonalization(H, [c(up,0), c(do,0)], beta)
+
+    ops = [n_up, n_do]
+
+    chi_tau = Gf(mesh=MeshImTime(beta, 'Boson', 51), target_shape=[2, 2])
+    chi_iw = Gf(mesh=MeshImFreq(beta, 'Boson', 10), target_shape=[2, 2])
+
+    ed.set_chi_tau(chi_tau, ops)
+    ed.set_chi_iw(chi_iw, ops)
+
+    # -- The atomic densities are conserved, chi is static
+
+    n = [ ed.get_expectation_value(op).real for op in ops ]
+    docc = ed.get_expectation_value(n_up * n_do).real
+    chi_ref = np.array([[n[0] - n[0]**2, docc - n[0]*n[1]],
+                        [docc - n[0]*n[1], n[1] - n[1]**2]])
+
+    for chi in chi_tau.data:
+        np.testing.assert_array_almost_equal(chi, chi_ref)
+
+    iwn = np.array([ iw for iw in chi_iw.mesh ])
+    for iw, chi in zip(iwn, chi_iw.data):
+        np.testing.assert_array_almost_equal(chi, beta * chi_ref * (iw == 0))
+
+# ----------------------------------------------------------------------
+def test_tail_moments_and_commutators():
+
+    beta = 2.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    # -- hermitian=False takes the commutator branch
+
+    H_mat = ed.rep.sparse_matrix(H)
+    ed_comm = SparseExactDiagonalization(H_mat, beta, hermitian=False)
+
+    n_up, n_do = c_dag(up,0) * c(up,0), c_dag(do,0) * c(do,0)
+    for op1, op2, xi in [(c(up,0), c_dag(up,0), -1.),
+                         (c(up,0), c_dag(up,1), -1.),
+                         (n_up, n_do, +1.)]:
+        op1_mat, op2_mat = ed.rep.sparse_matrix(op1), ed.rep.sparse_matrix(op2)
+        tail = ed.ed.get_high_frequency_tail_coeff_component(
+            op1_mat, op2_mat, xi, Norder=6)
+        tail_comm = ed_comm.get_high_frequency_tail_coeff_component(
+            op1_mat, op2_mat, xi, Norder=6)
+        np.testing.assert_array_almost_equal(tail, tail_comm)
+
 # ----------------------------------------------------------------------
 if __name__ == '__main__':
     
     test_cf_G_tau_and_G_iw_nonint(verbose=True)
+    test_cf_G_legendre_and_G_iw_nonint()
+    test_chi_tau_and_chi_iw()
+    test_tail_moments_and_commutators()
@@ -0,0 +1,81 @@
+
+"""
+Test the batched exact diagonalization of Hubbard atoms against
+one exact diagonalization per instance.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.gf import GfImTime, GfImFreq, Gf, MeshImTime, MeshProduct
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+from pyed.TriqsExactDiagonalization import TriqsBatchExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_batch_hubbard_atoms():
+
+    beta = 5.0
+    up, do = 0, 1
+
+    docc = c_dag(up,0) * c(up,0) * c_dag(do,0) * c(do,0)
+    nA = c_dag(up,0) * c(up,0) + c_dag(do,0) * c(do,0)
+
+    H_list = [ U * docc - 0.4 * U * nA for U in np.linspace(0., 4., 5) ]
+    fundamental_operators = [c(up,0), c(do,0)]
+
+    batch = TriqsBatchExactDiagonalization(H_list, fundamental_operators, beta)
+
+    g_tau_list = [ GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+                   for H in H_list ]
+    g_iw_list = [ GfImFreq(beta=beta, statistic='Fermion', n_points=10, indices=[1])
+                  for H in H_list ]
+
+    batch.set_g2_tau(g_tau_list, c(up,0), c_dag(up,0))
+    batch.set_g2_iwn(g_iw_list, c(up,0), c_dag(up,0))
+
+    imtime = MeshImTime(beta, 'Fermion', 6)
+    prodmesh = MeshProduct(imtime, imtime, imtime)
+
+    free_energy = batch.get_free_energy()
+    docc_exp = batch.get_expectation_value(docc)
+
+    for b, H in enumerate(H_list):
+
+        ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+        np.testing.assert_almost_equal(free_energy[b], ed.get_free_energy())
+        np.testing.assert_almost_equal(docc_exp[b], ed.get_expectation_value(docc))
+
+        g_tau = GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+        g_iw = GfImFreq(beta=beta, statistic='Fermion', n_points=10, indices=[1])
+
+        ed.set_g2_tau(g_tau, c(up,0), c_dag(up,0))
+        ed.set_g2_iwn(g_iw, c(up,0), c_dag(up,0))
+
+        np.testing.assert_array_almost_equal(g_tau_list[b].data, g_tau.data)
+        np.testing.assert_array_almost_equal(g_iw_list[b].data, g_iw.data)
+
+        # -- Per instance view with the single instance API
+        ed_b = batch.get_instance(b)
+        np.testing.assert_almost_equal(
+            ed_b.get_free_energy(), ed.get_free_energy())
+
+        g4_tau = Gf(name='g4_tau', mesh=prodmesh, indices=[1])
+        g4_ref = Gf(name='g4_ref', mesh=prodmesh, indices=[1])
+
+        ed_b.set_g4_tau(g4_tau, c(up,0), c_dag(up,0), c(do,0), c_dag(do,0))
+        ed.set_g4_tau(g4_ref, c(up,0), c_dag(up,0), c(do,0), c_dag(do,0))
+
+        np.testing.assert_array_almost_equal(g4_tau.data, g4_ref.data)
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_batch_hubbard_atoms()
@@ -0,0 +1,90 @@
+"""
+Test the checkpointed two-particle Green's function in imaginary time,
+stopped after a few slabs and resumed, against the direct calculation.
+"""
+
+# ----------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.gf import Gf, MeshImTime, MeshProduct
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from models import anderson_dimer
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_checkpoint_hdf5():
+
+    beta, ntau = 2.0, 6
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [c(up,0), c_dag(up,0), c(do,0), c_dag(do,0)]
+    imtime = MeshImTime(beta, 'Fermion', ntau)
+    prodmesh = MeshProduct(imtime, imtime, imtime)
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'g4_tau.h5')
+
+    try:
+        # -- Stop after two of the three slabs and resume
+
+        assert( ed.write_g4_tau_hdf5(filename, imtime, *ops, slab=2, max_slabs=2) == 2 )
+
+        g4_tau = Gf(name='g4_tau', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+        try:
+            ed.set_g4_tau_from_hdf5(g4_tau, filename)
+            assert( False )
+        except ValueError:
+            pass
+
+        assert( ed.write_g4_tau_hdf5(filename, imtime, *ops, slab=2) == 1 )
+        assert( ed.write_g4_tau_hdf5(filename, imtime, *ops, slab=2) == 0 )
+
+        # -- Round trip, equal time planes as in set_g4_tau
+
+        ed.set_g4_tau_from_hdf5(g4_tau, filename)
+
+        g4_ref = Gf(name='g4_ref', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+        ed.set_g4_tau(g4_ref, *ops)
+        np.testing.assert_array_almost_equal(g4_tau.data, g4_ref.data)
+
+        tau = np.array([ t.real for t in imtime ])
+        ops_mat = [ ed.rep.sparse_matrix(op) for op in ops ]
+        G4 = ed.ed.get_g2_tau(tau, ops_mat)
+
+        i1, i2, i3 = np.indices(G4.shape)
+        distinct = (i1 != i2) & (i2 != i3) & (i1 != i3)
+        np.testing.assert_array_almost_equal(
+            g4_tau.data[:, :, :, 0, 0, 0, 0][distinct], G4[distinct])
+
+        # -- Another beta, mesh or operator string is rejected
+
+        ed_beta = TriqsExactDiagonalization(H, fundamental_operators, 2 * beta)
+        imtime_beta = MeshImTime(2 * beta, 'Fermion', ntau)
+        for solver, mesh, ops_other in [
+                (ed_beta, imtime_beta, ops),
+                (ed, MeshImTime(beta, 'Fermion', ntau + 1), ops),
+                (ed, imtime, [c(up,0), c_dag(up,0), c(up,0), c_dag(up,0)]) ]:
+            try:
+                solver.write_g4_tau_hdf5(filename, mesh, *ops_other, slab=2)
+                assert( False )
+            except ValueError:
+                pass
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_checkpoint_hdf5()
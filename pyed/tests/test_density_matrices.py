@@ -0,0 +1,44 @@
+
+"""
+Test the one- and two-particle reduced density matrices against
+the expectation values of the corresponding operators.
+"""
+
+# ----------------------------------------------------------------------
+
+import itertools
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from models import anderson_dimer
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_reduced_density_matrices():
+
+    beta = 2.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    idxs = [(up,0), (do,0), (up,1), (do,1)]
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    rdm1, rdm2 = ed.get_reduced_density_matrices()
+
+    for i, j in itertools.product(range(4), repeat=2):
+        ref = ed.get_expectation_value(c_dag(*idxs[i]) * c(*idxs[j]))
+        np.testing.assert_almost_equal(rdm1[i, j], ref)
+
+    for i, j, k, l in itertools.product(range(4), repeat=4):
+        ref = ed.get_expectation_value(
+            c_dag(*idxs[i]) * c_dag(*idxs[j]) * c(*idxs[k]) * c(*idxs[l]))
+        np.testing.assert_almost_equal(rdm2[i, j, k, l], ref)
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_reduced_density_matrices()
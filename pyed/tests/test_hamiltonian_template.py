@@ -0,0 +1,60 @@
+
+"""
+Test the parametrized Hamiltonian template against direct
+compilation of the Triqs operator expression.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from pyed.HamiltonianTemplate import HamiltonianTemplate
+from pyed.SparseMatrixFockStates import SparseMatrixRepresentation
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_hamiltonian_template():
+
+    beta = 2.0
+    up, do = 0, 1
+
+    docc = c_dag(up,0) * c(up,0) * c_dag(do,0) * c(do,0)
+    nA = c_dag(up,0) * c(up,0) + c_dag(do,0) * c(do,0)
+    nB = c_dag(up,1) * c(up,1) + c_dag(do,1) * c(do,1)
+    hop = c_dag(up,0)*c(up,1) + c_dag(up,1)*c(up,0) + \
+          c_dag(do,0)*c(do,1) + c_dag(do,1)*c(do,0)
+
+    fundamental_operators = [c(up,0), c(do,0), c(up,1), c(do,1)]
+    rep = SparseMatrixRepresentation(fundamental_operators)
+
+    template = HamiltonianTemplate(
+        [('mu', -nA), ('epsilon', nB), ('U', docc), ('V', hop)],
+        fundamental_operators)
+
+    for mu, epsilon, U, V in [(0.5, 0.3, 1.0, 1.0), (2.0, -1.0, 4.0, 0.1)]:
+
+        H = mu * (-nA) + epsilon * nB + U * docc + V * hop
+        H_mat = template.sparse_matrix(dict(mu=mu, epsilon=epsilon, U=U, V=V))
+
+        np.testing.assert_array_almost_equal(
+            H_mat.todense(), rep.sparse_matrix(H).todense())
+
+        assert( not np.may_share_memory(H_mat.indices, template.indices) )
+        assert( not np.may_share_memory(H_mat.indptr, template.indptr) )
+
+        ed = TriqsExactDiagonalization(H_mat, fundamental_operators, beta)
+        ed_ref = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+        np.testing.assert_almost_equal(
+            ed.get_free_energy(), ed_ref.get_free_energy())
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_hamiltonian_template()
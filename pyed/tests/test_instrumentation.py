@@ -0,0 +1,71 @@
+
+"""
+Test the per stage profiler of the exact diagonalization solvers.
+"""
+
+# ----------------------------------------------------------------------
+
+import json
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.gf import Gf, MeshImTime, MeshProduct
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from pyed.Instrumentation import Profiler
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_profiler_stages():
+
+    beta = 2.0
+    U, mu = 1.0, 0.5
+
+    up, do = 0, 1
+    H = U * c_dag(up,0) * c(up,0) * c_dag(do,0) * c(do,0) \
+        - mu * (c_dag(up,0) * c(up,0) + c_dag(do,0) * c(do,0))
+
+    fundamental_operators = [c(up,0), c(do,0)]
+
+    records = []
+    profiler = Profiler(callbacks=[
+        lambda name, elapsed, counters: records.append(name)])
+
+    ed = TriqsExactDiagonalization(
+        H, fundamental_operators, beta, profiler=profiler)
+    ed_ref = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    imtime = MeshImTime(beta, 'Fermion', 10)
+    prodmesh = MeshProduct(imtime, imtime, imtime)
+
+    g4_tau = Gf(name='g4_tau', mesh=prodmesh, indices=[1])
+    g4_ref = Gf(name='g4_ref', mesh=prodmesh, indices=[1])
+
+    ed.set_g4_tau(g4_tau, c(up,0), c_dag(up,0), c(do,0), c_dag(do,0))
+    ed_ref.set_g4_tau(g4_ref, c(up,0), c_dag(up,0), c(do,0), c_dag(do,0))
+
+    np.testing.assert_array_almost_equal(g4_tau.data, g4_ref.data)
+
+    stages = profiler.report()['stages']
+    for name in ['operator_compilation', 'diagonalization',
+                 'eigenbasis_transform', 'contraction', 'scatter']:
+        assert( stages[name]['calls'] > 0 )
+
+    assert( stages['diagonalization']['calls'] == 1 )
+    assert( stages['contraction']['flops'] > 0 )
+    assert( stages['diagonalization']['memory_increase'] >= 0 )
+    assert( len(records) == sum([ s['calls'] for s in stages.values() ]) )
+
+    report = json.loads(profiler.to_json())
+    assert( set(report['stages'].keys()) == set(stages.keys()) )
+
+    profiler.reset()
+    assert( len(profiler.report()['stages']) == 0 )
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_profiler_stages()
@@ -0,0 +1,82 @@
+
+"""
+Test the imaginary time to Matsubara frequency transform of the
+three- and four-point Green's functions against the Lehmann
+representation.
+"""
+
+#----------------------------------------------------------------------
+
+import numpy as np
+
+#----------------------------------------------------------------------
+
+from pytriqs.gf import Gf
+from pytriqs.gf import MeshImTime, MeshImFreq, MeshProduct
+
+from pytriqs.operators import c, c_dag
+
+#----------------------------------------------------------------------
+
+from models import anderson_dimer
+from pyed.MatsubaraTransform import set_g3_iw_from_tau, set_g4_iw_from_tau
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+#----------------------------------------------------------------------
+def test_g4_iw_from_tau():
+
+    beta = 4.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [c(up,0), c_dag(up,0), c(do,0), c_dag(do,0)]
+
+    imtime = MeshImTime(beta, 'Fermion', 81)
+    g4_tau = Gf(name='g4_tau', mesh=MeshProduct(imtime, imtime, imtime),
+                target_shape=[1, 1, 1, 1])
+    ed.set_g4_tau(g4_tau, *ops)
+
+    imfreq = MeshImFreq(beta, 'Fermion', 3)
+    prodmesh = MeshProduct(imfreq, imfreq, imfreq)
+
+    g4_iw = Gf(name='g4_iw', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    g4_iw_ref = Gf(name='g4_iw_ref', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+
+    set_g4_iw_from_tau(g4_iw, g4_tau, slab_size=2)
+    ed.set_g4_iw(g4_iw_ref, *ops)
+
+    # -- Piecewise linear in tau with jump corrections, O(dtau^2)
+    np.testing.assert_array_almost_equal(g4_iw.data, g4_iw_ref.data, decimal=2)
+
+#----------------------------------------------------------------------
+def test_g3_iw_from_tau():
+
+    beta = 4.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [c(up,0), c_dag(up,0), c_dag(do,1) * c(do,1)]
+
+    imtime = MeshImTime(beta, 'Fermion', 161)
+    g3_tau = Gf(name='g3_tau', mesh=MeshProduct(imtime, imtime),
+                target_shape=[1, 1, 1, 1])
+    ed.set_g3_tau(g3_tau, *ops)
+
+    imfreq = MeshImFreq(beta, 'Fermion', 3)
+    prodmesh = MeshProduct(imfreq, imfreq)
+
+    g3_iw = Gf(name='g3_iw', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    g3_iw_ref = Gf(name='g3_iw_ref', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+
+    set_g3_iw_from_tau(g3_iw, g3_tau)
+    ed.set_g3_iw(g3_iw_ref, *ops)
+
+    np.testing.assert_array_almost_equal(g3_iw.data, g3_iw_ref.data, decimal=3)
+
+#----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_g4_iw_from_tau()
+    test_g3_iw_from_tau()
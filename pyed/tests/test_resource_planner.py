@@ -0,0 +1,79 @@
+
+"""
+Test the execution plans of the resource planner and
+the solvers configured by a plan.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.gf import GfImTime
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from models import anderson_dimer
+from pyed.ResourcePlanner import plan_execution
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_resource_planner():
+
+    beta = 2.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+
+    ed_ref = TriqsExactDiagonalization(H, fundamental_operators, beta)
+    nnz = ed_ref.ed.H.nnz
+
+    g_ref = GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+    ed_ref.set_g2_tau(g_ref, c(up,0), c_dag(up,0))
+
+    # -- Ample budget, full spectrum
+
+    plan = plan_execution(fundamental_operators, nnz, beta, ntau=50, ntau_g4=10,
+                          memory_budget=2**30)
+
+    assert( plan.nstates is None and not plan.use_sectors )
+    assert( plan.fits() )
+    assert( plan.peak_memory() <= 2**30 )
+
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta, plan=plan)
+    g_tau = GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+    ed.set_g2_tau(g_tau, c(up,0), c_dag(up,0))
+
+    np.testing.assert_array_almost_equal(g_tau.data, g_ref.data)
+
+    # -- Dense diagonalization over the time budget, particle number sectors
+
+    plan = plan_execution(fundamental_operators, nnz, beta, time_budget=1e-12)
+    assert( plan.use_sectors )
+
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta, plan=plan)
+    assert( len(ed.ed.blocks) == 5 )
+    np.testing.assert_almost_equal(ed.get_free_energy(), ed_ref.get_free_energy())
+
+    # -- Full spectrum over the memory budget, truncation
+
+    plan = plan_execution(fundamental_operators, nnz, beta, ntau_g4=10,
+                          memory_budget=2**12, nstates=1)
+    assert( plan.nstates == 1 )
+    assert( 'krylov' in plan.chunk_sizes )
+
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta, plan=plan)
+    assert( len(ed.ed.E) == 1 )
+
+    # -- Number of states derived from the memory budget
+
+    plan = plan_execution(fundamental_operators, nnz, beta, ntau_g4=10,
+                          memory_budget=2**16)
+    assert( plan.nstates == 1 )
+    assert( plan.fits() )
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_resource_planner()
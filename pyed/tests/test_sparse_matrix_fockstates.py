@@ -116,8 +116,57 @@ def test_trimer_hamiltonian():
 
     compare_sparse_matrices(H_mat, H_ref)
     
+#----------------------------------------------------------------------
+def test_sparse_matrix_registry():
+
+    up, do = 0, 1
+    fundamental_operators = [c(up,0), c(do,0), c(up,1), c(do,1)]
+
+    rep = SparseMatrixRepresentation(
+        fundamental_operators, expression_cache_size=2)
+
+    n_up = c_dag(up,0) * c(up,0)
+    n_do = c_dag(do,0) * c(do,0)
+    hop = c_dag(up,0) * c(up,1) + c_dag(up,1) * c(up,0)
+
+    ref = [ rep.sparse_matrix(op).copy() for op in [n_up, n_do, hop] ]
+
+    for op, op_ref in zip([hop, n_do, n_up, n_up], ref[::-1] + ref[:1]):
+        compare_sparse_matrices(rep.sparse_matrix(op), op_ref)
+
+    info = rep.get_cache_info()
+
+    # -- n_up was evicted by hop from the cache of two expressions
+    assert( info['expressions']['hits'] == 3 )
+    assert( info['expressions']['misses'] == 4 )
+    assert( info['expressions']['size'] == 2 )
+
+    # -- but its monomial is compiled only once
+    assert( info['monomials']['hits'] == 1 )
+    assert( info['monomials']['misses'] == 4 )
+
+#----------------------------------------------------------------------
+def test_compact_operator():
+
+    up, do = 0, 1
+    fundamental_operators = [c(up,0), c(do,0), c(up,1), c(do,1)]
+    rep = SparseMatrixRepresentation(fundamental_operators)
+
+    O = 0.7 * c_dag(do,1) * c_dag(up,0) * c(do,0) * c(up,1) + \
+        (0.2 - 1.3j) * c_dag(up,1) * c(do,0) + 0.5
+
+    O_mat = rep.sparse_matrix(O)
+    O_compact = rep.compact_operator(O)
+
+    compare_sparse_matrices(O_compact.sparse_matrix(), O_mat)
+
+    v = np.random.random((2**4, 3))
+    np.testing.assert_array_almost_equal(O_compact.dot(v), O_mat * v)
+
 #----------------------------------------------------------------------
 if __name__ == '__main__':
 
     test_sparse_matrix_representation()
     test_trimer_hamiltonian()
+    test_sparse_matrix_registry()
+    test_compact_operator()
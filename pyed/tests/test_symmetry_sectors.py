@@ -0,0 +1,60 @@
+
+"""
+Test the momentum and charge sector block diagonalization for
+a Hubbard ring with periodic boundary conditions.
+"""
+
+# ----------------------------------------------------------------------
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+
+from pytriqs.gf import GfImTime
+from pytriqs.operators import c, c_dag
+
+# ----------------------------------------------------------------------
+
+from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
+
+# ----------------------------------------------------------------------
+def test_hubbard_ring_momentum_sectors():
+
+    beta, L = 3.0, 4
+    t, U, mu = 1.0, 2.0, 0.7
+
+    up, do = 0, 1
+    H = 0 * c_dag(up,0) * c(up,0)
+    for i in range(L):
+        j = (i + 1) % L
+        for s in [up, do]:
+            H += -t * (c_dag(s,i) * c(s,j) + c_dag(s,j) * c(s,i)) \
+                 - mu * c_dag(s,i) * c(s,i)
+        H += U * c_dag(up,i) * c(up,i) * c_dag(do,i) * c(do,i)
+
+    fundamental_operators = [ c(s,i) for i in range(L) for s in [up, do] ]
+
+    translation = lambda idx: (idx[0], (idx[1] + 1) % L)
+    charges = [ lambda idx: 1, lambda idx: 1 - 2 * idx[0] ]
+
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+    ed_k = TriqsExactDiagonalization(H, fundamental_operators, beta,
+                                     translations=[translation], charges=charges)
+
+    # -- Blocks of at most 10 states instead of 36 with N and Sz only
+    assert( max([ B.shape[1] for B in ed_k.ed.blocks ]) == 10 )
+
+    np.testing.assert_almost_equal(ed.get_free_energy(), ed_k.get_free_energy())
+
+    g_tau = GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+    g_tau_k = GfImTime(beta=beta, statistic='Fermion', n_points=50, indices=[1])
+
+    ed.set_g2_tau(g_tau, c(up,0), c_dag(up,1))
+    ed_k.set_g2_tau(g_tau_k, c(up,0), c_dag(up,1))
+
+    np.testing.assert_array_almost_equal(g_tau.data, g_tau_k.data)
+
+# ----------------------------------------------------------------------
+if __name__ == '__main__':
+
+    test_hubbard_ring_momentum_sectors()
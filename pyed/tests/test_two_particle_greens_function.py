@@ -9,17 +9,20 @@ Author: Hugo U. R. Strand (2017), hugo.strand@gmail.com
 #----------------------------------------------------------------------
 
 import numpy as np
+from scipy.special import spherical_jn
 
 #----------------------------------------------------------------------
 
 from pytriqs.gf import Gf, GfImTime
-from pytriqs.gf import MeshImTime, MeshProduct
+from pytriqs.gf import MeshImTime, MeshImFreq, MeshLegendre, MeshProduct
 
 from pytriqs.operators import c, c_dag
 
 #----------------------------------------------------------------------
 
+from models import anderson_dimer, anderson_dimer_g4_tau
 from pyed.CubeTetras import zero_outer_planes_and_equal_times
+from pyed.MatsubaraTransform import set_g4_iw_from_tau
 from pyed.TriqsExactDiagonalization import TriqsExactDiagonalization
 
 #----------------------------------------------------------------------
@@ -85,7 +88,257 @@ def test_two_particle_greens_function():
     zero_outer_planes_and_equal_times(g40_tau)
     np.testing.assert_array_almost_equal(g4_tau.data, g40_tau.data)
     
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_matrix():
+
+    beta = 2.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ntau = 6
+    imtime = MeshImTime(beta, 'Fermion', ntau)
+    prodmesh = MeshProduct(imtime, imtime, imtime)
+
+    idxs = [(up,0), (do,0)]
+    ops = [c(*idx) for idx in idxs]
+    g4_tau = Gf(name='g4_tau', mesh=prodmesh, target_shape=[2, 2, 2, 2])
+    ed.set_g4_tau_matrix(g4_tau, ops)
+
+    for i, j, k, l in [(0, 0, 0, 0), (0, 1, 1, 0), (0, 0, 1, 1), (1, 0, 0, 1)]:
+        g4_ref = Gf(name='g4_ref', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+        ed.set_g4_tau(g4_ref, c(*idxs[i]), c_dag(*idxs[j]),
+                      c(*idxs[k]), c_dag(*idxs[l]))
+        np.testing.assert_array_almost_equal(
+            g4_tau.data[:, :, :, i, j, k, l], g4_ref.data[:, :, :, 0, 0, 0, 0])
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_points():
+
+    beta = 2.0
+    ntau = 6
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [c(up,0), c_dag(up,0), c(do,0), c_dag(do,0)]
+
+    imtime = MeshImTime(beta, 'Fermion', ntau)
+    g4_tau = Gf(name='g4_tau', mesh=MeshProduct(imtime, imtime, imtime),
+                target_shape=[1, 1, 1, 1])
+    ed.set_g4_tau(g4_tau, *ops)
+
+    # -- Random mesh points and the t1 = t2 plane, in chunks of 7 points
+
+    np.random.seed(1234)
+    idxs = np.random.randint(0, ntau, size=(40, 3))
+    i1, i3 = [ i.flatten() for i in np.meshgrid(range(ntau), range(ntau)) ]
+    idxs = np.vstack([idxs, np.array([i1, i1, i3]).T])
+
+    tau = np.array([ t.real for t in imtime ])
+    g4 = ed.get_g4_tau_points(tau[idxs], *ops, chunk_size=7)
+
+    g4_ref = g4_tau.data[:, :, :, 0, 0, 0, 0][tuple(idxs.T)]
+    np.testing.assert_array_almost_equal(g4, g4_ref)
+
+    # -- Off the equal time planes also as get_g2_tau
+
+    ops_mat = [ ed.rep.sparse_matrix(op) for op in ops ]
+    G4 = ed.ed.get_g2_tau(tau, ops_mat)
+
+    distinct = (idxs[:, 0] != idxs[:, 1]) & (idxs[:, 1] != idxs[:, 2]) & \
+        (idxs[:, 0] != idxs[:, 2])
+    np.testing.assert_array_almost_equal(
+        g4[distinct], G4[tuple(idxs[distinct].T)])
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_iw_nonint():
+
+    beta = 3.0
+    eps = 0.37
+
+    H = eps * c_dag(0,0) * c(0,0)
+    ed = TriqsExactDiagonalization(H, [c(0,0)], beta)
+
+    imfreq = MeshImFreq(beta, 'Fermion', 4)
+    prodmesh = MeshProduct(imfreq, imfreq, imfreq)
+
+    g4_iw = Gf(name='g4_iw', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    ed.set_g4_iw(g4_iw, c(0,0), c_dag(0,0), c(0,0), c_dag(0,0))
+
+    # -- Wick's theorem, including the equal frequency terms
+
+    nu = np.array([ w for w in imfreq ])
+    nu1, nu2, nu3 = np.meshgrid(nu, nu, nu, indexing='ij')
+    g1, g3 = 1./(nu1 - eps), 1./(nu3 - eps)
+    g4_ref = beta * (np.isclose(nu1, nu2) - np.isclose(nu2, nu3)) * g1 * g3
+
+    np.testing.assert_array_almost_equal(g4_iw.data[:, :, :, 0, 0, 0, 0], g4_ref)
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_iw_interacting():
+
+    beta = 4.0
+    up = 0
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    # -- Equal operators, with degenerate and zero frequency terms
+
+    ops = [c(up,0), c_dag(up,0), c(up,0), c_dag(up,0)]
+
+    imfreq = MeshImFreq(beta, 'Fermion', 3)
+    prodmesh = MeshProduct(imfreq, imfreq, imfreq)
+
+    g4_iw = Gf(name='g4_iw', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    ed.set_g4_iw(g4_iw, *ops)
+
+    # -- Transform of the imaginary time cube, O(dtau^2)
+
+    imtime = MeshImTime(beta, 'Fermion', 41)
+    g4_tau = Gf(name='g4_tau', mesh=MeshProduct(imtime, imtime, imtime),
+                target_shape=[1, 1, 1, 1])
+    ed.set_g4_tau(g4_tau, *ops)
+
+    g4_iw_ref = Gf(name='g4_iw_ref', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    set_g4_iw_from_tau(g4_iw_ref, g4_tau)
+
+    np.testing.assert_array_almost_equal(g4_iw.data, g4_iw_ref.data, decimal=2)
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_legendre():
+
+    beta = 2.0
+    nl = 16
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [c(up,0), c_dag(up,0), c(do,0), c_dag(do,0)]
+
+    legendre = MeshLegendre(beta, 'Fermion', nl)
+    prodmesh = MeshProduct(MeshImFreq(beta, 'Boson', 2), legendre, legendre)
+    g4_l = Gf(name='g4_l', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    ed.set_g4_legendre(g4_l, *ops)
+
+    # -- Legendre to Matsubara transform of the fermionic frequencies
+
+    def T(nu):
+        l, x = np.arange(nl), 0.5 * nu * beta
+        return np.sqrt(2 * l + 1) * np.exp(1j * x) * 1j**l * \
+            np.sign(x)**l * spherical_jn(l, np.abs(x))
+
+    ops_mat = [ ed.rep.sparse_matrix(op) for op in ops ]
+
+    for widx, iw in enumerate(prodmesh.components[0]):
+        for n1, n2 in [(0, 0), (1, -1), (-2, 0)]:
+            nu1, nu2 = [ (2 * n + 1) * np.pi / beta for n in [n1, n2] ]
+            iwn = np.array([[1j * nu1], [iw - 1j * nu1], [1j * nu2]])
+            g4_ref = ed.ed.get_frequency_two_particle_greens_function(iwn, ops_mat)
+            g4 = np.dot(T(nu1), np.dot(g4_l.data[widx, :, :, 0, 0, 0, 0], T(nu2)))
+            np.testing.assert_almost_equal(g4, g4_ref[0])
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_pruning():
+
+    ed, ops, tau = anderson_dimer_g4_tau(beta=20.0)
+
+    G4 = ed.get_g2_tau(tau, ops)
+
+    for tol in [1e-8, 1e-4]:
+        G4_pruned = ed.get_g2_tau_components(tau, [ops], prune_tol=tol)[0]
+        assert( ed.pruning_error_bound <= tol )
+        assert( np.max(np.abs(G4 - G4_pruned)) <= ed.pruning_error_bound )
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_truncated():
+
+    ed, ops, tau = anderson_dimer_g4_tau(beta=20.0)
+    ed_trunc, ops, tau = anderson_dimer_g4_tau(beta=20.0, nstates=1)
+
+    # -- Only the ground state, all intermediate states by Krylov propagation
+
+    G4 = ed.get_g2_tau(tau, ops)
+    G4_trunc = ed_trunc.get_g2_tau(tau, ops)
+
+    np.testing.assert_array_almost_equal(G4, G4_trunc, decimal=3)
+
+#----------------------------------------------------------------------
+def test_three_point_greens_function_truncated():
+
+    beta = 20.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+    ed_trunc = TriqsExactDiagonalization(
+        H, fundamental_operators, beta, nstates=1)
+
+    # -- O1 == O2, both triangles share one Krylov grid
+
+    n_up, n_do = c_dag(up,0) * c(up,0), c_dag(do,0) * c(do,0)
+
+    imtime = MeshImTime(beta, 'Boson', 8)
+    prodmesh = MeshProduct(imtime, imtime)
+
+    g3_tau = Gf(name='g3_tau', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+    g3_trunc = Gf(name='g3_trunc', mesh=prodmesh, target_shape=[1, 1, 1, 1])
+
+    ed.set_g3_tau(g3_tau, n_up, n_up, n_do)
+    ed_trunc.set_g3_tau(g3_trunc, n_up, n_up, n_do)
+
+    np.testing.assert_array_almost_equal(g3_tau.data, g3_trunc.data, decimal=3)
+
+#----------------------------------------------------------------------
+def test_three_point_kernel_nonuniform():
+
+    beta = 2.0
+    up, do = 0, 1
+    H, fundamental_operators = anderson_dimer()
+    ed = TriqsExactDiagonalization(H, fundamental_operators, beta)
+
+    ops = [ ed.rep.sparse_matrix(op) for op in
+            [c(up,0), c_dag(up,0), c_dag(do,0) * c(do,0)] ]
+    dops = [ np.asarray(dop) for dop in ed.ed._operators_to_eigenbasis(ops) ]
+    E = ed.ed.E
+
+    # -- Random ordered points, sharing t2 in groups larger than the chunk
+
+    np.random.seed(1234)
+    t2 = np.repeat(np.sort(np.random.uniform(0, beta, size=4)), 9)
+    t1 = t2 + np.random.uniform(0, 1, size=len(t2)) * (beta - t2)
+
+    G = ed.ed._timeordered_two_tau_kernel(
+        np.array([t1, t2]), dops, E, chunk_size=4)
+
+    e_a = np.exp(-(beta - t1)[:, None] * E[None, :])
+    e_b = np.exp(-(t1 - t2)[:, None] * E[None, :])
+    e_c = np.exp(-t2[:, None] * E[None, :])
+    G_ref = np.einsum('ta,ab,tb,bc,tc,ca->t', e_a, dops[0], e_b, dops[1], e_c, dops[2])
+
+    np.testing.assert_array_almost_equal(G, G_ref)
+
+#----------------------------------------------------------------------
+def test_two_particle_greens_function_single_precision():
+
+    ed, ops, tau = anderson_dimer_g4_tau(beta=10.0)
+    ed_single, ops, tau = anderson_dimer_g4_tau(beta=10.0, precision='single')
+
+    G4 = ed.get_g2_tau(tau, ops)
+    G4_single = ed_single.get_g2_tau(tau, ops)
+
+    np.testing.assert_array_almost_equal(G4, G4_single, decimal=5)
+
 #----------------------------------------------------------------------
 if __name__ == '__main__':
 
     test_two_particle_greens_function()
+    test_two_particle_greens_function_matrix()
+    test_two_particle_greens_function_points()
+    test_two_particle_greens_function_iw_nonint()
+    test_two_particle_greens_function_iw_interacting()
+    test_two_particle_greens_function_legendre()
+    test_two_particle_greens_function_pruning()
+    test_two_particle_greens_function_truncated()
+    test_three_point_greens_function_truncated()
+    test_three_point_kernel_nonuniform()
+    test_two_particle_greens_function_single_precision()